@@ -1 +1,15 @@
- 
+'''
+Freeode: the Siml compiler, and the runtime library of the generated 
+simulation programs.
+'''
+
+def compile_string(siml_text, file_name='<string>', module_name=None, 
+                   **options):
+    '''
+    Compile a Siml program and load it as a module, without writing files.
+    See: freeode.simlcompiler.compile_string
+    '''
+    #Imported here: the generated programs import this package, but they 
+    #don't need the compiler.
+    from freeode.simlcompiler import compile_string as compile_string_
+    return compile_string_(siml_text, file_name, module_name, **options)
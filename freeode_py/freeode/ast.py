@@ -594,6 +594,11 @@ class RoleIntermediateVariable(RoleVariable):
 class RoleAlgebraicVariable(RoleIntermediateVariable):
     '''The attribute is an algebraic variable'''
 #    userStr = 'algebraic_variable'
+class RoleTemporaryVariable(RoleIntermediateVariable):
+    '''
+    Variable that was created by the optimizer, to store an intermediate 
+    result. It is not an attribute of the simulation object.
+    '''
 class RoleOutputVariable(RoleVariable):
     '''
     This variable is a returned from the simulation function.
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2006 - 20010 by Eike Welk                                #
+#    eike.welk@gmx.net                                                     #
+#                                                                          #
+#    License: GPL                                                          #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 2 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+#                                                                          #
+#                                                                          #
+#    This Python module is the code generator of a compiler. The           #
+#    generated computer program shall be licensed under any license that   #
+#    the user of the compiler whishes. Even though the generated program   #
+#    is assembled from pieces of software of contained in this file.       #
+############################################################################
+
+'''
+Generator for C code.
+
+The differential equations (the dynamic function) are translated into a
+function in the C programming language, which is much faster than the
+equivalent Python function. The C function is embedded in the generated
+Python program, it is compiled with the system's C compiler when the
+simulation is run for the first time (see module clibrary). Everything
+else is the same as in the Python program, which is created by the
+module pygenerator.
+
+The highlevel wrapper class is CProgramGenerator.
+'''
+
+from __future__ import division
+from __future__ import absolute_import
+
+import cStringIO
+from freeode.util import UserException, func
+from freeode.ast import (NodeAssignment, NodeIfStmt, NodeExpressionStmt,
+                         RoleConstant)
+from freeode.interpreter import IFloat, IString, IBool, isrole, BUILTIN_LIB
+from freeode.pygenerator import (ExpressionGenerator, StatementGenerator,
+                                 SimulationClassGenerator, ProgramGenerator)
+
+
+
+class CExpressionGenerator(ExpressionGenerator):
+    '''
+    Take ILT sub-tree that describes a formula and
+    convert it into a formula in the C programming language.
+
+    Parameters are called p_<name>, all other variables v_<name>, only time
+    keeps its name. All binary operators are put into parentheses, because
+    the precedence rules of C and Python are different.
+    '''
+
+    #Table that maps functions to C functions (from math.h)
+    function_name = {BUILTIN_LIB.sin:'sin', BUILTIN_LIB.cos:'cos',
+                     BUILTIN_LIB.tan:'tan', BUILTIN_LIB.sqrt:'sqrt',
+                     BUILTIN_LIB.exp:'exp', BUILTIN_LIB.log:'log',
+                     BUILTIN_LIB.abs:'fabs',
+                     BUILTIN_LIB.min:'fmin' , BUILTIN_LIB.max:'fmax'}
+
+    #Table that maps functions to binary operators
+    binop_str = {func(IFloat.__add__):' + ',
+                 func(IFloat.__sub__):' - ',
+                 func(IFloat.__mul__):' * ',
+                 func(IFloat.__div__):' / ',
+                 func(IFloat.__lt__):' < ',
+                 func(IFloat.__gt__):' > ',
+                 func(IFloat.__le__):' <= ',
+                 func(IFloat.__ge__):' >= ',
+                 func(IFloat.__eq__):' == ', func(IBool.__eq__):' == ',
+                 func(IFloat.__ne__):' != ', func(IBool.__ne__):' != ',
+                 func(IBool.__siml_and2__):' && ',
+                 func(IBool.__siml_or2__):' || '}
+
+    #Binary operators that are functions in C
+    binop_func_name = {func(IFloat.__pow__):'pow',
+                       func(IFloat.__mod__):'siml_mod'}
+
+    #Table that maps functions to prefix operators
+    prefopt_str = {func(IFloat.__neg__):'-', func(IBool.__siml_not__):'!'}
+
+
+    def _create_graph_func_call(self, call):
+        '''The graph function can not be called from C.'''
+        raise UserException('The C code generator can not create a call to '
+                            'the graph function.', call.loc)
+
+
+    def _create_func_call(self, func_call):
+        '''Create C text for a call to a mathematical function.'''
+        func_name = self.function_name.get(func_call.function, None)
+        if func_name is None:
+            raise UserException('The C code generator does not know '
+                                'function: %s' % str(func_call.function),
+                                func_call.loc)
+        args = [self.create_expression(arg) for arg in func_call.arguments]
+        #min, max may have more than two arguments
+        ret_str = args[0]
+        if func_name in ('fmin', 'fmax'):
+            for arg in args[1:]:
+                ret_str = '%s(%s, %s)' % (func_name, ret_str, arg)
+            return ret_str
+        return func_name + '(' + ', '.join(args) + ')'
+
+
+    def _create_binop(self, func_call):
+        '''Create C text for infix operators: + - * / ** % and or'''
+        left = self.create_expression(func_call.arguments[0])
+        right = self.create_expression(func_call.arguments[1])
+        if func_call.function in self.binop_func_name:
+            return '%s(%s, %s)' % (self.binop_func_name[func_call.function],
+                                   left, right)
+        if func_call.function not in self.binop_str:
+            raise UserException('The C code generator does not know '
+                                'operator: %s' % str(func_call.function),
+                                func_call.loc)
+        return '(' + left + self.binop_str[func_call.function] + right + ')'
+
+
+    def _create_prefopt(self, func_call):
+        '''Create C text for prefix operators: - not'''
+        op_str = self.prefopt_str[func_call.function]
+        return op_str + '(' + self.create_expression(func_call.arguments[0]) + ')'
+
+
+    def _create_interpreter_obj(self, obj):
+        '''
+        Create C string that represents a variable or an immediate constant.
+        '''
+        if isrole(obj, RoleConstant):
+            if isinstance(obj, IFloat):
+                value = float(obj.value)
+                if value != value:
+                    return 'NAN'
+                elif value in (float('inf'), float('-inf')):
+                    return 'INFINITY' if value > 0 else '(-INFINITY)'
+                return repr(value)
+            elif isinstance(obj, IBool):
+                return '1' if obj.value else '0'
+            elif isinstance(obj, IString):
+                raise UserException('The C code generator can not create '
+                                    'strings.')
+            else:
+                raise Exception('Unknown type of immediate constant: '
+                                + str(type(obj)))
+        else:
+            return c_variable_name(obj)
+
+
+    def _create_parentheses(self, iltFormula):
+        #pair of prentheses: ( ... )
+        return '(' + self.create_expression(iltFormula.arguments[0]) + ')'
+
+
+
+def c_variable_name(obj):
+    '''
+    Return the name of a variable in the C code. Parameters are named
+    p_<name>, all other variables v_<name>; so that there are no collisions
+    with keywords and functions of C.
+    '''
+    name = obj.target_name
+    if name == 'time':
+        return name
+    elif name.startswith('param.'):
+        return 'p_' + name.split('.', 1)[1]
+    return 'v_' + name
+
+
+
+class CStatementGenerator(StatementGenerator):
+    '''
+    Generate statements in C from an ILT syntax tree.
+
+    Expression statements (print, graph, save) are not generated, because
+    the C function has no access to the Python runtime.
+    '''
+
+    def __init__(self, txt_buffer):
+        '''
+        ARGUMENT:
+            txt_buffer : File like object where the C program
+                        will be stored.
+        '''
+        super(CStatementGenerator, self).__init__(txt_buffer)
+        #Object that creates a formula from an AST sub-tree
+        self.genFormula = CExpressionGenerator()
+
+
+    def _create_assignment(self, assign_stmt, indent):
+        '''
+        Create fragment of C program for an assignment statement.
+        Called for: NodeAssignment
+        '''
+        self.write(indent + c_variable_name(assign_stmt.target) + ' = ' +
+                   self.create_expression(assign_stmt.expression) + ';\n')
+
+
+    def _create_if_stmt(self, if_stmt, indent):
+        '''
+        Create fragment of C program for an "if" statement.
+        Called for: NodeIfStmt
+        '''
+        ind4 = ' '*4
+        index_else = len(if_stmt.clauses) - 1
+        for index, clause  in enumerate(if_stmt.clauses):
+            if index == 0:
+                self.write(indent + 'if (%s) {\n'
+                           % self.create_expression(clause.condition))
+            elif index == index_else:
+                self.write(indent + '} else {\n')
+            else:
+                self.write(indent + '} else if (%s) {\n'
+                           % self.create_expression(clause.condition))
+            #write the statements of the clause
+            self.create_statements(clause.statements, indent + ind4)
+        self.write(indent + '}\n')
+
+
+    def _create_expression_stmt(self, iltStmt, indent):
+        '''
+        Expression statements (print(), graph(), store()) are not generated
+        in C. Called for: NodeExpressionStmt
+        '''
+        pass
+
+
+
+def find_assigned_variables(stmt_list, found=None):
+    '''
+    Return all variables that are assigned in a list of statements, also
+    inside of "if" statements. The order is the order of the assignments,
+    each variable appears only once.
+    '''
+    if found is None:
+        found = []
+    for stmt in stmt_list:
+        if isinstance(stmt, NodeAssignment):
+            #IFloat.__eq__ is a Siml operator, compare identity
+            if not [var for var in found if var is stmt.target]:
+                found.append(stmt.target)
+        elif isinstance(stmt, NodeIfStmt):
+            for clause in stmt.clauses:
+                find_assigned_variables(clause.statements, found)
+        elif isinstance(stmt, NodeExpressionStmt):
+            pass
+        else:
+            raise Exception('Unknown node in find_assigned_variables:\n'
+                            + str(stmt))
+    return found
+
+
+
+class CSimulationClassGenerator(SimulationClassGenerator):
+    '''
+    Create python class that simulates a process; the differential
+    equations are additionally translated to C.
+
+    The C source is stored in the class attribute cSource; the attribute
+    names of the parameters, in the order in which the C function expects
+    them, are stored in cParameterNames. See: SimulatorBase.rhsFunction
+    '''
+
+    def parameter_names_ordered(self):
+        '''
+        Return the parameters in the order of the parameter array of the C
+        function. (Sorted by Siml name; the hidden parameters, that are 
+        computed by the initialization functions and by the method 
+        derived_parameters, are at the end.)
+        '''
+        params = self.parameters.values()
+        params.sort(key=lambda node: node.siml_dot_name)
+        return params + self.param_deriv_params + \
+               [stmt.target for stmt in self.derived_param_statements]
+
+
+    def create_c_source(self):
+        '''
+        Create the C function that computes the differential equations:
+            void dynamic(double time, const double *y, const double *p,
+                         double *out)
+        y: state variables, p: parameters, out: time derivatives.
+        '''
+        out_c = cStringIO.StringIO()
+        write = out_c.write
+        ind4 = ' '*4
+        write('/* Differential equations of simulation class: %s */\n'
+              % self.class_py_name)
+        write('#include <math.h>\n\n')
+        write('/* Modulo operator with the semantics of Python */\n')
+        write('static double siml_mod(double a, double b)\n{\n')
+        write(ind4 + 'double r = fmod(a, b);\n')
+        write(ind4 + 'return (r != 0 && ((r < 0) != (b < 0))) ? r + b : r;\n')
+        write('}\n\n')
+        write('void dynamic(double time, const double *y, const double *p, '
+              'double *out)\n{\n')
+        #take the parameters out of the parameter vector
+        write(ind4 + '/* take the parameters out of the parameter vector */\n')
+        for n_param, param in enumerate(self.parameter_names_ordered()):
+            write(ind4 + 'double %s = p[%d];\n'
+                  % (c_variable_name(param), n_param))
+        #take the state variables out of the state vector
+        write(ind4 + '/* take the state variables out of the state vector */\n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            write(ind4 + 'double %s = y[%d];\n' % (c_variable_name(var), n_var))
+        #Create all other variables
+        write(ind4 + '/* create all other variables */\n')
+        state_vars = set(id(var) for var in self.state_variables_ordered)
+        params = set(id(param) for param in self.parameters.values())
+        for var in find_assigned_variables(self.rhs_statements):
+            if id(var) in state_vars or id(var) in params:
+                continue
+            write(ind4 + 'double %s = NAN;\n' % c_variable_name(var))
+        #emit the method's statements
+        write(ind4 + '/* do computations */\n')
+        stmtGen = CStatementGenerator(out_c)
+        stmtGen.create_statements(self.rhs_statements, ind4)
+        #put the time derivatives into the buffer
+        write(ind4 + '/* store the time derivatives in the buffer */\n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            write(ind4 + 'out[%d] = %s;\n'
+                  % (n_var, c_variable_name(var.time_derivative)))
+        write(ind4 + '(void)time; (void)p;\n')
+        write('}\n')
+        return out_c.getvalue()
+
+
+    def write_class_def_start(self):
+        '''
+        Write first few lines of class definition, and the C source of the
+        differential equations.
+        '''
+        SimulationClassGenerator.write_class_def_start(self)
+        if self.dynamic_statements is None:
+            return
+        ind4 = ' '*4
+        self.write(ind4 + '#Differential equations in C. '
+                          'See: SimulatorBase.rhsFunction \n')
+        self.write(ind4 + "cSource = r'''\n")
+        self.write(self.create_c_source())
+        self.write("'''\n")
+        self.write(ind4 + 'cParameterNames = [')
+        for param in self.parameter_names_ordered():
+            self.write("'%s', " % param.target_name.split('.', 1)[1])
+        self.write(']\n')
+        self.write('    \n')
+
+
+
+class CProgramGenerator(ProgramGenerator):
+    '''
+    Create a program from an ILT-tree, the differential equations are
+    computed by functions in C.
+    '''
+
+    def __init__(self, buffer_rhs=False, sensitivity_params=(),
+                 specialize=False):
+        '''
+        Arguments:
+            buffer_rhs : If True the dynamic methods (in Python) write the
+                         time derivatives into a preallocated buffer.
+            sensitivity_params : Names of parameters (str). The forward
+                         sensitivities with respect to these parameters
+                         are computed by the simulations.
+            specialize : If True the simulations use the parameter values
+                         as constants in the C code, which is compiled
+                         for each set of parameter values.
+        '''
+        ProgramGenerator.__init__(self, buffer_rhs, sensitivity_params,
+                                  specialize)
+        #create the simulation classes with C code
+        self.class_generator = CSimulationClassGenerator
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2006 - 2009 by Eike Welk                                #
+#    eike.welk@gmx.net                                                     #
+#                                                                          #
+#    License: LGPL                                                         #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU Library General Public License as       #
+#    published by the Free Software Foundation; either version 2 of the    #
+#    License, or (at your option) any later version.                       #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU Library General Public     #
+#    License along with this program; if not, write to the                 #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+'''
+Compile C code, that was generated by the Siml compiler (module cgenerator),
+into shared libraries, and load them with ctypes.
+
+The shared libraries are stored in a cache directory, the file names
+contain a hash of the C source, the compiler and its options. Each C source 
+is therefore only compiled once. The cache directory must belong to the 
+current user, and must not be writable by others; otherwise an other user 
+could put a library there, that would be loaded.
+
+This file is imported by the generated simulation programs,
+and not by the Siml compiler.
+'''
+
+
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import stat
+import ctypes
+import hashlib
+from subprocess import Popen, PIPE, STDOUT
+
+
+#Directory where the shared libraries are stored. None: use the default
+#directory in the user's cache directory: $XDG_CACHE_HOME or ~/.cache
+CACHE_DIR = None
+
+#The C compiler and its options; the environment variables CC and CFLAGS
+#override the defaults.
+C_COMPILER = os.environ.get('CC', 'cc')
+C_FLAGS = os.environ.get('CFLAGS', '-O2').split() + ['-shared', '-fPIC']
+
+#The libraries that were already loaded: {libraryKey(...): ctypes.CDLL}
+_loadedLibraries = {}
+
+
+
+class CBuildError(Exception):
+    '''The C compiler could not compile the generated code.'''
+    pass
+
+
+
+def cacheDirectory():
+    '''
+    Return the directory where the shared libraries are stored. It is 
+    created (only accessible by the current user) if necessary.
+    
+    Raises CBuildError if the directory belongs to an other user, or if 
+    other users can write into it.
+    '''
+    cache_dir = CACHE_DIR
+    if cache_dir is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+                     os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(cache_home, 'freeode', 'c-libraries')
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir, 0700)
+        except OSError:
+            if not os.path.isdir(cache_dir): #other process created it
+                raise
+    dir_stat = os.stat(cache_dir)
+    if hasattr(os, 'getuid') and dir_stat.st_uid != os.getuid():
+        raise CBuildError('The cache directory "%s" belongs to an other user.'
+                          % cache_dir)
+    if dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise CBuildError('The cache directory "%s" is writable by other users.'
+                          % cache_dir)
+    return cache_dir
+
+
+def libraryKey(c_source):
+    '''
+    Return the hash of C source code, the compiler and its options. 
+    The libraries in the cache directory are identified by it.
+    '''
+    return hashlib.sha1('\0'.join([C_COMPILER] + C_FLAGS + [c_source])
+                        ).hexdigest()
+
+
+def buildLibrary(c_source):
+    '''
+    Compile C source code to a shared library. If the library already
+    exists in the cache directory, it is not compiled again.
+
+    ARGUMENTS
+    ---------
+    c_source: str
+        The C source code.
+
+    RETURNS
+    -------
+    str: Name of the shared library.
+    '''
+    cache_dir = cacheDirectory()
+    lib_name = os.path.join(cache_dir, 'siml_%s.so' % libraryKey(c_source))
+    if os.path.exists(lib_name):
+        return lib_name
+    #write source and compile into files with unique names, then rename
+    #the library; concurrent processes may compile the same source.
+    tmp_name = '%s.%d' % (lib_name, os.getpid())
+    src_name = tmp_name + '.c'
+    src_file = open(src_name, 'w')
+    try:
+        src_file.write(c_source)
+    finally:
+        src_file.close()
+    try:
+        proc = Popen([C_COMPILER] + C_FLAGS + ['-o', tmp_name, src_name, '-lm'],
+                     stdout=PIPE, stderr=STDOUT)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise CBuildError('The C compiler "%s" failed:\n%s'
+                              % (C_COMPILER, output))
+        os.rename(tmp_name, lib_name)
+    except OSError, err:
+        raise CBuildError('The C compiler "%s" could not be run: %s'
+                          % (C_COMPILER, str(err)))
+    finally:
+        os.remove(src_name)
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return lib_name
+
+
+def loadLibrary(c_source):
+    '''
+    Compile C source code (if necessary), and load the shared library.
+
+    ARGUMENTS
+    ---------
+    c_source: str
+        The C source code.
+
+    RETURNS
+    -------
+    ctypes.CDLL: the shared library.
+    '''
+    key = libraryKey(c_source)
+    lib = _loadedLibraries.get(key, None)
+    if lib is None:
+        lib = ctypes.CDLL(buildLibrary(c_source))
+        _loadedLibraries[key] = lib
+    return lib
+
+
+def loadDynamicFunction(c_source):
+    '''
+    Load the C function that computes the differential equations:
+        void dynamic(double time, const double *y, const double *p,
+                     double *out)
+    The pointers must be given as integers (numpy.ndarray.ctypes.data).
+    '''
+    prototype = ctypes.CFUNCTYPE(None, ctypes.c_double, ctypes.c_void_p,
+                                 ctypes.c_void_p, ctypes.c_void_p)
+    return prototype(('dynamic', loadLibrary(c_source)))
+
+
+
+if __name__ == '__main__':
+    # Self-testing code goes here.
+    pass
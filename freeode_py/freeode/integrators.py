@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2006 - 2009 by Eike Welk                                #
+#    eike.welk@gmx.net                                                     #
+#                                                                          #
+#    License: LGPL                                                         #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU Library General Public License as       #
+#    published by the Free Software Foundation; either version 2 of the    #
+#    License, or (at your option) any later version.                       #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU Library General Public     #
+#    License along with this program; if not, write to the                 #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+'''
+ODE solvers written with Numpy: Runge-Kutta (RK4), Dormand-Prince with
+step size control (Dopri45), and Stoermer-Verlet (Verlet).
+
+The solvers have the interface of scipy.integrate.ode, that is used by
+SimulatorBase: set_initial_value(y, t), integrate(t), successful(), t, y
+
+The state may be a vector or a 2D array [variable, run]. With a 2D array
+many simulation runs (an ensemble) are computed together: one step of the
+solver advances all runs, and the right hand side is called once for all
+runs. The runs have a common time step; the step size control of Dopri45
+takes the run with the largest error into account.
+
+This file is imported by the generated simulation programs,
+and not by the Siml compiler.
+'''
+
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys
+
+from numpy import array, zeros, sqrt, abs, maximum, isfinite #IGNORE:W0622
+from numpy.random import RandomState
+
+
+
+class FixedStepSolver(object):
+    '''
+    Base class of the solvers with fixed step size.
+
+    The steps are shortened to hit the times that are given to
+    integrate(...) exactly. If stepSize is None, the solver takes one
+    step per call of integrate(...).
+    '''
+    def __init__(self, rhs, step=None):
+        '''
+        ARGUMENTS
+        ---------
+        rhs: function(time, state_vars)
+            Right hand side of the ODE.
+        step: float or None
+            Step size of the solver.
+        '''
+        object.__init__(self)
+        self.rhs = rhs
+        self.stepSize = step
+        '''Step size of the solver, None: one step per output interval'''
+        self.t = None
+        '''Current time'''
+        self.y = None
+        '''Current state: vector or array [variable, run]'''
+        self._success = True
+        self._n_rhs = 0
+        self._n_steps = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+
+    def set_initial_value(self, y, t=0.0):
+        '''Set initial conditions y(t) = y.'''
+        self.t = t
+        self.y = array(y, 'float64')
+        self._success = True
+        self._n_rhs = 0
+        self._n_steps = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+        return self
+
+    def integrate(self, t):
+        '''Integrate to time t, return the state at time t.'''
+        if not self._success:
+            return self.y
+        while self.t < t:
+            step = t - self.t
+            if self.stepSize is not None and self.stepSize < step * (1 - 1e-9):
+                step = self.stepSize
+            y_new = self._step(self.t, self.y, step)
+            if not isfinite(y_new).all():
+                print >> sys.stderr, 'error: solution is not finite at ' \
+                                     'time: %g' % self.t
+                self._success = False
+                return self.y
+            self._recordStep(step)
+            self.y = y_new
+            #hit the output time exactly
+            self.t = t if step == t - self.t else self.t + step
+        return self.y
+
+    def _step(self, t, y, h):
+        '''Compute one step of size h; return the new state.'''
+        raise NotImplementedError()
+
+    def _callRhs(self, t, y):
+        '''Call the right hand side, copy the result.'''
+        self._n_rhs += 1
+        return array(self.rhs(t, y), 'float64')
+
+    def _recordStep(self, step):
+        '''Update the statistics with an accepted step.'''
+        self._n_steps += 1
+        if step < self._step_min:
+            self._step_min = step
+        if step > self._step_max:
+            self._step_max = step
+
+    def successful(self):
+        '''Check if integration was successful.'''
+        return self._success
+
+    def statistics(self):
+        '''
+        Return statistics of the work done by the solver as a dict.
+        See: simulatorbase.solverStatistics
+        '''
+        stats = {'rhs_calls': self._n_rhs,
+                 'steps_accepted': self._n_steps}
+        if self._n_steps > 0:
+            stats['step_min'] = self._step_min
+            stats['step_max'] = self._step_max
+        return stats
+
+
+
+class RK4(FixedStepSolver):
+    '''The classical Runge-Kutta method of 4th order; fixed step size.'''
+    def _step(self, t, y, h):
+        '''Compute one step of size h; return the new state.'''
+        k1 = self._callRhs(t, y)
+        k2 = self._callRhs(t + h/2, y + h/2 * k1)
+        k3 = self._callRhs(t + h/2, y + h/2 * k2)
+        k4 = self._callRhs(t + h, y + h * k3)
+        return y + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+
+
+class Verlet(FixedStepSolver):
+    '''
+    Stoermer-Verlet method (leapfrog), 2nd order, fixed step size.
+
+    The method is symplectic, energy is conserved over long times.
+    It can only be used for separable systems: The state variables are
+    split into two groups (positions, velocities); the time derivatives
+    of each group may only depend on the variables of the other group:
+        $x = v;  $v = -k * x
+    The groups are found automatically, by changing the variables one by
+    one and observing which time derivatives change. A ValueError is
+    raised when the system is not separable (e.g. with friction).
+    '''
+    def __init__(self, rhs, step=None):
+        FixedStepSolver.__init__(self, rhs, step)
+        self.kickVars = None
+        '''Boolean array: the group of variables that is updated in two
+           half steps; the other group is updated in one full step.'''
+        self._dy = None
+
+    def set_initial_value(self, y, t=0.0):
+        '''Set initial conditions y(t) = y. Find the two groups.'''
+        FixedStepSolver.set_initial_value(self, y, t)
+        self.kickVars = self._findGroups(t, self.y)
+        self._dy = self._callRhs(t, self.y)
+        return self
+
+    def _findGroups(self, t, y):
+        '''
+        Split the variables into two groups, so that the time derivatives
+        of each group depend only on the other group.
+
+        RETURNS
+        -------
+        Boolean array; True for the variables of one group.
+        '''
+        n_vars = y.shape[0]
+        #Change the state randomly, to avoid accidental zeros in the
+        #derivatives (a product with a variable that is 0).
+        rand = RandomState(42).uniform(0.5, 1.0, y.shape)
+        y_base = y + 0.1 * rand * (abs(y) + 1)
+        dy_base = self._callRhs(t, y_base)
+        #neighbors[i]: variables that depend on variable i, or vice versa
+        neighbors = [set() for _ in range(n_vars)]
+        for i_var in range(n_vars):
+            y_probe = y_base.copy()
+            y_probe[i_var] *= 1.01
+            y_probe[i_var] += 0.01
+            changed = (self._callRhs(t, y_probe) != dy_base)
+            changed = changed.reshape((n_vars, -1)).any(axis=1)
+            for i_dep in changed.nonzero()[0]:
+                neighbors[i_var].add(i_dep)
+                neighbors[i_dep].add(i_var)
+        #Two-coloring of the dependency graph
+        group = [None] * n_vars
+        for i_start in range(n_vars):
+            if group[i_start] is not None:
+                continue
+            group[i_start] = False
+            todo = [i_start]
+            while todo:
+                i_var = todo.pop()
+                for i_nb in neighbors[i_var]:
+                    if group[i_nb] is None:
+                        group[i_nb] = not group[i_var]
+                        todo.append(i_nb)
+                    elif group[i_nb] == group[i_var]:
+                        raise ValueError(
+                            'The Verlet method needs a separable system: '
+                            'the time derivative of each variable may only '
+                            'depend on variables of the other group.')
+        return array(group, 'bool')
+
+    def _step(self, t, y, h):
+        '''Compute one step of size h; return the new state.'''
+        kick, drift = self.kickVars, ~self.kickVars
+        y = y.copy()
+        y[kick] += h/2 * self._dy[kick]
+        dy = self._callRhs(t + h/2, y)
+        y[drift] += h * dy[drift]
+        dy = self._callRhs(t + h, y)
+        y[kick] += h/2 * dy[kick]
+        #The derivatives of the kicked variables depend only on the other
+        #variables, they are still valid for the next step.
+        self._dy = dy
+        return y
+
+
+
+class Dopri45(object):
+    '''
+    The Dormand-Prince method of order 5(4) with step size control.
+
+    When the state is a 2D array [variable, run], the error is computed
+    separately for each run (root mean square over the variables), and
+    the largest error controls the common step size of all runs.
+    '''
+    #Coefficients of the Butcher tableau
+    c = [0, 1/5, 3/10, 4/5, 8/9, 1, 1]
+    a = [[],
+         [1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+         [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+    #Coefficients for the error: 5th order - 4th order solution
+    e = [71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+    def __init__(self, rhs, rtol=1e-6, atol=1e-12, nsteps=100000):
+        '''
+        ARGUMENTS
+        ---------
+        rhs: function(time, state_vars)
+            Right hand side of the ODE.
+        rtol, atol: float
+            Relative and absolute tolerance.
+        nsteps: int
+            Maximum number of steps per call of integrate(...)
+        '''
+        object.__init__(self)
+        self.rhs = rhs
+        self.rtol = rtol
+        self.atol = atol
+        self.nsteps = nsteps
+        self.t = None
+        '''Current time'''
+        self.y = None
+        '''Current state: vector or array [variable, run]'''
+        self._dy = None
+        self._h = None
+        self._success = True
+        self._n_rhs = 0
+        self._n_steps = 0
+        self._n_rejected = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+
+    def set_initial_value(self, y, t=0.0):
+        '''Set initial conditions y(t) = y.'''
+        self.t = t
+        self.y = array(y, 'float64')
+        self._success = True
+        self._n_rhs = 0
+        self._n_steps = 0
+        self._n_rejected = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+        self._dy = self._callRhs(t, self.y)
+        self._h = None
+        return self
+
+    def _callRhs(self, t, y):
+        '''Call the right hand side, copy the result.'''
+        self._n_rhs += 1
+        return array(self.rhs(t, y), 'float64')
+
+    def _errorNorm(self, err, y, y_new):
+        '''
+        Error relative to the tolerances. Root mean square over the
+        variables, maximum over the runs.
+        '''
+        scale = self.atol + self.rtol * maximum(abs(y), abs(y_new))
+        ratio = err / scale
+        n_vars = y.shape[0]
+        if n_vars == 0:
+            return 0.0
+        ratio = ratio.reshape((n_vars, -1))
+        return sqrt((ratio**2).sum(axis=0) / n_vars).max()
+
+    def _initialStep(self):
+        '''Guess the initial step size. (Hairer, Noersett, Wanner)'''
+        t, y, dy = self.t, self.y, self._dy
+        scale = self.atol + self.rtol * abs(y)
+        d0 = sqrt(((y / scale)**2).mean())
+        d1 = sqrt(((dy / scale)**2).mean())
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        dy1 = self._callRhs(t + h0, y + h0 * dy)
+        d2 = sqrt((((dy1 - dy) / scale)**2).mean()) / h0
+        if max(d1, d2) <= 1e-15:
+            h1 = max(1e-6, h0 * 1e-3)
+        else:
+            h1 = (0.01 / max(d1, d2)) ** (1/5)
+        return min(100 * h0, h1)
+
+    def integrate(self, t):
+        '''Integrate to time t, return the state at time t.'''
+        if not self._success:
+            return self.y
+        if self._h is None:
+            self._h = self._initialStep()
+        a, c, e = self.a, self.c, self.e
+        n_steps = 0
+        while self.t < t:
+            if n_steps >= self.nsteps:
+                print >> sys.stderr, 'error: too many steps (%d) at time: %g' \
+                                     % (n_steps, self.t)
+                self._success = False
+                return self.y
+            n_steps += 1
+            t0, y0 = self.t, self.y
+            h = min(self._h, t - t0)
+            if h <= abs(t0) * 1e-14:
+                print >> sys.stderr, 'error: step size too small at time: ' \
+                                     '%g' % t0
+                self._success = False
+                return self.y
+            #the stages; the last stage is the derivative at the new point
+            k = [self._dy]
+            for i_stage in range(1, 7):
+                y_stage = y0.copy()
+                for a_ij, k_j in zip(a[i_stage], k):
+                    if a_ij != 0:
+                        y_stage += h * a_ij * k_j
+                k.append(self._callRhs(t0 + c[i_stage] * h, y_stage))
+            y_new = y_stage
+            err = zeros(y0.shape, 'float64')
+            for e_j, k_j in zip(e, k):
+                if e_j != 0:
+                    err += h * e_j * k_j
+            err_norm = self._errorNorm(err, y0, y_new)
+            #new step size
+            if not isfinite(err_norm):
+                factor = 0.2
+            elif err_norm == 0:
+                factor = 10.0
+            else:
+                factor = min(10.0, max(0.2, 0.9 * err_norm ** (-1/5)))
+            if err_norm <= 1:
+                self._dy = k[6]
+                self.y = y_new
+                self.t = t if h == t - t0 else t0 + h
+                self._n_steps += 1
+                self._step_min = min(self._step_min, h)
+                self._step_max = max(self._step_max, h)
+                #a step, that was shortened to hit the output time, should
+                #not make the following steps shorter
+                if h < self._h:
+                    self._h = max(self._h, h * factor)
+                else:
+                    self._h = h * factor
+            else:
+                self._n_rejected += 1
+                self._h = h * min(factor, 1.0)
+        return self.y
+
+    def successful(self):
+        '''Check if integration was successful.'''
+        return self._success
+
+    def statistics(self):
+        '''
+        Return statistics of the work done by the solver as a dict.
+        See: simulatorbase.solverStatistics
+        '''
+        stats = {'rhs_calls': self._n_rhs,
+                 'steps_accepted': self._n_steps,
+                 'steps_rejected': self._n_rejected}
+        if self._n_steps > 0:
+            stats['step_min'] = self._step_min
+            stats['step_max'] = self._step_max
+        return stats
+
+
+
+if __name__ == '__main__':
+    # Self-testing code goes here.
+    pass
@@ -1304,8 +1304,10 @@ def siml_save(file_name): #pylint:disable-msg=W0613
     raise UnknownArgumentsException('Exception to create function call.')
 
 
-@signature([IFloat, IFloat], INoneType)
-def siml_solution_parameters(duration=None, reporting_interval=None): #pylint:disable-msg=W0613
+@signature([IFloat, IFloat, IString, IFloat, IFloat, IFloat], INoneType)
+def siml_solution_parameters(duration=None, reporting_interval=None, #pylint:disable-msg=W0613
+                             method=IString(''), rtol=IFloat(1e-6), 
+                             atol=IFloat(1e-12), step=IFloat(0)): 
     '''
     Set parameters for the solver (at run time).
 
@@ -1324,6 +1326,22 @@ def siml_solution_parameters(duration=None, reporting_interval=None): #pylint:di
     reporting_interval: Float
         Interval at which the simulation results are recorded.
         Time between data points
+        
+    method: String
+        Name of the ODE solver. For example: "vode", "lsoda", "dopri5", 
+        "dop853", "RK45", "Radau", "BDF", "LSODA", "rk4", "dopri45", 
+        "verlet". 
+        The empty string means: choose solver automatically.
+        
+    rtol: Float
+        Relative tolerance of the ODE solver.
+        
+    atol: Float
+        Absolute tolerance of the ODE solver.
+        
+    step: Float
+        Step size of the fixed step solvers ("rk4", "verlet"). 
+        0 means: one step per reporting interval.
     '''
     raise UnknownArgumentsException('Exception to create function call.')
 
@@ -40,13 +40,15 @@ from __future__ import absolute_import              #IGNORE:W0410
 from freeode.ast import (NodeParentheses, NodeExpressionStmt,
                          NodeFuncCall, NodeAssignment, NodeIfStmt, NodeClause, 
                          RoleConstant, RoleParameter, RoleInputVariable, 
-                         RoleOutputVariable, RoleIntermediateVariable)
+                         RoleOutputVariable, RoleIntermediateVariable, 
+                         RoleAlgebraicVariable, RoleTemporaryVariable)
 from freeode.interpreter import (InterpreterObject, SimlFunction,
                                  CodeGeneratorObject, CompiledClass,
+                                 IFloat, IBool, IString, BUILTIN_LIB,
                                  isrole, 
                                  isknownconst,
                                  )
-from freeode.util import UserException, DotName
+from freeode.util import UserException, DotName, func
 
 
 
@@ -475,7 +477,621 @@ class VariableUsageChecker(object):
 #    def check_function(self, function):
 #        self.check_statement_list(function.statements)
     
+
+
+class SymbolicDifferentiator(object):
+    '''
+    Compute derivatives of the statements of a main function symbolically.
+    (Forward mode of automatic differentiation.)
+    
+    For each assignment statement "v = expr" and each independent variable 
+    "s" (usually a state variable) an additional assignment "dv_ds = ..." is 
+    created. Derivatives that are always zero are not computed. In "if" 
+    statements the derivatives are set to zero explicitly, in clauses where 
+    they are zero, but nonzero in other clauses.
+    
+    The derivatives are stored in new variables (IFloat) that are not 
+    attributes of the simulation object. They get a Python name that is 
+    derived from the names of the variables.  Therefore the differentiation 
+    must be done after the code generator has created the Python names.
+    
+    Usage:
+    ------
+    diff = SymbolicDifferentiator()
+    stmts, jac = diff.create_jacobian(dynamic_func.statements, 
+                                      [time_derivative, ...],
+                                      [state_var, ...])
+    '''
+    #Constants that are used in derivatives
+    ZERO = IFloat(0)
+    ONE = IFloat(1)
+    TWO = IFloat(2)
+    
+    def __init__(self):
+        object.__init__(self)
+        #The derivative variables: dict: (variable, independent_var) -> IFloat
+        self.deriv_vars = {}
+        #The currently nonzero derivatives:  
+        #dict: variable -> {independent_var: IFloat}
+        self.deriv_known = {}
+        #The independent variables
+        self.independent_vars = []
+        #Put expression statements (print, graph, ...) into the result
+        self.keep_expression_stmts = False
+        
+        
+    #------------ build expressions ------------------------------------------
+    @staticmethod
+    def _paren(expr):
+        '''Put parentheses around compound expressions.'''
+        if isinstance(expr, (NodeFuncCall)):
+            return NodeParentheses((expr,))
+        return expr
+    
+    @staticmethod
+    def _iszero(expr):
+        '''Test if expression is known to be zero.'''
+        return expr is None or (isknownconst(expr) and expr.value == 0)
+    
+    @staticmethod
+    def _isone(expr):
+        '''Test if expression is the constant 1.'''
+        return isknownconst(expr) and expr.value == 1
+    
+    def _call(self, function, *args):
+        '''Create a function call, put parentheses around the arguments.'''
+        return NodeFuncCall(function, tuple(self._paren(a) for a in args), {})
+    
+    def _add(self, a, b):
+        '''a + b; None means zero'''
+        if self._iszero(a):
+            return None if self._iszero(b) else b
+        if self._iszero(b):
+            return a
+        return NodeFuncCall(func(IFloat.__add__), (a, self._paren(b)), {})
+    
+    def _sub(self, a, b):
+        '''a - b; None means zero'''
+        if self._iszero(b):
+            return None if self._iszero(a) else a
+        if self._iszero(a):
+            return self._neg(b)
+        return NodeFuncCall(func(IFloat.__sub__), (a, self._paren(b)), {})
+
+    def _neg(self, a):
+        '''-a; None means zero'''
+        if self._iszero(a):
+            return None
+        return self._call(func(IFloat.__neg__), a)
+    
+    def _mul(self, a, b):
+        '''a * b; None means zero'''
+        if self._iszero(a) or self._iszero(b):
+            return None
+        if self._isone(a):
+            return b
+        if self._isone(b):
+            return a
+        return self._call(func(IFloat.__mul__), a, b)
+    
+    def _indicator(self, cmp_func, a, b):
+        '''
+        Comparison converted to number: 1.0 if the comparison is true, 
+        0.0 otherwise. 
+        '''
+        comparison = self._call(cmp_func, a, b)
+        return self._call(func(IFloat.__mul__), comparison, self.ONE)
+    
+    def _div(self, a, b):
+        '''a / b; None means zero'''
+        if self._iszero(a):
+            return None
+        if self._isone(b):
+            return a
+        return self._call(func(IFloat.__div__), a, b)
+    
+    
+    #------------ differentiate expressions ----------------------------------
+    def diff_expr(self, expr, wrt):
+        '''
+        Differentiate an expression with respect to one variable.
+        (recursive)
+        
+        ARGUMENTS
+        ---------
+        expr: NodeFuncCall, NodeParentheses, IFloat
+            The expression that is differentiated.
+        wrt: IFloat
+            Differentiate with respect to this variable.
+            
+        RETURNS
+        -------
+        Expression for the derivative, or None if the derivative is zero.
+        '''
+        if isinstance(expr, NodeParentheses):
+            return self._paren(self.diff_expr(expr.arguments[0], wrt))
+        elif isinstance(expr, CodeGeneratorObject):
+            if expr is wrt:
+                return self.ONE
+            return self.deriv_known.get(expr, {}).get(wrt, None)
+        elif isinstance(expr, NodeFuncCall):
+            return self._diff_func_call(expr, wrt)
+        else:
+            raise Exception('Unexpected node in expression. type: %s; value: %s' 
+                            % (str(type(expr)), str(expr)))
+        
+        
+    #Functions with results of type Bool and String; their derivative is 0
+    non_float_funcs = set([func(IFloat.__lt__), func(IFloat.__gt__), 
+                           func(IFloat.__le__), func(IFloat.__ge__),
+                           func(IFloat.__eq__), func(IFloat.__ne__),
+                           func(IBool.__eq__), func(IBool.__ne__),
+                           func(IBool.__siml_and2__), func(IBool.__siml_or2__),
+                           func(IBool.__siml_not__),
+                           func(IString.__add__), func(IString.__eq__), 
+                           func(IString.__ne__), func(IFloat.__siml_str__), 
+                           func(IString.__siml_str__), func(IBool.__siml_str__)])
+    
+    def _diff_func_call(self, call, wrt):
+        '''Differentiate a function call; apply chain rule.'''
+        fn = call.function
+        if fn in self.non_float_funcs:
+            return None
+        args = call.arguments
+        a = args[0]
+        da = self.diff_expr(a, wrt)
+        if len(args) == 2:
+            b = args[1]
+            db = self.diff_expr(b, wrt)
+            if self._iszero(da) and self._iszero(db):
+                return None
+        elif self._iszero(da):
+            return None
+        
+        if fn is func(IFloat.__add__):
+            return self._add(da, db)
+        elif fn is func(IFloat.__sub__):
+            return self._sub(da, db)
+        elif fn is func(IFloat.__mul__):
+            return self._add(self._mul(da, b), self._mul(a, db))
+        elif fn is func(IFloat.__div__):
+            #d(a/b) = da/b - a*db/b**2
+            return self._sub(self._div(da, b), 
+                             self._div(self._mul(a, db), self._mul(b, b)))
+        elif fn is func(IFloat.__mod__):
+            #a % b = a - floor(a/b)*b; floor(a/b) = (a - a % b)/b
+            return self._sub(da, self._mul(self._div(self._sub(a, call), b), 
+                                           db))
+        elif fn is func(IFloat.__pow__):
+            #d(a**b) = b * a**(b-1) * da + a**b * log(a) * db
+            d_base = self._mul(self._mul(b, self._call(fn, a, self._sub(b, self.ONE))),
+                               da)
+            d_exp = self._mul(self._mul(call, self._call(BUILTIN_LIB.log, a)), db)
+            return self._add(d_base, d_exp)
+        elif fn is func(IFloat.__neg__):
+            return self._neg(da)
+        elif fn is BUILTIN_LIB.sin:
+            return self._mul(self._call(BUILTIN_LIB.cos, a), da)
+        elif fn is BUILTIN_LIB.cos:
+            return self._neg(self._mul(self._call(BUILTIN_LIB.sin, a), da))
+        elif fn is BUILTIN_LIB.tan:
+            return self._div(da, self._call(func(IFloat.__pow__), 
+                                            self._call(BUILTIN_LIB.cos, a), 
+                                            self.TWO))
+        elif fn is BUILTIN_LIB.sqrt:
+            return self._div(da, self._mul(self.TWO, call))
+        elif fn is BUILTIN_LIB.exp:
+            return self._mul(call, da)
+        elif fn is BUILTIN_LIB.log:
+            return self._div(da, a)
+        elif fn is BUILTIN_LIB.abs:
+            #sign(a) * da; the comparison results are converted to numbers 
+            sign = self._sub(self._indicator(func(IFloat.__gt__), a, self.ZERO), 
+                             self._indicator(func(IFloat.__lt__), a, self.ZERO))
+            return self._mul(sign, da)
+        elif fn is BUILTIN_LIB.min:
+            #derivative of the smaller argument
+            return self._add(
+                self._mul(self._indicator(func(IFloat.__le__), a, b), da), 
+                self._mul(self._indicator(func(IFloat.__gt__), a, b), db))
+        elif fn is BUILTIN_LIB.max:
+            #derivative of the bigger argument
+            return self._add(
+                self._mul(self._indicator(func(IFloat.__ge__), a, b), da), 
+                self._mul(self._indicator(func(IFloat.__lt__), a, b), db))
+        else:
+            raise Exception('Can not differentiate function: %s' % str(fn))
+        
+        
+    #------------ differentiate statements -----------------------------------
+    def _get_deriv_var(self, var, wrt):
+        '''Return the variable where the derivative dvar/dwrt is stored.'''
+        key = (var, wrt)
+        if key not in self.deriv_vars:
+            deriv = IFloat()
+            deriv.__siml_role__ = RoleAlgebraicVariable
+            if isrole(var, RoleTemporaryVariable):
+                deriv.__siml_role__ = RoleTemporaryVariable
+            deriv.target_name = 'd_%s__d_%s' % (var.target_name.replace('.', '_'), 
+                                                wrt.target_name.replace('.', '_'))
+            self.deriv_vars[key] = deriv
+        return self.deriv_vars[key]
+    
+    
+    def _copy_deriv_known(self):
+        '''Copy the dict of currently nonzero derivatives.'''
+        return dict((var, dict(derivs)) 
+                    for var, derivs in self.deriv_known.iteritems())
+    
+    
+    def diff_assignment(self, assignment):
+        '''
+        Create the assignments for the derivatives of the target. 
+        Returns list of statements. The original statement is included.
+        '''
+        target = assignment.target
+        new_stmts = [assignment]
+        derivs = {}
+        for wrt in self.independent_vars:
+            d_expr = self.diff_expr(assignment.expression, wrt)
+            if self._iszero(d_expr):
+                continue
+            deriv_var = self._get_deriv_var(target, wrt)
+            new_stmts.append(NodeAssignment(deriv_var, d_expr, assignment.loc))
+            derivs[wrt] = deriv_var
+        self.deriv_known[target] = derivs
+        return new_stmts
+    
+    
+    def diff_if_statement(self, if_stmt):
+        '''
+        Create an "if" statement that additionally computes the derivatives.
+        Derivatives, that are nonzero in any clause, are computed in all 
+        clauses. 
+        '''
+        deriv_start = self._copy_deriv_known()
+        new_clauses, clause_derivs = [], []
+        for clause in if_stmt.clauses:
+            self.deriv_known = dict((var, dict(derivs)) 
+                                    for var, derivs in deriv_start.iteritems())
+            stmts = self.diff_statement_list(clause.statements)
+            new_clauses.append(NodeClause(clause.condition, stmts, 
+                                          clause.runtime_if, clause.loc))
+            clause_derivs.append(self.deriv_known)
+        #compute union of the nonzero derivatives of all clauses
+        deriv_union = {}
+        for derivs in clause_derivs:
+            for var, var_derivs in derivs.iteritems():
+                union = deriv_union.setdefault(var, {})
+                for wrt, deriv_var in var_derivs.iteritems():
+                    #clauses store the derivative in different variables
+                    if union.setdefault(wrt, deriv_var) is not deriv_var:
+                        union[wrt] = self._get_deriv_var(var, wrt)
+        #Set derivatives to zero, where they are zero in a clause. 
+        #Copy them, where a clause stores them in a different variable.
+        get_name = lambda attr: attr.target_name
+        for clause, derivs in zip(new_clauses, clause_derivs):
+            for var in sorted(deriv_union, key=get_name):
+                for wrt in sorted(deriv_union[var], key=get_name):
+                    deriv_var = deriv_union[var][wrt]
+                    deriv = derivs.get(var, {}).get(wrt, None)
+                    if deriv is not deriv_var:
+                        clause.statements.append(
+                                NodeAssignment(deriv_var, 
+                                               deriv if deriv is not None 
+                                               else self.ZERO, clause.loc))
+        self.deriv_known = deriv_union
+        return NodeIfStmt(new_clauses, if_stmt.runtime_if, if_stmt.loc)
+    
+    
+    def diff_statement_list(self, stmt_list):
+        '''
+        Create list of statements, that additionally computes the derivatives.
+        Expression statements (print, graph, ...) are omitted, unless 
+        self.keep_expression_stmts is True.
+        '''
+        new_stmts = []
+        for stmt in stmt_list:
+            if isinstance(stmt, NodeAssignment):
+                new_stmts += self.diff_assignment(stmt)
+            elif isinstance(stmt, NodeIfStmt):
+                new_stmts.append(self.diff_if_statement(stmt))
+            elif isinstance(stmt, NodeExpressionStmt):
+                if self.keep_expression_stmts:
+                    new_stmts.append(stmt)
+            else:
+                raise Exception('Unexpected type of statement '
+                                'type: %s; value: %s' 
+                                % (str(type(stmt)), str(stmt)))
+        return new_stmts
     
+    
+    def create_derivatives(self, stmt_list, independent_vars):
+        '''
+        Create statements that compute the original statements' results
+        and their derivatives with respect to the independent variables.
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            Statements of a main function.
+        independent_vars: [IFloat]
+            Compute derivatives with respect to these variables. 
+            
+        RETURNS
+        -------
+        List of statements. Use get_derivative(...) to find the variables 
+        where the derivatives are stored.
+        '''
+        self.__init__()
+        self.independent_vars = list(independent_vars)
+        return self.diff_statement_list(stmt_list)
+        
+        
+    def get_derivative(self, var, wrt):
+        '''
+        Return the variable, that contains the derivative dvar/dwrt, 
+        after the statements created by create_derivatives(...) are executed. 
+        Returns None if the derivative is zero.
+        '''
+        return self.deriv_known.get(var, {}).get(wrt, None)
+    
+    
+    def create_jacobian(self, stmt_list, functions, state_vars):
+        '''
+        Create statements that compute the Jacobian matrix of a system of 
+        differential equations.
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            Statements of the dynamic function.
+        functions: [IFloat]
+            The time derivatives (the right hand side of the ODE)
+        state_vars: [IFloat]
+            The state variables.
+            
+        RETURNS
+        -------
+        stmt_list: [Node]
+            Statements that compute the Jacobian's elements.
+        jacobian: [[IFloat or None]]
+            jacobian[i][j] is the variable that contains 
+            d functions[i] / d state_vars[j]; None if the element is 
+            always zero.
+        '''
+        stmts = self.create_derivatives(stmt_list, state_vars)
+        jacobian = [[self.get_derivative(fn, var) for var in state_vars]
+                    for fn in functions]
+        return stmts, jacobian
+    
+    
+    def _set_param_derivs(self, param_derivs):
+        '''
+        Make the derivatives of parameters, that are computed in the 
+        initialization functions, known. (See create_initial_sensitivities.)
+        '''
+        for var, derivs in (param_derivs or {}).iteritems():
+            self.deriv_known[var] = dict(derivs)
+    
+    
+    def create_sensitivities(self, stmt_list, functions, state_vars, params, 
+                             param_derivs=None):
+        '''
+        Create statements that compute the right hand side of the forward 
+        sensitivity equations: 
+            d/dt s[i][k] = sum_j df_i/dx_j * s[j][k] + df_i/dp_k
+        with s[i][k] = d state_vars[i] / d params[k]. 
+        
+        The state variables depend on the parameters; their derivatives 
+        with respect to the parameters are the sensitivities s[i][k], 
+        which become additional state variables.
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            Statements of the dynamic function.
+        functions: [IFloat]
+            The time derivatives (the right hand side of the ODE)
+        state_vars: [IFloat]
+            The state variables.
+        params: [IFloat]
+            The parameters.
+        param_derivs: {IFloat: {IFloat: IFloat}} or None
+            Parameters that are computed from the parameters in params by 
+            the initialization functions: param_derivs[k][p] is the hidden 
+            parameter that contains d k / d p.
+            
+        RETURNS
+        -------
+        stmt_list: [Node]
+            The original statements, and the statements that compute the 
+            time derivatives of the sensitivities.
+        sensitivities: [[IFloat]]
+            sensitivities[i][k] is the variable for d state_vars[i] / d params[k]
+        sens_functions: [[IFloat or None]]
+            sens_functions[i][k] is the variable that contains the time 
+            derivative of sensitivities[i][k]; None if it is always zero.
+        '''
+        self.__init__()
+        self.independent_vars = list(params)
+        self._set_param_derivs(param_derivs)
+        sensitivities = [[self._get_deriv_var(var, param) for param in params]
+                         for var in state_vars]
+        for var, var_sens in zip(state_vars, sensitivities):
+            self.deriv_known[var] = dict(zip(params, var_sens))
+        stmts = self.diff_statement_list(stmt_list)
+        sens_functions = [[self.get_derivative(fn, param) for param in params]
+                          for fn in functions]
+        return stmts, sensitivities, sens_functions
+    
+    
+    def create_initial_sensitivities(self, stmt_list, state_vars, params, 
+                                     param_derivs=None):
+        '''
+        Create statements that compute the initial values of the forward
+        sensitivities: d state_vars[i] / d params[k] at the start of the 
+        simulation. 
+        
+        Parameters can be computed from the parameters in params (k = 2*r). 
+        Their derivatives are stored in hidden parameters (param_derivs), 
+        so that the sensitivity equations can use them. When a parameter in 
+        param_derivs is assigned, statements that store its derivatives are 
+        appended. Use get_derivative(...) to find parameters whose 
+        derivatives are nonzero, and which are not yet in param_derivs.
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            Statements of an initialization function. 
+        state_vars: [IFloat]
+            The state variables.
+        params: [IFloat]
+            The parameters.
+        param_derivs: {IFloat: {IFloat: IFloat}} or None
+            Parameters that are computed from the parameters in params: 
+            param_derivs[k][p] is the hidden parameter for d k / d p.
+            
+        RETURNS
+        -------
+        stmt_list: [Node]
+            The original statements (including expression statements), 
+            and the statements that compute the derivatives.
+        init_sens: [[IFloat or None]]
+            init_sens[i][k] is the variable that contains the initial value 
+            of d state_vars[i] / d params[k]; None if it is zero. 
+            It has the same name as the sensitivity created by 
+            create_sensitivities(...).
+        '''
+        self.__init__()
+        self.keep_expression_stmts = True
+        self.independent_vars = list(params)
+        self._set_param_derivs(param_derivs)
+        stmts = self.diff_statement_list(stmt_list)
+        #store the derivatives of the assigned parameters
+        get_name = lambda attr: attr.target_name
+        param_derivs = param_derivs or {}
+        for var in sorted(param_derivs, key=get_name):
+            for wrt in sorted(param_derivs[var], key=get_name):
+                deriv_param = param_derivs[var][wrt]
+                deriv = self.get_derivative(var, wrt)
+                if deriv is deriv_param: 
+                    continue #parameter is not assigned
+                stmts.append(NodeAssignment(deriv_param, 
+                                            deriv if deriv is not None 
+                                            else self.ZERO, None))
+        init_sens = [[self.get_derivative(var, param) for param in params]
+                     for var in state_vars]
+        return stmts, init_sens
+
+
+
+def compute_jacobian_sparsity(main_func, state_vars, functions, 
+                              statements=None):
+    '''
+    Compute which functions depend on which state variables. 
+    (Sparsity pattern of the Jacobian matrix.)
+    
+    The dependencies are computed from the data flow decorations 
+    (inputs, outputs) of the assignments in the function. Conditions of 
+    "if" statements are ignored, because the Jacobian does not depend on 
+    them (except at the switching points); this is consistent with the 
+    Jacobian computed by SymbolicDifferentiator.
+    
+    ARGUMENTS
+    ---------
+    main_func: SimlFunction
+        The dynamic function. It is decorated by MakeDataFlowDecorations
+        if necessary.
+    state_vars: [IFloat]
+        The state variables.
+    functions: [IFloat]
+        The time derivatives (the right hand side of the ODE)
+    statements: [Node] or None
+        Statements that are used instead of the dynamic function's 
+        statements (for example with sensitivity equations). They are 
+        decorated by MakeDataFlowDecorations.
+        
+    RETURNS
+    -------
+    List of (row, column) index pairs of the nonzero elements; 
+    row: index into functions, column: index into state_vars.
+    '''
+    if statements is not None:
+        MakeDataFlowDecorations().decorate_statement_list(statements)
+    else:
+        if not hasattr(main_func, 'inputs'):
+            MakeDataFlowDecorations().decorate_main_function(main_func)
+        statements = main_func.statements
+        
+    def propagate(stmt_list, deps):
+        '''Compute the state variables on which each variable depends.'''
+        for stmt in stmt_list:
+            if isinstance(stmt, NodeAssignment):
+                stmt_deps = set()
+                for inp in stmt.inputs:
+                    stmt_deps.update(deps.get(inp, ()))
+                deps[stmt.target] = stmt_deps
+            elif isinstance(stmt, NodeIfStmt):
+                #Variables depend on the union of all clauses' dependencies
+                deps_start = dict(deps)
+                deps.clear()
+                for clause in stmt.clauses:
+                    clause_deps = dict(deps_start)
+                    propagate(clause.statements, clause_deps)
+                    for var, var_deps in clause_deps.iteritems():
+                        deps[var] = deps.get(var, set()) | var_deps
+                        
+    #dict: variable -> set of indices of state variables
+    deps = dict((var, set([i])) for i, var in enumerate(state_vars))
+    propagate(statements, deps)
+    sparsity = []
+    for row, fn in enumerate(functions):
+        for col in sorted(deps.get(fn, ())):
+            sparsity.append((row, col))
+    return sparsity
+
+
+
+def find_dependent_variables(sim_obj, variables):
+    '''
+    Find the variables that are computed from the given variables by the 
+    initialization functions (initialize, init_*). Indirect dependencies 
+    are found too; variables that are assigned in an "if" statement depend 
+    on all inputs of the "if" statement.
+    
+    ARGUMENTS
+    ---------
+    sim_obj: CompiledClass
+        The simulation object.
+    variables: [IFloat]
+        The variables, for example parameters for sensitivity analysis.
+        
+    RETURNS
+    -------
+    Set of the variables, and all variables that depend on them.
+    '''
+    deco = MakeDataFlowDecorations()
+    init_funcs = []
+    for name, attr in sim_obj.attributes.iteritems():
+        if isinstance(attr, SimlFunction) and (str(name) == 'initialize' or 
+                                               str(name).startswith('init_')):
+            if not hasattr(attr, 'inputs'):
+                deco.decorate_main_function(attr)
+            init_funcs.append(attr)
+    
+    dependent = set(variables)
+    n_dependent = -1
+    while n_dependent != len(dependent):
+        n_dependent = len(dependent)
+        for init_func in init_funcs:
+            for stmt in init_func.statements:
+                if stmt.inputs & dependent:
+                    dependent.update(stmt.outputs)
+    return dependent
+
+
+
 def check_simulation_objects(obj_list):
     '''
     Check a list of simulation objects for errors. Raises UserException when
@@ -487,3 +1103,576 @@ def check_simulation_objects(obj_list):
     for sim_obj in obj_list:
         deco.decorate_simulation_object(sim_obj)
         check.check_simulation_object(sim_obj)
+
+
+
+class CommonSubexpressionEliminator(object):
+    '''
+    Compute expressions, that appear several times in a main function, 
+    only once. (Common subexpression elimination.)
+    
+    Each statement list (function body, clause of "if" statement) is 
+    treated separately; but the clauses of "if" statements use the 
+    temporary variables of the enclosing statement list. Identical 
+    sub-expressions (function calls with the same function and the same 
+    arguments) are found with hash consing: every expression gets a key, 
+    that is built from the keys of its arguments. Variables are identified 
+    by their identity and a version number, which is incremented when the 
+    variable is assigned. 
+    
+    A repeated expression is computed once in a new temporary variable 
+    (role RoleTemporaryVariable), in an assignment before the statement 
+    where the expression appears first. The expressions are then replaced 
+    by the temporary variable. Only expressions that result in a Float are 
+    moved. The right operand of "and", "or" and the conditions of "elif" 
+    clauses are not searched, because they are not always evaluated.
+    
+    Usage:
+    ------
+    cse = CommonSubexpressionEliminator()
+    cse.eliminate_simulation_object(sim_obj)
+    '''
+    #Functions with a Float result, only calls of them are moved.
+    float_funcs = set([func(IFloat.__add__), func(IFloat.__sub__), 
+                       func(IFloat.__mul__), func(IFloat.__div__), 
+                       func(IFloat.__mod__), func(IFloat.__pow__), 
+                       func(IFloat.__neg__), 
+                       BUILTIN_LIB.sin, BUILTIN_LIB.cos, BUILTIN_LIB.tan, 
+                       BUILTIN_LIB.sqrt, BUILTIN_LIB.exp, BUILTIN_LIB.log, 
+                       BUILTIN_LIB.abs, BUILTIN_LIB.min, BUILTIN_LIB.max])
+    #Functions whose second argument is not always evaluated
+    short_circuit_funcs = set([func(IBool.__siml_and2__), 
+                               func(IBool.__siml_or2__)])
+    
+    def __init__(self):
+        object.__init__(self)
+        #Version number of each variable; incremented by assignments.
+        #dict: variable -> int
+        self.versions = {}
+        #Number of temporary variables, to create unique names
+        self.num_temps = 0
+        
+        
+    def expr_key(self, expr):
+        '''
+        Compute the key of an expression (recursive). Identical expressions
+        have the same key; parentheses are ignored.
+        '''
+        if isinstance(expr, NodeParentheses):
+            return self.expr_key(expr.arguments[0])
+        elif isinstance(expr, NodeFuncCall):
+            return ('call', expr.function, 
+                    tuple(self.expr_key(arg) for arg in expr.arguments), 
+                    tuple(sorted((name, self.expr_key(arg)) for name, arg 
+                                 in expr.keyword_arguments.iteritems())))
+        elif isknownconst(expr):
+            return ('const', type(expr), expr.value)
+        else:
+            return ('var', id(expr), self.versions.get(expr, 0))
+        
+        
+    def _evaluated_subexpressions(self, expr, repeated=None, seen=None):
+        '''
+        Iterate over the function calls, that are always evaluated when 
+        expr is evaluated. Yields tuples: (key, call)
+        
+        When the sets repeated and seen are given: the arguments of calls,
+        whose key is in repeated, are only visited at their first 
+        appearance (key not in seen); the keys are put into seen.
+        '''
+        if isinstance(expr, NodeParentheses):
+            for item in self._evaluated_subexpressions(expr.arguments[0], 
+                                                       repeated, seen):
+                yield item
+        elif isinstance(expr, NodeFuncCall):
+            key = self.expr_key(expr)
+            yield key, expr
+            if repeated is not None and key in repeated:
+                if key in seen:
+                    return
+                seen.add(key)
+            args = list(expr.arguments) + expr.keyword_arguments.values()
+            if expr.function in self.short_circuit_funcs:
+                args = args[0:1]
+            for arg in args:
+                for item in self._evaluated_subexpressions(arg, repeated, 
+                                                           seen):
+                    yield item
+                    
+                    
+    def _statement_expressions(self, stmt):
+        '''The expressions of a statement that are always evaluated.'''
+        if isinstance(stmt, NodeAssignment):
+            return [stmt.expression]
+        elif isinstance(stmt, NodeExpressionStmt):
+            return [stmt.expression]
+        elif isinstance(stmt, NodeIfStmt):
+            return [stmt.clauses[0].condition]
+        else:
+            raise Exception('Unexpected type of statement '
+                            'type: %s; value: %s' 
+                            % (str(type(stmt)), str(stmt)))
+            
+            
+    def _update_versions(self, stmt):
+        '''Increment the version of the variables that stmt assigns.'''
+        if isinstance(stmt, NodeAssignment):
+            self.versions[stmt.target] = self.versions.get(stmt.target, 0) + 1
+        elif isinstance(stmt, NodeIfStmt):
+            for clause in stmt.clauses:
+                for sub_stmt in clause.statements:
+                    self._update_versions(sub_stmt)
+                    
+                    
+    def _count_keys(self, stmt_list, repeated=None):
+        '''
+        Count how often each expression is evaluated in a statement list.
+        Returns dict: key -> number
+        '''
+        counts = {}
+        seen = set()
+        versions_start = dict(self.versions)
+        for stmt in stmt_list:
+            for expr in self._statement_expressions(stmt):
+                for key, call in self._evaluated_subexpressions(expr, repeated, 
+                                                                seen):
+                    if call.function in self.float_funcs:
+                        counts[key] = counts.get(key, 0) + 1
+            self._update_versions(stmt)
+        self.versions = versions_start
+        return counts
+    
+    
+    def _replace(self, expr, repeated, temps, new_stmts, loc):
+        '''
+        Replace the repeated expressions in expr by temporary variables 
+        (recursive). Assignments to new temporary variables are appended 
+        to new_stmts. Returns the new expression.
+        
+        ARGUMENTS
+        ---------
+        repeated: set of keys of the repeated expressions
+        temps: dict: key -> temporary variable
+        '''
+        if isinstance(expr, NodeParentheses):
+            arg = self._replace(expr.arguments[0], repeated, temps, 
+                                new_stmts, loc)
+            if arg is expr.arguments[0]:
+                return expr
+            return NodeParentheses((arg,), expr.loc)
+        elif not isinstance(expr, NodeFuncCall):
+            return expr
+        key = self.expr_key(expr)
+        if key in temps:
+            return temps[key]
+        args = list(expr.arguments)
+        n_evaluated = 1 if expr.function in self.short_circuit_funcs \
+                        else len(args)
+        for i in range(n_evaluated):
+            args[i] = self._replace(args[i], repeated, temps, new_stmts, loc)
+        kwargs = dict((name, self._replace(arg, repeated, temps, new_stmts, 
+                                           loc))
+                      for name, arg in expr.keyword_arguments.iteritems())
+        unchanged = all(new is old for new, old in zip(args, expr.arguments)) \
+                    and all(kwargs[name] is arg for name, arg 
+                            in expr.keyword_arguments.iteritems())
+        if not unchanged:
+            new_expr = NodeFuncCall(expr.function, tuple(args), kwargs, 
+                                    expr.loc)
+            new_expr.__siml_type__ = expr.__siml_type__
+            new_expr.__siml_role__ = expr.__siml_role__
+        else:
+            new_expr = expr
+        if key not in repeated:
+            return new_expr
+        #compute the expression in a temporary variable
+        self.num_temps += 1
+        temp = IFloat()
+        temp.__siml_role__ = RoleTemporaryVariable
+        temp.target_name = '_cse%d' % self.num_temps
+        new_stmts.append(NodeAssignment(temp, new_expr, loc))
+        temps[key] = temp
+        return temp
+    
+    
+    def eliminate_statement_list(self, stmt_list, outer_temps=None):
+        '''
+        Remove common subexpressions from a list of statements. 
+        Returns the new list of statements. (Recursive: the clauses of 
+        "if" statements are treated as separate statement lists.)
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            The statements.
+        outer_temps: dict: key -> temporary variable
+            Temporary variables of the enclosing statement list, that are 
+            computed before stmt_list. They are used too.
+        '''
+        #find the repeated expressions
+        counts = self._count_keys(stmt_list)
+        repeated = set(key for key, num in counts.iteritems() if num > 1)
+        #repeated expressions inside repeated expressions disappear, 
+        #when the outer expression is replaced.
+        counts = self._count_keys(stmt_list, repeated)
+        repeated = set(key for key, num in counts.iteritems() if num > 1)
+        #create the new statements
+        temps = dict(outer_temps) if outer_temps is not None else {}
+        new_stmts = []
+        for stmt in stmt_list:
+            if isinstance(stmt, NodeAssignment):
+                expr = self._replace(stmt.expression, repeated, temps, 
+                                     new_stmts, stmt.loc)
+                if expr is not stmt.expression:
+                    stmt = NodeAssignment(stmt.target, expr, stmt.loc)
+                new_stmts.append(stmt)
+            elif isinstance(stmt, NodeExpressionStmt):
+                expr = self._replace(stmt.expression, repeated, temps, 
+                                     new_stmts, stmt.loc)
+                if expr is not stmt.expression:
+                    stmt = NodeExpressionStmt(expr, stmt.loc)
+                new_stmts.append(stmt)
+            elif isinstance(stmt, NodeIfStmt):
+                new_clauses = []
+                for i, clause in enumerate(stmt.clauses):
+                    cond = clause.condition
+                    if i == 0:
+                        cond = self._replace(cond, repeated, temps, new_stmts, 
+                                             stmt.loc)
+                    versions_start = dict(self.versions)
+                    body = self.eliminate_statement_list(clause.statements, 
+                                                         temps)
+                    self.versions = versions_start
+                    new_clauses.append(NodeClause(cond, body, 
+                                                  clause.runtime_if, 
+                                                  clause.loc))
+                new_stmts.append(NodeIfStmt(new_clauses, stmt.runtime_if, 
+                                            stmt.loc))
+            self._update_versions(stmt)
+        return new_stmts
+    
+    
+    def eliminate_main_function(self, main_function):
+        '''Remove common subexpressions from a main function.'''
+        self.versions = {}
+        self.num_temps = 0
+        main_function.statements = \
+            self.eliminate_statement_list(main_function.statements)
+        
+        
+    def eliminate_simulation_object(self, sim_obj):
+        '''Remove common subexpressions from all main functions.'''
+        for attr in sim_obj.attributes.itervalues():
+            if isinstance(attr, SimlFunction):
+                self.eliminate_main_function(attr)
+
+
+
+class ParameterExpressionHoister(object):
+    '''
+    Compute expressions of the dynamic function, that depend only on 
+    parameters and constants, once before the simulation starts.
+    (Hoisting of loop invariant expressions.)
+    
+    The largest sub-expressions, that contain no variables, 
+    are replaced by new hidden parameters (target names: param._derived1, 
+    param._derived2, ...). The assignments that compute the hidden 
+    parameters are stored in the simulation object's attribute 
+    derived_parameters (list of NodeAssignment); the code generator puts 
+    them into the method derived_parameters(param) of the simulation class.
+    
+    Products and quotients are reordered, to put the parameters together:
+        time * (fMax - fMin) / rampDuration  
+        --> time * ((fMax - fMin) / rampDuration) 
+    This can change the last digits of the results. 
+    
+    Only expressions that are always evaluated are moved: The statements 
+    in the clauses of "if" statements are not changed. Parameters for which
+    sensitivities are computed (see SymbolicDifferentiator) must not be 
+    moved, they can be excluded.
+    
+    Usage:
+    ------
+    hoister = ParameterExpressionHoister(excluded_params)
+    hoister.hoist_simulation_object(sim_obj)
+    '''
+    float_funcs = CommonSubexpressionEliminator.float_funcs
+    short_circuit_funcs = CommonSubexpressionEliminator.short_circuit_funcs
+    mul_div_funcs = set([func(IFloat.__mul__), func(IFloat.__div__)])
+    ONE = IFloat(1)
+    
+    def __init__(self, excluded_params=()):
+        '''
+        ARGUMENTS
+        ---------
+        excluded_params: [IFloat]
+            Expressions that contain these parameters are not moved.
+        '''
+        object.__init__(self)
+        self.excluded_params = set(excluded_params)
+        #Computes the keys to find identical expressions
+        self.keys = CommonSubexpressionEliminator()
+        #The hidden parameters: dict: key -> IFloat
+        self.derived_params = {}
+        #The assignments to the hidden parameters
+        self.statements = []
+        
+        
+    def is_param_expr(self, expr):
+        '''
+        Test if expression depends only on parameters and constants, 
+        and can be moved. (recursive)
+        '''
+        if isinstance(expr, NodeParentheses):
+            return self.is_param_expr(expr.arguments[0])
+        elif isinstance(expr, NodeFuncCall):
+            return expr.function in self.float_funcs and \
+                   not expr.keyword_arguments and \
+                   all(self.is_param_expr(arg) for arg in expr.arguments)
+        elif isknownconst(expr):
+            return True
+        elif isinstance(expr, CodeGeneratorObject):
+            return isrole(expr, RoleParameter) and \
+                   expr not in self.excluded_params
+        return False
+    
+    
+    def _derived_param(self, expr, loc):
+        '''Return the hidden parameter, that contains the value of expr.'''
+        key = self.keys.expr_key(expr)
+        if key not in self.derived_params:
+            param = IFloat()
+            param.__siml_role__ = RoleParameter
+            param.target_name = 'param._derived%d' % (len(self.statements) + 1)
+            self.statements.append(NodeAssignment(param, expr, loc))
+            self.derived_params[key] = param
+        return self.derived_params[key]
+    
+    
+    def _factors(self, expr, denominator=False):
+        '''
+        Split a product or quotient into its factors. 
+        Returns list of tuples: (expression, is_denominator)
+        '''
+        if isinstance(expr, NodeParentheses):
+            return self._factors(expr.arguments[0], denominator)
+        elif isinstance(expr, NodeFuncCall) and \
+             expr.function in self.mul_div_funcs:
+            a, b = expr.arguments
+            return (self._factors(a, denominator) + 
+                    self._factors(b, denominator != 
+                                     (expr.function is func(IFloat.__div__))))
+        return [(expr, denominator)]
+    
+    
+    def _product(self, numerators, denominators):
+        '''Create expression: n1 * n2 * ... / d1 / d2 ...'''
+        mul, div = func(IFloat.__mul__), func(IFloat.__div__)
+        paren = SymbolicDifferentiator._paren #pylint:disable-msg=W0212
+        result = paren(numerators[0]) if numerators else self.ONE
+        for factor in numerators[1:]:
+            result = NodeFuncCall(mul, (result, paren(factor)), {})
+        for factor in denominators:
+            result = NodeFuncCall(div, (result, paren(factor)), {})
+        return result
+    
+    
+    def hoist_expression(self, expr, loc):
+        '''
+        Replace the sub-expressions, that depend only on parameters, 
+        by hidden parameters. (recursive) Returns the new expression.
+        '''
+        if isinstance(expr, NodeParentheses):
+            arg = self.hoist_expression(expr.arguments[0], loc)
+            if arg is expr.arguments[0]:
+                return expr
+            return NodeParentheses((arg,), expr.loc)
+        elif not isinstance(expr, NodeFuncCall):
+            return expr
+        elif self.is_param_expr(expr):
+            return self._derived_param(expr, loc)
+        #put the parameters of products together
+        if expr.function in self.mul_div_funcs:
+            factors = self._factors(expr)
+            param_factors = [(f, den) for f, den in factors 
+                             if self.is_param_expr(f)]
+            if len(param_factors) > 1 and len(param_factors) < len(factors):
+                derived = self._derived_param(
+                    self._product([f for f, den in param_factors if not den],
+                                  [f for f, den in param_factors if den]), 
+                    loc)
+                other_factors = [(self.hoist_expression(f, loc), den) 
+                                 for f, den in factors 
+                                 if not self.is_param_expr(f)]
+                return self._product(
+                    [f for f, den in other_factors if not den] + [derived], 
+                    [f for f, den in other_factors if den])
+        #search the arguments
+        args = list(expr.arguments)
+        n_evaluated = 1 if expr.function in self.short_circuit_funcs \
+                        else len(args)
+        for i in range(n_evaluated):
+            args[i] = self.hoist_expression(args[i], loc)
+        if all(new is old for new, old in zip(args, expr.arguments)):
+            return expr
+        new_expr = NodeFuncCall(expr.function, tuple(args), 
+                                expr.keyword_arguments, expr.loc)
+        new_expr.__siml_type__ = expr.__siml_type__
+        new_expr.__siml_role__ = expr.__siml_role__
+        return new_expr
+    
+    
+    def hoist_statement_list(self, stmt_list):
+        '''
+        Replace the sub-expressions, that depend only on parameters, 
+        in a list of statements. Returns the new list of statements.
+        '''
+        new_stmts = []
+        for stmt in stmt_list:
+            if isinstance(stmt, NodeAssignment):
+                expr = self.hoist_expression(stmt.expression, stmt.loc)
+                if expr is not stmt.expression:
+                    stmt = NodeAssignment(stmt.target, expr, stmt.loc)
+            elif isinstance(stmt, NodeIfStmt):
+                clause = stmt.clauses[0]
+                cond = self.hoist_expression(clause.condition, stmt.loc)
+                if cond is not clause.condition:
+                    stmt = NodeIfStmt([NodeClause(cond, clause.statements, 
+                                                  clause.runtime_if, 
+                                                  clause.loc)] + 
+                                      stmt.clauses[1:], 
+                                      stmt.runtime_if, stmt.loc)
+            new_stmts.append(stmt)
+        return new_stmts
+    
+    
+    def hoist_simulation_object(self, sim_obj):
+        '''
+        Move the expressions, that depend only on parameters, out of the
+        dynamic function. Creates the attribute sim_obj.derived_parameters.
+        '''
+        self.derived_params = {}
+        self.statements = []
+        method_name = DotName('dynamic')
+        if sim_obj.has_attribute(method_name):
+            dynamic = sim_obj.get_attribute(method_name)
+            dynamic.statements = self.hoist_statement_list(dynamic.statements)
+        sim_obj.derived_parameters = self.statements
+
+
+
+class DeadStatementEliminator(object):
+    '''
+    Remove the statements, that do not contribute to a given set of 
+    variables. 
+    
+    The solver needs only the time derivatives from the dynamic function;
+    many algebraic variables are only computed for the simulation results 
+    (for example: STY = X * D). The statements that compute them are removed
+    from the solver's function; the algebraic variables are computed 
+    separately, only at the reporting times.
+    
+    The statements are decorated with the sets of input and output 
+    variables by MakeDataFlowDecorations, then they are searched backwards.
+    Expression statements (print, graph, save) are always kept. 
+    
+    Usage:
+    ------
+    eliminator = DeadStatementEliminator()
+    rhs_stmts = eliminator.eliminate_statement_list(stmts, time_derivatives)
+    '''
+    def __init__(self):
+        object.__init__(self)
+        self.deco = MakeDataFlowDecorations()
+        
+        
+    def _live_statements(self, stmt_list, live):
+        '''
+        Return the statements that compute the variables in the set live.
+        (recursive) On return live contains the variables that are needed 
+        before the statements.
+        '''
+        new_stmts = []
+        for stmt in reversed(stmt_list):
+            if isinstance(stmt, NodeAssignment):
+                if stmt.target not in live:
+                    continue
+                live.discard(stmt.target)
+                live.update(stmt.inputs)
+            elif isinstance(stmt, NodeIfStmt):
+                #The clauses are alternatives: nothing is removed from live
+                clause_stmts = []
+                live_before = set()
+                for clause in stmt.clauses:
+                    live_clause = set(live)
+                    clause_stmts.append(self._live_statements(clause.statements, 
+                                                              live_clause))
+                    live_before.update(live_clause)
+                if not any(clause_stmts):
+                    continue
+                for clause in stmt.clauses:
+                    live_before.update(clause.condition.inputs 
+                                       if hasattr(clause.condition, 'inputs')
+                                       else [clause.condition])
+                live.update(live_before)
+                if any(new is not clause.statements for new, clause 
+                       in zip(clause_stmts, stmt.clauses)):
+                    stmt = NodeIfStmt([NodeClause(clause.condition, new, 
+                                                  clause.runtime_if, 
+                                                  clause.loc)
+                                       for new, clause 
+                                       in zip(clause_stmts, stmt.clauses)], 
+                                      stmt.runtime_if, stmt.loc)
+            else:
+                live.update(stmt.inputs)
+            new_stmts.append(stmt)
+        new_stmts.reverse()
+        if len(new_stmts) == len(stmt_list):
+            return stmt_list
+        return new_stmts
+        
+        
+    def eliminate_statement_list(self, stmt_list, needed_vars):
+        '''
+        Remove the statements that are not necessary to compute the 
+        variables in needed_vars. Returns the new list of statements; the 
+        original list is returned if no statement was removed.
+        
+        ARGUMENTS
+        ---------
+        stmt_list: [Node]
+            The statements. They are decorated with inputs and outputs.
+        needed_vars: [CodeGeneratorObject]
+            The variables that must be computed by the statements.
+        '''
+        self.deco.decorate_statement_list(stmt_list)
+        return self._live_statements(stmt_list, set(needed_vars))
+
+
+
+def optimize_simulation_objects(obj_list, sensitivity_params=()):
+    '''
+    Optimize the main functions of a list of simulation objects. 
+    The objects must have been checked by check_simulation_objects. 
+    The data flow decorations are recomputed for the changed functions.
+    
+    ARGUMENTS
+    ---------
+    obj_list: [CompiledClass]
+        The simulation objects.
+    sensitivity_params: [str]
+        Names of parameters for sensitivity analysis. Expressions that 
+        contain them, or parameters computed from them, are not moved out 
+        of the dynamic function.
+    '''
+    deco = MakeDataFlowDecorations()
+    cse = CommonSubexpressionEliminator()
+    
+    for sim_obj in obj_list:
+        sens_params = [sim_obj.get_attribute(DotName(name)) 
+                       for name in sensitivity_params 
+                       if sim_obj.has_attribute(DotName(name))]
+        excluded = find_dependent_variables(sim_obj, sens_params)
+        ParameterExpressionHoister(excluded).hoist_simulation_object(sim_obj)
+        cse.eliminate_simulation_object(sim_obj)
+        deco.decorate_simulation_object(sim_obj)
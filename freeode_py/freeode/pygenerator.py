@@ -40,14 +40,19 @@ from __future__ import absolute_import
 
 import datetime
 import cStringIO
-from freeode.util import DotName, PROGRAM_VERSION, func 
+from freeode.util import DotName, PROGRAM_VERSION, UserException, func 
 from freeode.ast import (NodeFuncCall, NodeParentheses,  
                          NodeAssignment, NodeIfStmt, 
                          NodeExpressionStmt, 
                          RoleIntermediateVariable, RoleInputVariable, 
-                         RoleOutputVariable, RoleParameter, RoleConstant)
+                         RoleOutputVariable, RoleParameter, RoleConstant, 
+                         RoleTemporaryVariable)
 from  freeode.interpreter import (IFloat, IString, IBool, CompiledClass, 
                                   CodeGeneratorObject, isrole, BUILTIN_LIB )
+from freeode.optimizer import (SymbolicDifferentiator, 
+                               DeadStatementEliminator, 
+                               MakeDataFlowDecorations,
+                               compute_jacobian_sparsity)
 
 
 
@@ -65,6 +70,9 @@ class ExpressionGenerator(object):
     
     def __init__(self):
         object.__init__(self)
+        #Variables that are replaced by the expressions that compute them:
+        #{id(variable): expression}
+        self.inline_exprs = {}
         
     def create_expression(self, expr):
         '''
@@ -139,7 +147,7 @@ class ExpressionGenerator(object):
     def _create_func_call(self, func_call):
         '''Create Python text for function func_call.'''
         #get name of the corresponding Python function
-        func_name = ExpressionGenerator.function_name[func_call.function] 
+        func_name = self.function_name[func_call.function] 
         #produce output
         ret_str = func_name + '('
         for arg in func_call.arguments:
@@ -171,7 +179,7 @@ class ExpressionGenerator(object):
     
     def _create_binop(self, func_call):
         '''Create Python text for infix operators: + - * / ^ and or'''
-        op_str = ExpressionGenerator.binop_str[func_call.function]
+        op_str = self.binop_str[func_call.function]
         return (self.create_expression(func_call.arguments[0]) + op_str +
                 self.create_expression(func_call.arguments[1]))
         
@@ -182,7 +190,7 @@ class ExpressionGenerator(object):
     
     def _create_prefopt(self, func_call):
         '''Create Python text for prefix operators: - not'''
-        op_str = ExpressionGenerator.prefopt_str[func_call.function]
+        op_str = self.prefopt_str[func_call.function]
         return op_str + self.create_expression(func_call.arguments[0])
 
 
@@ -201,6 +209,8 @@ class ExpressionGenerator(object):
             else:
                 raise Exception('Unknown type of immediate constant: ' 
                                 + str(type(obj))) 
+        elif id(obj) in self.inline_exprs:
+            return '(' + self.create_expression(self.inline_exprs[id(obj)]) + ')'
         else:
             return obj.target_name
         
@@ -208,7 +218,51 @@ class ExpressionGenerator(object):
     def _create_parentheses(self, iltFormula):
         #pair of prentheses: ( ... )
         return '(' + self.create_expression(iltFormula.arguments[0]) + ')'
-                
+
+
+
+class VectorExpressionGenerator(ExpressionGenerator):
+    '''
+    Create Python expressions that operate on Numpy arrays.
+
+    The variables in the generated expressions can be arrays of the same shape
+    (or scalars), the computations are done element wise. Functions are
+    replaced by their Numpy equivalents, logical operators by the element
+    wise logical functions of Numpy.
+    '''
+
+    #Table that maps functions to Python functions
+    function_name = dict(ExpressionGenerator.function_name)
+    function_name.update({BUILTIN_LIB.sin:'numpy.sin',
+                          BUILTIN_LIB.cos:'numpy.cos',
+                          BUILTIN_LIB.tan:'numpy.tan',
+                          BUILTIN_LIB.sqrt:'numpy.sqrt',
+                          BUILTIN_LIB.exp:'numpy.exp',
+                          BUILTIN_LIB.log:'numpy.log',
+                          BUILTIN_LIB.abs:'numpy.abs',
+                          BUILTIN_LIB.min:'numpy.minimum',
+                          BUILTIN_LIB.max:'numpy.maximum'})
+
+    #Table that maps logical operators to Numpy functions
+    logical_func_name = {func(IBool.__siml_and2__):'numpy.logical_and',
+                         func(IBool.__siml_or2__):'numpy.logical_or',
+                         func(IBool.__siml_not__):'numpy.logical_not'}
+
+    def _create_binop(self, func_call):
+        '''Create Python text for infix operators; "and", "or" are functions.'''
+        if func_call.function in self.logical_func_name:
+            return (self.logical_func_name[func_call.function] + '(' +
+                    self.create_expression(func_call.arguments[0]) + ', ' +
+                    self.create_expression(func_call.arguments[1]) + ')')
+        return ExpressionGenerator._create_binop(self, func_call)
+
+    def _create_prefopt(self, func_call):
+        '''Create Python text for prefix operators; "not" is a function.'''
+        if func_call.function in self.logical_func_name:
+            return (self.logical_func_name[func_call.function] + '(' +
+                    self.create_expression(func_call.arguments[0]) + ')')
+        return ExpressionGenerator._create_prefopt(self, func_call)
+
 
 
 class StatementGenerator(object):
@@ -322,19 +376,148 @@ class StatementGenerator(object):
         store().
         Called for: NodeExpressionStmt
         '''
-        self.write(indent + self.create_expression(iltStmt.expression) + '\n')            
-            
+        self.write(indent + self.create_expression(iltStmt.expression) + '\n')
+
+
+
+class VectorStatementGenerator(StatementGenerator):
+    '''
+    Generate statements that operate on Numpy arrays.
+
+    All variables are arrays, each element belongs to a different, independent
+    computation (simulation run, point in time). There is no control flow:
+    "if" statements are converted to masks, and assignments in the clauses
+    only change the elements where the mask is true (numpy.where).
+    Expression statements (print, graph, save) are not generated, because
+    they make no sense for element wise computations.
+    '''
+
+    def __init__(self, txt_buffer):
+        '''
+        ARGUMENT:
+            txt_buffer : File like object where the Python program
+                        will be stored.
+        '''
+        super(VectorStatementGenerator, self).__init__(txt_buffer)
+        #Object that creates a formula from an AST sub-tree
+        self.genFormula = VectorExpressionGenerator()
+        #Names of the masks of the enclosing "if" clauses
+        self.mask_stack = []
+        #Number of masks that were created, to create unique names.
+        self.num_masks = 0
+
+
+    def _make_mask_name(self):
+        '''Create a unique name for a mask variable.'''
+        self.num_masks += 1
+        return '_mask%d' % self.num_masks
+
+
+    def _create_assignment(self, assign_stmt, indent):
+        '''
+        Create fragment of Python program for an assignment statement.
+        Inside of "if" clauses only elements where the mask is true are changed.
+        Temporary variables of the optimizer are only used inside the clause,
+        they are assigned completely.
+        '''
+        target = assign_stmt.target.target_name
+        expr = self.create_expression(assign_stmt.expression)
+        mask = self.mask_stack[-1] if self.mask_stack else None
+        if mask is not None and \
+           not isrole(assign_stmt.target, RoleTemporaryVariable):
+            self.write(indent + '%s = numpy.where(%s, %s, %s)\n'
+                       % (target, mask, expr, target))
+        else:
+            self.write(indent + target + ' = ' + expr + '\n')
+
+
+    def _create_if_stmt(self, if_stmt, indent):
+        '''
+        Create fragment of Python program for an "if" statement.
+
+        For each clause a mask is computed, which is true for the elements
+        where the clause's statements are executed. Masks of nested "if"
+        statements are combined with the mask of the enclosing clause.
+        '''
+        #elements that were not taken by any of the previous clauses
+        remaining = self.mask_stack[-1] if self.mask_stack else None
+        index_else = len(if_stmt.clauses) - 1
+        for index, clause in enumerate(if_stmt.clauses):
+            if index != index_else:
+                cond = self.create_expression(clause.condition)
+                mask = self._make_mask_name()
+                if remaining is None:
+                    self.write(indent + '%s = %s\n' % (mask, cond))
+                else:
+                    self.write(indent + '%s = numpy.logical_and(%s, %s)\n'
+                               % (mask, remaining, cond))
+                remaining_new = self._make_mask_name()
+                if remaining is None:
+                    self.write(indent + '%s = numpy.logical_not(%s)\n'
+                               % (remaining_new, mask))
+                else:
+                    self.write(indent + '%s = numpy.logical_and(%s, '
+                               'numpy.logical_not(%s))\n'
+                               % (remaining_new, remaining, mask))
+                remaining = remaining_new
+            else:
+                mask = remaining
+            #write the statements of the clause
+            self.mask_stack.append(mask)
+            self.create_statements(clause.statements, indent)
+            self.mask_stack.pop()
+
+
+    def _create_expression_stmt(self, iltStmt, indent):
+        '''
+        Expression statements (print(), graph(), store()) are not generated
+        in vectorized functions. Called for: NodeExpressionStmt
+        '''
+        pass
+
 
 
 class SimulationClassGenerator(object):
     '''create python class that simulates a process'''
 
-    def __init__(self, txt_buffer):
+    def __init__(self, txt_buffer, buffer_rhs=False, sensitivity_params=(),
+                 specialize=False):
         '''
         Arguments:
             txt_buffer : File where the Python program will be stored.
+            buffer_rhs : If True the dynamic method writes the time 
+                         derivatives into a buffer, that is supplied by the 
+                         caller: dynamic(time, y, out)
+            sensitivity_params : Names of parameters (str). The forward 
+                         sensitivities of all state variables with respect 
+                         to these parameters are computed. Names that are no
+                         parameters of this class are ignored.
+            specialize : If True the parameter values are used as constants
+                         in the differential equations. The class gets the
+                         source code of the differential equations.
         '''
         super(SimulationClassGenerator, self).__init__()
+        #Create dynamic method that writes into a preallocated buffer
+        self.buffer_rhs = buffer_rhs
+        #Use the parameter values as constants (SimulatorBase.specialize)
+        self.specialize = specialize
+        #Names of parameters for the sensitivity equations
+        self.sensitivity_params = list(sensitivity_params)
+        #The parameters for which sensitivity equations were created
+        self.sensitivity_params_found = []
+        #Statements of the dynamic function; with sensitivity equations
+        self.dynamic_statements = None
+        #Statements of the dynamic function, that are needed to compute the
+        #time derivatives. (Is self.dynamic_statements if all are needed.)
+        self.rhs_statements = None
+        #Algebraic variables that are computed by self.rhs_statements
+        self.rhs_algebraic_variables = []
+        #Statements of the initialization functions; 
+        #with initial values of the sensitivities. dict: DotName -> [Node]
+        self.init_statements = {}
+        #Hidden parameters that contain the derivatives of parameters, which 
+        #are computed from the sensitivity parameters. list: [IFloat]
+        self.param_deriv_params = []
         #The input: an IL-tree of the process. It has no external dependencies.
         self.flat_object = CompiledClass(None)
         #File where the Python program will be stored.
@@ -351,6 +534,13 @@ class SimulationClassGenerator(object):
         self.state_variables_ordered = []
         #generated derivative variables: dict: {DotName: InterpreterObject]
         self.time_derivatives = {}
+        #Assignments to hidden parameters, that contain expressions of the
+        #dynamic function, which depend only on parameters. (See module 
+        #optimizer, ParameterExpressionHoister.) list: [NodeAssignment]
+        self.derived_param_statements = []
+        #The expressions that compute the hidden parameters: 
+        #{id(parameter): expression}
+        self.derived_param_exprs = {}
         
         
     def write(self, string):
@@ -465,6 +655,116 @@ class SimulationClassGenerator(object):
         self.algebraic_variables_ordered.sort(key=get_siml_name)
 
 
+    def create_sensitivity_equations(self):
+        '''
+        Augment the system of differential equations with the forward 
+        sensitivity equations, for the parameters in self.sensitivity_params.
+        
+        The sensitivities d(x)/d(p) become additional state variables, 
+        they are appended to self.state_variables_ordered. The statements 
+        that compute them are stored in self.dynamic_statements and 
+        self.init_statements.
+        
+        Parameters that are computed from p in the initialization functions
+        (k = 2*p) depend on p too. Their derivatives d(k)/d(p) are computed 
+        in the initialization functions, and stored in hidden parameters 
+        (self.param_deriv_params), which the sensitivity equations use.
+        '''
+        method_name = DotName('dynamic')
+        if self.flat_object.has_attribute(method_name):
+            self.dynamic_statements = \
+                self.flat_object.get_attribute(method_name).statements #IGNORE:E1103
+        if not self.sensitivity_params or self.dynamic_statements is None:
+            return
+        #find the parameters
+        params = []
+        for param_name in self.sensitivity_params:
+            param = self.parameters.get(DotName(param_name), None)
+            if param is None:
+                continue
+            params.append(param)
+            self.sensitivity_params_found.append(param_name)
+        if not params:
+            return
+        state_vars = list(self.state_variables_ordered)
+        functions = [var.time_derivative for var in state_vars]
+        differentiator = SymbolicDifferentiator()
+        #differentiate the initialization functions. Repeat until the 
+        #parameters, that depend on the sensitivity parameters, are known.
+        is_init = lambda name: str(name) == 'initialize' or \
+                               str(name).startswith('init_')
+        init_names = filter(is_init, self.flat_object.attributes) #pylint: disable-msg=W0141
+        other_params = [param for param in self.parameters.values() 
+                        if not [p for p in params if p is param]]
+        param_derivs = {}
+        n_derivs = -1
+        while n_derivs != len(self.param_deriv_params):
+            n_derivs = len(self.param_deriv_params)
+            for name in init_names:
+                init_stmts, _ = differentiator.create_initial_sensitivities(
+                        self.flat_object.get_attribute(name).statements, #IGNORE:E1103
+                        state_vars, params, param_derivs)
+                self.init_statements[name] = init_stmts
+                for param in other_params:
+                    for wrt in params:
+                        if differentiator.get_derivative(param, wrt) is None or \
+                           wrt in param_derivs.get(param, {}):
+                            continue
+                        deriv_param = IFloat()
+                        deriv_param.__siml_role__ = RoleParameter
+                        deriv_param.target_name = 'param._d_%s__d_%s' % \
+                            (param.target_name[len('param.'):].replace('.', '_'),
+                             wrt.target_name[len('param.'):].replace('.', '_'))
+                        deriv_param.siml_dot_name = 'd(%s)/d(%s)' % \
+                            (param.siml_dot_name, wrt.siml_dot_name)
+                        param_derivs.setdefault(param, {})[wrt] = deriv_param
+                        self.param_deriv_params.append(deriv_param)
+        #differentiate the dynamic function
+        stmts, sensitivities, sens_functions = \
+            differentiator.create_sensitivities(self.dynamic_statements, 
+                                                functions, state_vars, params,
+                                                param_derivs)
+        #create the additional state variables
+        for var, var_sens, var_sens_funcs in zip(state_vars, sensitivities, 
+                                                 sens_functions):
+            for param, sens, sens_func in zip(params, var_sens, var_sens_funcs):
+                sens.siml_dot_name = 'd(%s)/d(%s)' % (var.siml_dot_name, 
+                                                      param.siml_dot_name)
+                if sens_func is None:
+                    #the time derivative is always 0
+                    sens_func = IFloat()
+                    sens_func.target_name = sens.target_name + '_Dtime'
+                    stmts.append(NodeAssignment(sens_func, IFloat(0), 
+                                                self.flat_object.loc))
+                sens_func.siml_dot_name = '$' + sens.siml_dot_name
+                sens.time_derivative = sens_func
+                self.state_variables[sens.siml_dot_name] = sens
+                self.time_derivatives[sens_func.siml_dot_name] = sens_func
+                self.state_variables_ordered.append(sens)
+        self.dynamic_statements = stmts
+
+
+    def create_rhs_statements(self):
+        '''
+        Find the statements of the dynamic function, that are needed by the 
+        solver to compute the time derivatives. The other statements compute
+        only algebraic variables, they are executed at the reporting times 
+        (when the dynamic methods are called with returnAlgVars=True, and by
+        the algebraic method).
+        Results: self.rhs_statements, self.rhs_algebraic_variables
+        '''
+        if self.dynamic_statements is None:
+            return
+        functions = [var.time_derivative for var in self.state_variables_ordered]
+        self.rhs_statements = DeadStatementEliminator()\
+            .eliminate_statement_list(self.dynamic_statements, functions)
+        _, outputs = MakeDataFlowDecorations().decorate_statement_list(
+                                                        self.rhs_statements)
+        self.rhs_algebraic_variables = [var for var 
+                                        in self.algebraic_variables_ordered 
+                                        if var in outputs]
+
+
     def write_class_def_start(self):
         '''Write first few lines of class definition.'''
         self.write('class %s(SimulatorBase): \n' % self.class_py_name)
@@ -476,6 +776,40 @@ class SimulationClassGenerator(object):
                             self.flat_object.loc.line_no()))
         self.write('    \'\'\' \n')
         self.write('    \n')
+        if self.specialize and self.rhs_statements is not None:
+            self.write('    #Differential equations in Python. '
+                       'See: SimulatorBase.specialize \n')
+            self.write("    rhsSource = r'''\n")
+            self.write(self.create_rhs_source())
+            self.write("'''\n")
+            self.write('    \n')
+
+
+    def create_rhs_source(self):
+        '''
+        Create the Python source of a function that computes the time
+        derivatives: dynamic(time, state_vars) 
+        The parameters are accessed as param.<name>; the function is 
+        created at runtime, when the parameters are replaced by their 
+        values. (SimulatorBase.specialize)
+        '''
+        out_py = cStringIO.StringIO()
+        ind4 = ' '*4
+        out_py.write('def dynamic(time, state_vars):\n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            out_py.write(ind4 + '%s = state_vars[%d]\n' 
+                         % (var.target_name, n_var))
+        for var in self.rhs_algebraic_variables:
+            if var.target_name == 'time':
+                continue #time is an argument of the function
+            out_py.write(ind4 + '%s = nan\n' % (var.target_name))
+        stmtGen = StatementGenerator(out_py)
+        stmtGen.create_statements(self.rhs_statements, ind4)
+        out_py.write(ind4 + 'return array([')
+        for var in self.state_variables_ordered:
+            out_py.write('%s, ' % var.time_derivative.target_name)
+        out_py.write('], \'float64\')\n')
+        return out_py.getvalue()
 
 
     def write_constructor(self):
@@ -492,9 +826,54 @@ class SimulationClassGenerator(object):
         self.write(ind8 + 'param = self.param \n')
         for paramDef in self.parameters.values():
             self.write(ind8 + '%s = 0 \n' % (paramDef.target_name))
+        #Create mapping between parameter names and attribute names
+        self.write(ind8 + '#mapping between parameter names and attributes '
+                          'of self.param \n')
+        self.write(ind8 + 'self.parameterNameMap = {')
+        for paramDef in self.parameters.values():
+            attr_name = paramDef.target_name.split('.', 1)[1]
+            self.write('\'%s\':\'%s\', ' % (str(paramDef.siml_dot_name), 
+                                              attr_name))
+        self.write('}\n')
+        if self.buffer_rhs:
+            self.write(ind8 + '#dynamic(...) writes into a buffer \n')
+            self.write(ind8 + 'self.rhsBuffered = True \n')
+        if self.specialize and self.rhs_statements is not None:
+            self.write(ind8 + '#parameters are constants in the '
+                              'differential equations \n')
+            self.write(ind8 + 'self.specializeParams = True \n')
+        self.write_jacobian_sparsity()
         self.write('\n\n')
 
 
+    def write_jacobian_sparsity(self):
+        '''
+        Generate the sparsity pattern of the Jacobian matrix. 
+        Part of the __init__ function.
+        '''
+        #get the process' dynamic method
+        method_name = DotName('dynamic')
+        if not self.flat_object.has_attribute(method_name):
+            return
+        method = self.flat_object.get_attribute(method_name)
+        functions = [var.time_derivative for var in self.state_variables_ordered]
+        sparsity = compute_jacobian_sparsity(method, 
+                                             self.state_variables_ordered, 
+                                             functions, 
+                                             self.dynamic_statements)
+        ind8 = ' '*8
+        self.write(ind8 + '#Sparsity pattern of the Jacobian: '
+                          'nonzero elements (row, column) \n')
+        self.write(ind8 + 'self.jacobianSparsity = sparsityPattern((%d, %d), ['
+                   % (len(functions), len(self.state_variables_ordered)))
+        for row, _ in sparsity:
+            self.write('%d, ' % row)
+        self.write('], [')
+        for _, col in sparsity:
+            self.write('%d, ' % col)
+        self.write('])\n')
+
+
     def write_initialize_method(self, method_name=DotName('initialize')):
         '''Generate method that initializes variables and parameters'''
         #get the init method
@@ -532,7 +911,11 @@ class SimulationClassGenerator(object):
         #print the method's statements
         self.write(ind8 + '#do computations \n')
         stmtGen = StatementGenerator(self.out_py)
-        stmtGen.create_statements(method.statements, ind8) #IGNORE:E1103
+        statements = self.init_statements.get(method_name, 
+                                              method.statements) #IGNORE:E1103
+        stmtGen.create_statements(statements, ind8)
+        if self.derived_param_statements:
+            self.write(ind8 + 'self.derived_parameters(param) \n')
         self.write(ind8 + '\n')
 
         #put initial values into array and store them
@@ -561,6 +944,38 @@ class SimulationClassGenerator(object):
         self.write('\n\n')
 
 
+    def write_derived_parameters_method(self):
+        '''
+        Generate the method that computes the hidden parameters. The 
+        parameters can be numbers, or arrays for simulateEnsemble.
+        '''
+        if not self.derived_param_statements:
+            return
+        ind8 = ' '*8
+        self.write('    def derived_parameters(self, param): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute the expressions of the dynamic method, \n')
+        self.write(ind8 + 'that depend only on parameters. \n')
+        self.write(ind8 + '\'\'\' \n')
+        stmtGen = VectorStatementGenerator(self.out_py)
+        stmtGen.create_statements(self.derived_param_statements, ind8)
+        self.write('\n\n')
+
+
+    def make_public_generator(self, generator_class=StatementGenerator):
+        '''
+        Create a statement generator for the methods, that are also called 
+        by the user (dynamic, jacobian, algebraic). The hidden parameters 
+        are replaced by the expressions that compute them; the methods 
+        therefore see changes of the parameters at each call. Only the 
+        solver's methods use the hidden parameters, they are computed by 
+        derived_parameters before the simulation.
+        '''
+        stmt_gen = generator_class(self.out_py)
+        stmt_gen.genFormula.inline_exprs = self.derived_param_exprs
+        return stmt_gen
+
+
     def write_dynamic_method(self):
         '''Generate the method that contains the differential equations'''
         #get the process' dynamic method
@@ -569,6 +984,9 @@ class SimulationClassGenerator(object):
             method = self.flat_object.get_attribute(method_name)
         else:
             return
+        if self.buffer_rhs:
+            self.write_dynamic_buffer_method()
+            return
         #write method definition
         ind8 = ' '*8; ind12 = ' '*12 #; ind16 = ' '*16
         self.write('    def dynamic(self, time, state_vars, returnAlgVars=False): \n')
@@ -582,6 +1000,20 @@ class SimulationClassGenerator(object):
         self.write(ind8 + '#take the state variables out of the state vector \n')
         for n_var, var in enumerate(self.state_variables_ordered):
             self.write(ind8 + '%s = state_vars[%d] \n' % (var.target_name, n_var))
+        #the solver needs only the statements that compute time derivatives
+        if self.rhs_statements is not self.dynamic_statements:
+            self.write(ind8 + 'if not returnAlgVars: \n')
+            for var in self.rhs_algebraic_variables:
+                if var.target_name == 'time':
+                    continue #time is an argument of the dynamic function
+                self.write(ind12 + '%s = nan \n' % (var.target_name))
+            self.write(ind12 + '#compute only the time derivatives \n')
+            stmtGen = self.make_public_generator()
+            stmtGen.create_statements(self.rhs_statements, ind12)
+            self.write(ind12 + 'return array([')
+            for var in self.state_variables_ordered:
+                self.write('%s, ' % var.time_derivative.target_name)
+            self.write('], \'float64\') \n')
         #Create all algebraic variables
         self.write(ind8 + '#create all algebraic variables '
                           'to prevent runtime errors.\n')
@@ -592,8 +1024,8 @@ class SimulationClassGenerator(object):
 
         #emit the method's statements
         self.write(ind8 + '#do computations \n')
-        stmtGen = StatementGenerator(self.out_py)
-        stmtGen.create_statements(method.statements, ind8) #IGNORE:E1103
+        stmtGen = self.make_public_generator()
+        stmtGen.create_statements(self.dynamic_statements, ind8)
         self.write(ind8 + '\n')
 
         #return either state variables or algebraic variables
@@ -618,6 +1050,298 @@ class SimulationClassGenerator(object):
         self.write('\n\n')
 
 
+    def write_dynamic_rhs_method(self):
+        '''
+        Generate the method that computes only the time derivatives, for 
+        the solver: dynamic_rhs(time, state_vars). It uses the hidden 
+        parameters of derived_parameters. Only necessary if there are 
+        hidden parameters, and dynamic(...) does not write into a buffer.
+        '''
+        if not self.derived_param_statements or self.buffer_rhs or \
+           self.dynamic_statements is None:
+            return
+        ind8 = ' '*8
+        self.write('    def dynamic_rhs(self, time, state_vars): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute time derivative of state variables. \n')
+        self.write(ind8 + 'This function will be called by the solver repeatedly. \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + '#Make parameters visible in dynamic method. \n')
+        self.write(ind8 + 'param = self.param \n')
+        #take the state variables out of the state vector
+        self.write(ind8 + '#take the state variables out of the state vector \n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            self.write(ind8 + '%s = state_vars[%d] \n' % (var.target_name, n_var))
+        #Create the algebraic variables, that are computed
+        self.write(ind8 + '#create all algebraic variables '
+                          'to prevent runtime errors.\n')
+        for var in (self.rhs_algebraic_variables):
+            if var.target_name == 'time':
+                continue #time is an argument of the dynamic function
+            self.write(ind8 + '%s = nan \n' % (var.target_name))
+        #emit the statements that compute the time derivatives
+        self.write(ind8 + '#do computations \n')
+        stmtGen = StatementGenerator(self.out_py)
+        stmtGen.create_statements(self.rhs_statements, ind8)
+        self.write(ind8 + '\n')
+        self.write(ind8 + 'return array([')
+        for var in self.state_variables_ordered:
+            self.write('%s, ' % var.time_derivative.target_name)
+        self.write('], \'float64\') \n')
+        self.write('\n\n')
+
+
+    def write_dynamic_buffer_method(self):
+        '''
+        Generate the method that contains the differential equations, 
+        in the variant that does not allocate memory: 
+            dynamic(time, y, out)
+        The state variables are taken out of y with one tuple unpack, they 
+        become Python floats. The time derivatives are written into the 
+        array out, which is supplied by the caller.
+        The algebraic variables are computed by the method algebraic(...).
+        '''
+        ind8 = ' '*8
+        self.write('    def dynamic(self, time, y, out): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute time derivative of state variables, '
+                          'and store them in out. \n')
+        self.write(ind8 + 'This function will be called by the solver repeatedly. \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + '#Make parameters visible in dynamic method. \n')
+        self.write(ind8 + 'param = self.param \n')
+        #take the state variables out of the state vector
+        if self.state_variables_ordered:
+            self.write(ind8 + '#take the state variables out of the state vector \n')
+            self.write(ind8)
+            for var in self.state_variables_ordered:
+                self.write('%s, ' % var.target_name)
+            self.write('= y.tolist() \n')
+        #Create the algebraic variables, that are computed
+        self.write(ind8 + '#create all algebraic variables '
+                          'to prevent runtime errors.\n')
+        for var in (self.rhs_algebraic_variables):
+            if var.target_name == 'time':
+                continue #time is an argument of the dynamic function
+            self.write(ind8 + '%s = nan \n' % (var.target_name))
+
+        #emit the statements that compute the time derivatives
+        self.write(ind8 + '#do computations \n')
+        stmtGen = StatementGenerator(self.out_py)
+        stmtGen.create_statements(self.rhs_statements, ind8)
+        self.write(ind8 + '\n')
+
+        #put the time derivatives into the buffer
+        self.write(ind8 + '#store the time derivatives in the buffer \n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            self.write(ind8 + 'out[%d] = %s \n' 
+                       % (n_var, var.time_derivative.target_name))
+        self.write(ind8 + 'return out \n')
+        self.write('\n\n')
+
+
+    def write_jacobian_method(self):
+        '''
+        Generate the method that computes the Jacobian matrix of the 
+        differential equations. The derivatives are computed symbolically 
+        from the statements of the dynamic method.
+        '''
+        #get the process' dynamic method
+        if self.dynamic_statements is None:
+            return
+        #differentiate the dynamic method
+        functions = [var.time_derivative for var in self.state_variables_ordered]
+        differentiator = SymbolicDifferentiator()
+        statements, jacobian = differentiator.create_jacobian(
+                        self.rhs_statements, functions,
+                        self.state_variables_ordered) 
+        #write method definition
+        ind8 = ' '*8
+        self.write('    def jacobian(self, time, state_vars): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute the Jacobian matrix of the differential equations: \n')
+        self.write(ind8 + 'jacMatrix[i,j] = d dynamic(...)[i] / d state_vars[j] \n')
+        self.write(ind8 + 'This function will be called by the solver repeatedly. \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + '#Make parameters visible in jacobian method. \n')
+        self.write(ind8 + 'param = self.param \n')
+        #take the state variables out of the state vector
+        self.write(ind8 + '#take the state variables out of the state vector \n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            self.write(ind8 + '%s = state_vars[%d] \n' % (var.target_name, n_var))
+        #Create all algebraic variables
+        self.write(ind8 + '#create all algebraic variables '
+                          'to prevent runtime errors.\n')
+        for var in (self.algebraic_variables_ordered):
+            if var.target_name == 'time':
+                continue #time is an argument of the jacobian function
+            self.write(ind8 + '%s = nan \n' % (var.target_name))
+
+        #emit the statements that compute the derivatives
+        self.write(ind8 + '#do computations \n')
+        stmtGen = self.make_public_generator()
+        stmtGen.create_statements(statements, ind8)
+        self.write(ind8 + '\n')
+
+        #put the derivatives into the matrix
+        self.write(ind8 + '#assemble the Jacobian matrix \n')
+        self.write(ind8 + 'jacMatrix = zeros((%d, %d), \'float64\') \n'
+                   % (len(functions), len(self.state_variables_ordered)))
+        for i, row in enumerate(jacobian):
+            for j, deriv_var in enumerate(row):
+                if deriv_var is None:
+                    continue
+                self.write(ind8 + 'jacMatrix[%d, %d] = %s \n' 
+                           % (i, j, deriv_var.target_name))
+        self.write(ind8 + 'return jacMatrix \n')
+        self.write('\n\n')
+
+
+    def write_dynamic_ensemble_method(self):
+        '''
+        Generate the method that computes the differential equations for
+        many simulation runs at once.
+
+        All variables are arrays, the last dimensions are the different
+        simulation runs. The parameters are given as an argument, they can be
+        arrays with one value per run.
+        '''
+        #get the process' dynamic method
+        method_name = DotName('dynamic')
+        if self.flat_object.has_attribute(method_name):
+            method = self.flat_object.get_attribute(method_name)
+        else:
+            return
+        #write method definition
+        ind8 = ' '*8; ind12 = ' '*12
+        self.write('    def dynamic_ensemble(self, time, state_vars, param, '
+                   'returnAlgVars=False): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute time derivative of state variables for '
+                          'many simulation runs. \n')
+        self.write(ind8 + 'state_vars[i_var, i_run, ...]; parameters '
+                          'can be arrays with one value per run. \n')
+        self.write(ind8 + '\'\'\' \n')
+        #both branches of numpy.where are computed for all elements
+        self.write(ind8 + 'with numpy.errstate(invalid=\'ignore\', '
+                          'divide=\'ignore\', over=\'ignore\'): \n')
+        ind8 = ' '*12; ind12 = ' '*16
+        #take the state variables out of the state vector
+        self.write(ind8 + '#take the state variables out of the state vector \n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            self.write(ind8 + '%s = state_vars[%d] \n' % (var.target_name, n_var))
+        #the solver needs only the statements that compute time derivatives
+        if self.rhs_statements is not self.dynamic_statements:
+            self.write(ind8 + 'if not returnAlgVars: \n')
+            for var in self.rhs_algebraic_variables:
+                if var.target_name == 'time':
+                    continue #time is an argument of the dynamic function
+                self.write(ind12 + '%s = nan \n' % (var.target_name))
+            for var in self.state_variables_ordered:
+                self.write(ind12 + '%s = nan \n' 
+                           % var.time_derivative.target_name)
+            self.write(ind12 + '#compute only the time derivatives \n')
+            stmtGen = VectorStatementGenerator(self.out_py)
+            stmtGen.create_statements(self.rhs_statements, ind12)
+            self.write(ind12 + 'return stackVectors([')
+            for var in self.state_variables_ordered:
+                self.write('%s, ' % var.time_derivative.target_name)
+            self.write('], state_vars.shape[1:]) \n')
+        #Create all algebraic variables and time derivatives
+        self.write(ind8 + '#create all algebraic variables '
+                          'to prevent runtime errors.\n')
+        for var in (self.algebraic_variables_ordered):
+            if var.target_name == 'time':
+                continue #time is an argument of the dynamic function
+            self.write(ind8 + '%s = nan \n' % (var.target_name))
+        for var in self.state_variables_ordered:
+            self.write(ind8 + '%s = nan \n' % var.time_derivative.target_name)
+
+        #emit the method's statements
+        self.write(ind8 + '#do computations \n')
+        stmtGen = VectorStatementGenerator(self.out_py)
+        stmtGen.create_statements(self.dynamic_statements, ind8)
+        self.write(ind8 + '\n')
+
+        #return either state variables or algebraic variables
+        self.write(ind8 + 'if returnAlgVars: \n')
+        self.write(ind12 + '#put algebraic variables into array \n')
+        self.write(ind12 + 'return stackVectors([')
+        for var in self.algebraic_variables_ordered:
+            self.write('%s, ' % var.target_name)
+        self.write('], state_vars.shape[1:]) \n')
+        self.write(ind8 + 'else: \n')
+        self.write(ind12 + '#assemble the time derivatives into the return array \n')
+        self.write(ind12 + 'return stackVectors([')
+        for var in self.state_variables_ordered:
+            self.write('%s, ' % var.time_derivative.target_name)
+        self.write('], state_vars.shape[1:]) \n')
+
+        self.write('\n\n')
+
+
+    def write_algebraic_method(self):
+        '''
+        Generate the method that computes the algebraic variables for many
+        points in time at once.
+
+        The statements of the dynamic method are evaluated element wise on 
+        Numpy arrays, one element per point in time. This replaces one call 
+        of the dynamic method per point in time, after the simulation.
+        '''
+        #get the process' dynamic method
+        method_name = DotName('dynamic')
+        if self.flat_object.has_attribute(method_name):
+            method = self.flat_object.get_attribute(method_name)
+        else:
+            return
+        #write method definition
+        ind8 = ' '*8
+        self.write('    def algebraic(self, time_vec, state_matrix): \n')
+        self.write(ind8 + '\'\'\' \n')
+        self.write(ind8 + 'Compute the algebraic variables for many points '
+                          'in time at once. \n')
+        self.write(ind8 + 'state_matrix[i_time, i_var]; returns '
+                          'algMatrix[i_time, i_alg_var] \n')
+        self.write(ind8 + '\'\'\' \n')
+        #both branches of numpy.where are computed for all elements
+        self.write(ind8 + 'with numpy.errstate(invalid=\'ignore\', '
+                          'divide=\'ignore\', over=\'ignore\'): \n')
+        ind8 = ' '*12
+        self.write(ind8 + '#Make parameters visible in algebraic method. \n')
+        self.write(ind8 + 'param = self.param \n')
+        self.write(ind8 + 'time = time_vec \n')
+        #take the state variables out of the state matrix
+        self.write(ind8 + '#take the state variables out of the state matrix \n')
+        for n_var, var in enumerate(self.state_variables_ordered):
+            self.write(ind8 + '%s = state_matrix[:, %d] \n' 
+                       % (var.target_name, n_var))
+        #Create all algebraic variables and time derivatives
+        self.write(ind8 + '#create all algebraic variables '
+                          'to prevent runtime errors.\n')
+        for var in (self.algebraic_variables_ordered):
+            if var.target_name == 'time':
+                continue #time is an argument of the algebraic function
+            self.write(ind8 + '%s = nan \n' % (var.target_name))
+        for var in self.state_variables_ordered:
+            self.write(ind8 + '%s = nan \n' % var.time_derivative.target_name)
+
+        #emit the method's statements
+        self.write(ind8 + '#do computations \n')
+        stmtGen = self.make_public_generator(VectorStatementGenerator)
+        stmtGen.create_statements(method.statements, ind8) #IGNORE:E1103
+        self.write(ind8 + '\n')
+
+        #return the algebraic variables, one row per point in time
+        self.write(ind8 + '#put algebraic variables into array \n')
+        self.write(ind8 + 'algMatrix = stackVectors([')
+        for var in self.algebraic_variables_ordered:
+            self.write('%s, ' % var.target_name)
+        self.write('], time_vec.shape) \n')
+        self.write(ind8 + 'return algMatrix.T \n')
+        self.write('\n\n')
+
+
     def write_final_method(self):
         '''Generate the method that dispays/saves results after the simulation.'''
         #get the process' final method
@@ -666,9 +1390,15 @@ class SimulationClassGenerator(object):
 
         #collect information about the process
         self.class_py_name = class_name
+        self.derived_param_statements = getattr(flat_object, 
+                                                'derived_parameters', [])
+        self.derived_param_exprs = dict((id(stmt.target), stmt.expression) 
+                                        for stmt in self.derived_param_statements)
         self.classify_attributes()
         self.create_attr_py_names()
         self.order_attributes()
+        self.create_sensitivity_equations()
+        self.create_rhs_statements()
 
         #output program text
         self.write_class_def_start()
@@ -678,7 +1408,12 @@ class SimulationClassGenerator(object):
         is_additional_init = lambda name: str(name).startswith('init_')
         for name in filter(is_additional_init, self.flat_object.attributes): #pylint: disable-msg=W0141
             self.write_initialize_method(name)
+        self.write_derived_parameters_method()
         self.write_dynamic_method()
+        self.write_dynamic_rhs_method()
+        self.write_jacobian_method()
+        self.write_dynamic_ensemble_method()
+        self.write_algebraic_method()
         self.write_final_method()
 
         self.write('\n\n')
@@ -688,19 +1423,35 @@ class SimulationClassGenerator(object):
 class ProgramGenerator(object):
     '''Create a program from an ILT-tree'''
 
-    def __init__(self):
+    def __init__(self, buffer_rhs=False, sensitivity_params=(), 
+                 specialize=False):
         '''
         Arguments:
-            pyFile : file where the program will be stored,
-                     or a StringStream for debuging.
+            buffer_rhs : If True the dynamic methods write the time 
+                         derivatives into a preallocated buffer.
+            sensitivity_params : Names of parameters (str). The forward 
+                         sensitivities with respect to these parameters 
+                         are computed by the simulations. 
+            specialize : If True the simulations use the parameter values
+                         as constants in the differential equations.
         '''
         object.__init__(self)
+        #Create dynamic methods that write into a preallocated buffer
+        self.buffer_rhs = buffer_rhs
+        #Parameters are constants in the differential equations
+        self.specialize = specialize
+        #Names of parameters for the sensitivity equations
+        self.sensitivity_params = list(sensitivity_params)
         #filename of source file
         self.source_file_name = None
         #buffer for generated python code; with file interface
         self.out_py = cStringIO.StringIO()
         #names of the generated classes.
         self.simulation_class_names = []
+        #class that generates the code of a simulation class
+        self.class_generator = SimulationClassGenerator
+        #hash of the input, written into the header. See: simlcompiler
+        self.source_hash = None
 
 
     def get_buffer(self):
@@ -738,6 +1489,8 @@ class ProgramGenerator(object):
         self.write('# Generated by SIML compiler version %s on %s %s. \n'
                          % (PROGRAM_VERSION, date, time))
         self.write('# Source file: %s' % str(self.source_file_name))
+        if self.source_hash is not None:
+            self.write('\n# Source hash: %s' % self.source_hash)
         self.write(
 '''
 ################################################################################
@@ -746,8 +1499,10 @@ class ProgramGenerator(object):
 from __future__ import division
 from __future__ import absolute_import 
 from math import pi, sin, cos, tan, sqrt, exp, log
-from numpy import array, nan, float64
-from freeode.simulatorbase import SimulatorBase, simulatorMainFunc, debug_print
+import numpy
+from numpy import array, nan, float64, zeros
+from freeode.simulatorbase import (SimulatorBase, simulatorMainFunc, 
+                                   debug_print, stackVectors, sparsityPattern)
 
 
 '''     )
@@ -786,10 +1541,20 @@ if __name__ == '__main__':
         self.write_program_start()
 
         #create code for each simulation object in the list
+        params_found = set()
         for sim_object in obj_list:
             #TODO: make unique class names
             self.simulation_class_names.append(sim_object.class_name)
-            procGen = SimulationClassGenerator(self.out_py)
+            procGen = self.class_generator(self.out_py, self.buffer_rhs, 
+                                           self.sensitivity_params, 
+                                           self.specialize)
             procGen.create_sim_class(sim_object.class_name, sim_object)
+            params_found.update(procGen.sensitivity_params_found)
+        #all parameters for sensitivity analysis must exist
+        for param_name in self.sensitivity_params:
+            if param_name not in params_found:
+                raise UserException('Sensitivity analysis: "%s" is not a '
+                                    'parameter of any simulation object.' 
+                                    % param_name)
 
         self.write_program_end()
@@ -35,14 +35,126 @@ import optparse
 import sys
 import os
 import stat
+import imp
+import itertools
+import hashlib
 from subprocess import Popen #, PIPE, STDOUT
 #import freeode.simlparser as simlparser
 import freeode.interpreter as interpreter
 import freeode.pygenerator as pygenerator
-from freeode.optimizer import check_simulation_objects
+import freeode.cgenerator as cgenerator
+from freeode.optimizer import (check_simulation_objects, 
+                               optimize_simulation_objects)
 from freeode.util import UserException, PROGRAM_VERSION, DEBUG_AREAS
 
 
+
+def compilation_hash(siml_text, file_name='<string>', **options):
+    '''
+    Compute a hash of everything that determines the generated program: 
+    the Siml program, its file name, the compiler version, and the options 
+    of the code generator (see generate_program). Returns a hex string.
+    '''
+    hasher = hashlib.sha1()
+    for item in [PROGRAM_VERSION, file_name, 
+                 repr(sorted((name, list(value) 
+                              if isinstance(value, tuple) else value) 
+                             for name, value in options.iteritems())), 
+                 siml_text]:
+        hasher.update(item)
+        hasher.update('\0')
+    return hasher.hexdigest()
+
+
+def generate_program(siml_text, file_name='<string>', buffer_rhs=False, 
+                     sensitivity_params=(), c_backend=False, specialize=False,
+                     source_hash=None):
+    '''
+    Compile a Siml program, and return the generated Python program.
+    
+    ARGUMENTS
+    ---------
+    siml_text: str
+        The Siml program.
+    file_name: str
+        File name of the Siml program, for error messages.
+    buffer_rhs, sensitivity_params, c_backend, specialize: 
+        Options of the code generator, see the compiler's command line 
+        options: --buffer-rhs, --sensitivity, --c-backend, --specialize
+    source_hash: str or None
+        Written into the header of the program. See: compilation_hash
+        
+    RETURNS
+    -------
+    (program, class_names)
+    program: str
+        The Python program.
+    class_names: [str]
+        Names of the simulation classes, in the order of the Siml program.
+    '''
+    intp = interpreter.Interpreter()
+    if c_backend:
+        prog_gen = cgenerator.CProgramGenerator(buffer_rhs, sensitivity_params,
+                                                specialize)
+    else:
+        prog_gen = pygenerator.ProgramGenerator(buffer_rhs, sensitivity_params,
+                                                specialize)
+    prog_gen.source_hash = source_hash
+    #the compilation proper
+    intp.interpret_module_string(siml_text, file_name, '__main__')
+    sims = intp.get_compiled_objects()
+    check_simulation_objects(sims)
+    optimize_simulation_objects(sims, sensitivity_params)
+    prog_gen.create_program(file_name, sims)
+    return prog_gen.get_buffer(), list(prog_gen.simulation_class_names)
+
+
+#Numbers for unique module names of compile_string
+_module_numbers = itertools.count(1)
+
+def compile_string(siml_text, file_name='<string>', module_name=None, 
+                   **options):
+    '''
+    Compile a Siml program and load the generated Python program as a 
+    module. No files are written and no processes are started.
+    
+    ARGUMENTS
+    ---------
+    siml_text: str
+        The Siml program.
+    file_name: str
+        File name of the Siml program, for error messages.
+    module_name: str or None
+        Name of the new module; it is put into sys.modules. 
+        None: create a unique name.
+    options: 
+        Options of the code generator: buffer_rhs, sensitivity_params, 
+        c_backend, specialize. See: generate_program
+        
+    RETURNS
+    -------
+    The module. Its attribute simulationClasses contains the simulation 
+    classes, in the order of the Siml program. 
+    
+    Example:
+        mod = compile_string(siml_text)
+        sim = mod.simulationClasses[0]()
+        sim.simulateDynamic()
+    '''
+    program, class_names = generate_program(siml_text, file_name, **options)
+    if module_name is None:
+        module_name = 'siml_program_%d' % _module_numbers.next()
+    module = imp.new_module(module_name)
+    module.__file__ = file_name
+    #the simulation objects look up their module (SimulatorBase.specialize)
+    sys.modules[module_name] = module
+    exec compile(program, '<generated from %s>' % file_name, 'exec') \
+         in module.__dict__
+    module.simulationClasses = [getattr(module, name) for name in class_names]
+    return module
+
+
+
 class SimlCompilerMain(object):
     def __init__(self):
         super(SimlCompilerMain, self).__init__()
@@ -55,6 +167,16 @@ class SimlCompilerMain(object):
         #debug areas as strings, they are passed like this to the simulation
         #if it is run
         self.debug_areas = ''
+        #generate dynamic methods that write into a preallocated buffer
+        self.buffer_rhs = False
+        #parameters for sensitivity analysis
+        self.sensitivity_params = []
+        #compute the differential equations in C
+        self.c_backend = False
+        #use the parameter values as constants in the differential equations
+        self.specialize = False
+        #compile even if the output file is up to date
+        self.force = False
 
 
     def parse_cmd_line(self):
@@ -84,6 +206,41 @@ class SimlCompilerMain(object):
                                 'to the simulation if it is run.',
                            metavar='<area,...>')
 
+        optPars.add_option('--buffer-rhs', dest='buffer_rhs',
+                           action="store_true", default=False,
+                           help='generate dynamic methods that write the ' \
+                                'time derivatives into a preallocated buffer. ' \
+                                'Faster, but division by zero is an error.')
+
+        optPars.add_option('--sensitivity', dest='sensitivity',
+                           help='compute the sensitivities of all state ' \
+                                'variables with respect to the given ' \
+                                'parameters (forward sensitivity equations).' \
+                                ' Example: --sensitivity=r.mu_max,r.Ks',
+                           metavar='<param,...>')
+
+        optPars.add_option('--c-backend', dest='c_backend',
+                           action="store_true", default=False,
+                           help='compute the differential equations with ' \
+                                'C code, which is compiled with the system\'s' \
+                                ' C compiler, when the simulation is run. ' \
+                                'Much faster.')
+
+        optPars.add_option('--force', dest='force',
+                           action="store_true", default=False,
+                           help='compile even if the output file is up to ' \
+                                'date. (The output file contains a hash of ' \
+                                'the input file, the options and the ' \
+                                'compiler version.)')
+
+        optPars.add_option('--specialize', dest='specialize',
+                           action="store_true", default=False,
+                           help='use the parameter values as constants in ' \
+                                'the differential equations. The equations ' \
+                                'are generated again when a simulation ' \
+                                'starts with new parameter values. Faster ' \
+                                'for many simulations with equal parameters.')
+
         #do the parsing
         (options, args) = optPars.parse_args()
 
@@ -130,6 +287,22 @@ class SimlCompilerMain(object):
         if options.no_graphs:
             self.no_graphs = True
             
+        #generate dynamic methods that write into a buffer
+        self.buffer_rhs = options.buffer_rhs
+
+        #parameters for sensitivity analysis
+        if options.sensitivity:
+            self.sensitivity_params = options.sensitivity.split(',')
+
+        #compute the differential equations in C
+        self.c_backend = options.c_backend
+        
+        #use the parameter values as constants
+        self.specialize = options.specialize
+        
+        #compile even if the output file is up to date
+        self.force = options.force
+
         #Set the debug areas
         DEBUG_AREAS.clear()
         if options.debug_areas:
@@ -140,16 +313,28 @@ class SimlCompilerMain(object):
 
     def do_compile(self):
         '''Do the work'''
-        #create the top level objects that do the compilation
-        intp = interpreter.Interpreter()
-        prog_gen = pygenerator.ProgramGenerator()
+        #read the Siml program
+        try:
+            input_file = open(os.path.abspath(self.input_file_name), 'r')
+            siml_text = input_file.read()
+            input_file.close()
+        except IOError, theError:
+            message = 'Could not read input file.\n' + str(theError)
+            raise UserException(message, None)
+
+        #skip compilation if the output file is up to date
+        options = dict(buffer_rhs=self.buffer_rhs, 
+                       sensitivity_params=self.sensitivity_params,
+                       c_backend=self.c_backend, specialize=self.specialize)
+        source_hash = compilation_hash(siml_text, self.input_file_name, 
+                                       **options)
+        if not self.force and self.is_up_to_date(source_hash):
+            print 'Output file is up to date: %s' % self.output_file_name
+            return
 
         #the compilation proper
-        intp.interpret_module_file(self.input_file_name, '__main__')
-        sims = intp.get_compiled_objects()
-        check_simulation_objects(sims)
-        prog_gen.create_program(self.input_file_name, sims)
-        prog_str = prog_gen.get_buffer()
+        prog_str, _ = generate_program(siml_text, self.input_file_name, 
+                                       source_hash=source_hash, **options)
 
         #write generated program to file
         try:
@@ -167,6 +352,21 @@ class SimlCompilerMain(object):
         #print 'input file: %s, output file: %s' % (self.input_file_name, self.output_file_name)
 
 
+    def is_up_to_date(self, source_hash):
+        '''
+        Test if the output file was generated from the same input, with the 
+        same options and compiler version. The hash (see compilation_hash) 
+        is in the header of the output file.
+        '''
+        try:
+            output_file = open(self.output_file_name, 'r')
+            header = list(itertools.islice(output_file, 30))
+            output_file.close()
+        except IOError:
+            return False
+        return '# Source hash: %s\n' % source_hash in header
+
+
     def run_program(self):
         '''
         Run the generated program if the user wants it.
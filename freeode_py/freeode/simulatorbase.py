@@ -33,13 +33,24 @@ from __future__ import division
 from __future__ import absolute_import     
 
 import sys
-
-from numpy import array, linspace, zeros, shape, ones, resize
+import os
+import re
+import copy
+import cPickle
+from timeit import default_timer as wallTime
+import itertools
+import multiprocessing
+
+from numpy import (array, linspace, zeros, ones, empty, arange, vstack, 
+                   hstack, searchsorted, isfinite, may_share_memory)
 from pylab import figure, xlabel, plot, legend, title, show
 import scipy.integrate.ode as odeInt
-import scipy.optimize.minpack as minpack
+import scipy.optimize
+import scipy.sparse
 
-from freeode.storage import DictStore
+from freeode.storage import BlockStore, EnsembleStore, ChunkedRecorder
+from freeode.clibrary import loadDynamicFunction
+from freeode.integrators import FixedStepSolver, RK4, Dopri45, Verlet
 
 
 
@@ -94,6 +105,372 @@ class ParamStorage(object):
     '''
     pass
 
+
+def _pyLiteral(value):
+    '''Return a Python expression for a float. See: specialize'''
+    if isfinite(value):
+        return '(%r)' % value
+    return 'float(\'%r\')' % value
+
+
+def _cLiteral(value):
+    '''Return a C expression for a float. See: specialize'''
+    if isfinite(value):
+        return '(%r)' % float(value)
+    elif value != value:
+        return 'NAN'
+    return 'INFINITY' if value > 0 else '(-INFINITY)'
+
+
+def stackVectors(values, shape):
+    '''
+    Put several arrays (or numbers) of equal shape into one array.
+    Used by the generated vectorized functions, where some variables 
+    can be numbers, because they are computed from parameters only.
+    
+    ARGUMENTS
+    ---------
+    values: list of arrays or numbers
+        Each value becomes one row of the result. Numbers are broadcast.
+    shape: tuple of int
+        The shape of each value.
+        
+    RETURNS
+    -------
+    Array with shape: (len(values),) + shape
+    '''
+    result = empty((len(values),) + tuple(shape), 'float64')
+    for i, value in enumerate(values):
+        result[i] = value
+    return result
+
+
+def sparsityPattern(shape, rows, columns):
+    '''
+    Create a sparse matrix, with ones at the nonzero elements of a 
+    (Jacobian) matrix. Used by the generated simulation classes.
+    
+    ARGUMENTS
+    ---------
+    shape: (int, int)
+        Shape of the matrix
+    rows, columns: list of int
+        Indices of the nonzero elements.
+    '''
+    return scipy.sparse.csc_matrix((ones(len(rows)), (rows, columns)), 
+                                   shape=shape)
+
+
+
+class IvpSolver(object):
+    '''
+    Wrapper around the solver classes of scipy.integrate.solve_ivp
+    (RK45, Radau, BDF, LSODA, ...) with the interface of 
+    scipy.integrate.ode, that is used by SimulatorBase.
+    
+    The solver takes steps of its own size; the results at the requested 
+    times are computed by interpolation (dense output). 
+    
+    When the BDF or Radau method gets a sparsity pattern, the Jacobian is 
+    computed with finite differences, only at the nonzero elements. Columns 
+    that have no nonzero elements in common are computed with a single call 
+    of the right hand side. The linear systems are solved with a sparse LU 
+    decomposition. 
+    '''
+    def __init__(self, solver_class, rhs, rtol=1e-6, atol=1e-12, 
+                 t_end=float('inf'), **options):
+        '''
+        ARGUMENTS
+        ---------
+        solver_class: subclass of scipy.integrate.OdeSolver
+            The solution algorithm.
+        rhs: function(time, state_vars)
+            Right hand side of the ODE.
+        rtol, atol: float
+            Relative and absolute tolerance.
+        t_end: float
+            The solver does not integrate beyond this time.
+        options: 
+            Additional arguments for the solver, for example: 
+            jac, jac_sparsity
+        '''
+        object.__init__(self)
+        self.solver_class = solver_class
+        #The solvers keep references to the returned arrays, but rhs may 
+        #return the same buffer in each call. 
+        self.rhs = lambda time, state_vars: array(rhs(time, state_vars), 
+                                                  'float64')
+        self.rtol = rtol
+        self.atol = atol
+        self.t_end = t_end
+        self.options = options
+        self.t = None
+        '''Current time'''
+        self.y = None
+        '''Current state vector'''
+        self._solver = None
+        self._success = True
+        self._n_steps = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+
+    def set_initial_value(self, y, t=0.0):
+        '''Set initial conditions y(t) = y.'''
+        self.t = t
+        self.y = array(y, 'float64')
+        self._solver = self.solver_class(self.rhs, t, self.y, self.t_end, 
+                                         rtol=self.rtol, atol=self.atol, 
+                                         **self.options)
+        self._success = True
+        self._n_steps = 0
+        self._step_min = float('inf')
+        self._step_max = 0.0
+        return self
+
+    def integrate(self, t):
+        '''Integrate to time t, return the state vector at time t.'''
+        solver = self._solver
+        while solver.t < t:
+            message = solver.step()
+            if solver.status != 'running' and solver.t < t:
+                print >> sys.stderr, 'error: %s' % message
+                self._success = False
+                return self.y
+            step = solver.t - solver.t_old
+            self._n_steps += 1
+            if step < self._step_min:
+                self._step_min = step
+            if step > self._step_max:
+                self._step_max = step
+        self.t = t
+        self.y = solver.dense_output()(t)
+        return self.y
+
+    def successful(self):
+        '''Check if integration was successful.'''
+        return self._success
+
+    @property
+    def nfev(self):
+        '''Number of evaluations of the right hand side.'''
+        return self._solver.nfev
+
+    def statistics(self):
+        '''
+        Return statistics of the work done by the solver as a dict.
+        See: solverStatistics
+        '''
+        stats = {'rhs_calls': self._solver.nfev,
+                 'jac_calls': self._solver.njev,
+                 'steps_accepted': self._n_steps}
+        if self._n_steps > 0:
+            stats['step_min'] = self._step_min
+            stats['step_max'] = self._step_max
+        return stats
+
+
+def solverStatistics(solver):
+    '''
+    Return statistics of the work done by an ODE solver, as far as the
+    solver reports them.
+
+    Solvers can report statistics by implementing a method statistics().
+    For scipy.integrate.ode, the counters of vode and lsoda are read; for
+    the other integrators the calls of the right hand side are counted
+    (see _registerOdeSolvers).
+
+    RETURNS
+    -------
+    dict with some or all of the keys: 'rhs_calls', 'jac_calls',
+    'steps_accepted', 'steps_rejected', 'step_min', 'step_max'
+    '''
+    if hasattr(solver, 'statistics'):
+        return solver.statistics()
+    stats = {}
+    if isinstance(solver, odeInt):
+        integrator = solver._integrator #IGNORE:W0212
+        name = integrator.__class__.__name__
+        if name in ('vode', 'lsoda') and integrator.iwork is not None:
+            iwork = integrator.iwork
+            stats['steps_accepted'] = int(iwork[10])
+            stats['rhs_calls'] = int(iwork[11])
+            stats['jac_calls'] = int(iwork[12])
+            if name == 'vode':
+                #convergence failures + error test failures
+                stats['steps_rejected'] = int(iwork[20] + iwork[21])
+    if hasattr(solver, 'callCounts'):
+        stats.update(solver.callCounts)
+    return stats
+
+
+
+#---- registry of ODE solvers -------------------------------------------------
+#Global dict of the available ODE solvers: {name: factory}
+#The factories are functions: 
+#    factory(rhs, jac, sparsity, rtol, atol, t_end) -> solver object
+#The solver objects have the interface of scipy.integrate.ode: 
+#set_initial_value(y, t), integrate(t), successful(), t, y
+SOLVERS = {}
+
+#Global solver options from the command line: {'method':..., 'rtol':..., 
+#'atol':...}. They override the values from the Siml program.
+SOLVER_OPTIONS = {}
+
+
+def registerSolver(name, factory):
+    '''
+    Make an ODE solver available to the simulations.
+    
+    ARGUMENTS
+    ---------
+    name: str
+        Name of the solver, as used by solution_parameters(method=...)
+    factory: function(rhs, jac, sparsity, rtol, atol, t_end) -> solver object
+        Creates the solver. jac (function) and sparsity (sparse matrix) 
+        may be None. The solver must not integrate beyond t_end.
+    '''
+    SOLVERS[name] = factory
+
+
+def findSolver(name):
+    '''
+    Return the factory of the ODE solver with the given name. 
+    The name is case insensitive, if this is unambiguous.
+    Raises ValueError for unknown names.
+    '''
+    if name in SOLVERS:
+        return SOLVERS[name]
+    matches = [key for key in SOLVERS if key.lower() == name.lower()]
+    if len(matches) == 1:
+        return SOLVERS[matches[0]]
+    raise ValueError('Unknown solver: "%s". Available solvers are: %s' 
+                     % (name, ', '.join(sorted(SOLVERS.keys()))))
+
+
+def _registerOdeSolvers():
+    '''Register the solvers of scipy.integrate.ode'''
+    def makeFactory(integrator, count_calls=False, use_jac=True, **options):
+        def factory(rhs, jac, sparsity, rtol, atol, t_end): #pylint:disable-msg=W0613
+            if not use_jac:
+                jac = None
+            if count_calls:
+                #The integrator does not report its statistics
+                call_counts = {'rhs_calls': 0}
+                def counting_rhs(time, state_vars):
+                    call_counts['rhs_calls'] += 1
+                    return rhs(time, state_vars)
+                solver = odeInt(counting_rhs) #IGNORE:E1102
+                solver.callCounts = call_counts
+            else:
+                solver = odeInt(rhs, jac) if jac is not None else odeInt(rhs) #IGNORE:E1102
+            return solver.set_integrator(integrator, rtol=rtol, atol=atol, 
+                                         nsteps=5000, **options)
+        return factory
+    #Adams method with functional iteration, for non-stiff problems.
+    #A Jacobian would switch vode to Newton iteration.
+    registerSolver('vode', makeFactory('vode', use_jac=False))
+    #BDF method with Newton iteration, for stiff problems
+    def vodeBdf(rhs, jac, sparsity, rtol, atol, t_end): #pylint:disable-msg=W0613
+        return (odeInt(rhs, jac) #IGNORE:E1102
+                .set_integrator('vode', method='bdf', with_jacobian=True, 
+                                rtol=rtol, atol=atol, nsteps=5000))
+    registerSolver('vode_bdf', vodeBdf)
+    registerSolver('lsoda', makeFactory('lsoda'))
+    registerSolver('dopri5', makeFactory('dopri5', count_calls=True))
+    registerSolver('dop853', makeFactory('dop853', count_calls=True))
+
+
+def _registerIvpSolvers():
+    '''Register the solvers of scipy.integrate.solve_ivp'''
+    try:
+        from scipy.integrate import RK45, Radau, BDF, LSODA
+    except ImportError:
+        return #old version of Scipy
+    def makeFactory(solver_class, use_jac, use_sparsity):
+        def factory(rhs, jac, sparsity, rtol, atol, t_end):
+            options = {}
+            if use_sparsity and sparsity is not None:
+                options['jac_sparsity'] = sparsity
+            elif use_jac and jac is not None:
+                options['jac'] = jac
+            return IvpSolver(solver_class, rhs, rtol, atol, t_end, **options)
+        return factory
+    registerSolver('RK45', makeFactory(RK45, False, False))
+    registerSolver('Radau', makeFactory(Radau, True, True))
+    registerSolver('BDF', makeFactory(BDF, True, True))
+    registerSolver('LSODA', makeFactory(LSODA, True, False))
+
+
+def _registerNumpySolvers():
+    '''
+    Register the solvers of module integrators, which are written with 
+    Numpy. They can compute many simulation runs at once (see 
+    simulateEnsemble); the fixed step solvers use SimulatorBase.solver_step.
+    '''
+    def rk4(rhs, jac, sparsity, rtol, atol, t_end): #pylint:disable-msg=W0613
+        return RK4(rhs)
+    def dopri45(rhs, jac, sparsity, rtol, atol, t_end): #pylint:disable-msg=W0613
+        return Dopri45(rhs, rtol, atol)
+    def verlet(rhs, jac, sparsity, rtol, atol, t_end): #pylint:disable-msg=W0613
+        return Verlet(rhs)
+    registerSolver('rk4', rk4)
+    registerSolver('dopri45', dopri45)
+    registerSolver('verlet', verlet)
+
+
+_registerOdeSolvers()
+_registerIvpSolvers()
+_registerNumpySolvers()
+
+
+
+class SimulationStats(object):
+    '''
+    Statistics of a dynamic simulation run: work done by the ODE solver,
+    and wall time spent in the different phases of the simulation.
+    Values that the solver does not report are None.
+    '''
+    def __init__(self):
+        self.rhs_calls = None
+        '''Number of evaluations of the right hand side (dynamic)'''
+        self.jac_calls = None
+        '''Number of evaluations of the Jacobian'''
+        self.steps_accepted = None
+        '''Number of successful steps of the solver'''
+        self.steps_rejected = None
+        '''Number of rejected steps (error test or convergence failures)'''
+        self.step_min = None
+        '''Smallest step size'''
+        self.step_mean = None
+        '''Average step size'''
+        self.step_max = None
+        '''Largest step size'''
+        self.time_initialize = 0.0
+        '''Wall time spent in initialize [s]'''
+        self.time_integrate = 0.0
+        '''Wall time spent in the ODE solver [s]'''
+        self.time_algebraic = 0.0
+        '''Wall time spent computing the algebraic variables [s]'''
+        self.time_final = 0.0
+        '''Wall time spent in final [s]'''
+
+    def __str__(self):
+        def fmt(value):
+            return 'n.a.' if value is None else '%g' % value
+        return ('rhs calls: %s, jacobian evaluations: %s \n'
+                'steps accepted: %s, rejected: %s \n'
+                'step size min: %s, mean: %s, max: %s \n'
+                'wall time [s] initialize: %.3g, integrate: %.3g, '
+                'algebraic: %.3g, final: %.3g'
+                % (fmt(self.rhs_calls), fmt(self.jac_calls),
+                   fmt(self.steps_accepted), fmt(self.steps_rejected),
+                   fmt(self.step_min), fmt(self.step_mean),
+                   fmt(self.step_max),
+                   self.time_initialize, self.time_integrate,
+                   self.time_algebraic, self.time_final))
+
+
+
 class SimulatorBase(object):
     """ Base class for the generated simulator classes """
 
@@ -104,6 +481,9 @@ class SimulatorBase(object):
         '''Array with times at which the solution was computed.'''
         self.resultArray = None
         '''Array with the simulation results'''
+        self.resultBlock = None
+        '''Array with time and the simulation results: [time | variables]. 
+           self.time and self.resultArray are views of it.'''
 
         self.param = ParamStorage()
         '''Storage for the parameters'''
@@ -120,6 +500,45 @@ class SimulatorBase(object):
         '''Length of the state vector'''
         self.algVectorLen = None
         '''Length of vector that contains the algebraic variables'''
+        self.parameterNameMap = {}
+        '''Mapping between parameter (siml) name and attribute of self.param'''
+        self.ensembleResultArray = None
+        '''Results of an ensemble simulation: [run, time, variable]'''
+        self.jacobianSparsity = None
+        '''Sparsity pattern of the Jacobian matrix (sparse matrix)'''
+        self.sparseSolverMinSize = 50
+        '''Minimum number of state variables to use the sparse solver'''
+        self.rhsBuffered = False
+        '''If True: dynamic(time, y, out) writes into the buffer out'''
+        self.specializeParams = False
+        '''If True: the parameters are constants in the differential 
+           equations. See: specialize'''
+        self._specializedRhs = (None, None)
+        '''The last specialized Python function: (parameter values, function)'''
+        self.recordFileName = None
+        '''If not None: simulateDynamic writes the results into this file, 
+           while it is computing them. See: recordToFile'''
+        self.recordChunkSize = 10000
+        '''Number of rows (points in time) that are written at once'''
+        self.checkpointFileName = None
+        '''If not None: simulateDynamic writes checkpoints into this file.
+           See: checkpointToFile'''
+        self.checkpointTimes = []
+        '''Points in time at which checkpoints are written'''
+        self._steadyStateGuess = None
+        '''Initial guess for the next steady state solution'''
+        self.solver_method = None
+        '''Name of the ODE solver, None: choose automatically. See SOLVERS'''
+        self.rtol = 1e-6
+        '''Relative tolerance of the ODE solver'''
+        self.atol = 1e-12
+        '''Absolute tolerance of the ODE solver'''
+        self.solver_step = None
+        '''Step size of the fixed step solvers ("rk4", "verlet"), 
+           None: one step per reporting interval'''
+        self.stats = SimulationStats()
+        '''Statistics of the last dynamic simulation (simulateDynamic,
+           continueDynamic)'''
 #        self.paramOverrideDict = {}
 #        '''Store alternative values for parameters.
 #           Written and read in initialize.'''
@@ -140,12 +559,13 @@ class SimulatorBase(object):
         """
         Delete the results. Use prior to simulateSteadyState().
         """
-        if hasattr(self, 'time'):
-            del self.time
-        if hasattr(self, 'resultArray'):
-            del self.resultArray
+        self.time = None
+        self.resultArray = None
+        self.resultBlock = None
 
-    def set_solution_parameters(self, duration=None, reporting_interval=None):
+    def set_solution_parameters(self, duration=None, reporting_interval=None,
+                                method=None, rtol=None, atol=None, 
+                                step=None):
         '''
         Change parameters of the solution algorithm.
     
@@ -155,11 +575,33 @@ class SimulatorBase(object):
             Duration of the simulation.
         reporting_interval: Float
             Interval at which the simulation results are recorded.
+        method: str
+            Name of the ODE solver, for example: "vode", "lsoda", "dopri5", 
+            "dop853", "RK45", "Radau", "BDF", "LSODA", "rk4", "dopri45", 
+            "verlet". See SOLVERS.
+            The empty string means: choose solver automatically.
+        rtol: Float
+            Relative tolerance of the ODE solver.
+        atol: Float
+            Absolute tolerance of the ODE solver.
+        step: Float
+            Step size of the fixed step solvers ("rk4", "verlet"). 
+            0 means: one step per reporting interval.
         '''
         if duration is not None:
             self.simulation_time = duration 
         if reporting_interval is not None:
             self.reporting_interval = reporting_interval        
+        if method is not None:
+            if method:
+                findSolver(method) #test if solver exists
+            self.solver_method = method or None
+        if rtol is not None:
+            self.rtol = rtol
+        if atol is not None:
+            self.atol = atol
+        if step is not None:
+            self.solver_step = step or None
         
     def getAttribute(self, attrName):
         """
@@ -184,6 +626,36 @@ class SimulatorBase(object):
         index = self.variableNameMap[attrName]
         return self.resultArray[:,index]
 
+    def getSensitivity(self, attrName, paramName):
+        """
+        Get the sensitivity of a state variable with respect to a parameter:
+        d attrName / d paramName, at all simulated points in time.
+        
+        The program must be compiled with the option --sensitivity, which 
+        creates the forward sensitivity equations for the parameter.
+        Example:
+            >>> mySimulationObject.getSensitivity('r.X', 'r.mu_max')
+        """
+        return self.getAttribute('d(%s)/d(%s)' % (attrName, paramName))
+
+    def getEnsembleAttribute(self, attrName):
+        """
+        Get an attribute of an ensemble simulation by name.
+
+        The funcion returns an array with the attribute's values of all 
+        simulation runs at all simulated points in time: [run, time].
+        Arguments:
+        varName:    Text string with the attribute name as it would appear in
+                    the Siml language. The special name 'time' returns the
+                    vector of simulated points in time.
+        Example:
+            >>> mySimulationObject.getEnsembleAttribute('r.X')
+        """
+        if attrName == 'time':
+            return self.time
+        index = self.variableNameMap[attrName]
+        return self.ensembleResultArray[:,:,index]
+
     def save(self, file_name=None):
         '''
         Save the simulation results to disk.
@@ -195,13 +667,25 @@ class SimulatorBase(object):
         result.save(file_name)
 
     def getResults(self):
-        '''Return the simulation results in a DictStore object'''
-        result = DictStore()
-        #put Variables into DictStore
-        result['time'] = self.getAttribute('time')
-        for name in self.variableNameMap.keys():
-            result[name] = self.getAttribute(name)
-        return result
+        '''
+        Return the simulation results in a BlockStore object. 
+        The store's block is self.resultBlock, the results are not copied;
+        recorded results (see recordToFile) stay on disk. Results that are 
+        not stored in self.resultBlock (for example of simulateSteadyState)
+        are copied into one array.
+        '''
+        block = self.resultBlock
+        if block is None or block.shape[0] != len(self.time) or \
+           not may_share_memory(block, self.time) or \
+           not may_share_memory(block, self.resultArray):
+            block = empty((len(self.time), self.resultArray.shape[1] + 1), 
+                          'float64', order='F')
+            block[:, 0] = self.time
+            block[:, 1:] = self.resultArray
+        column_index = dict((name, index + 1) for name, index 
+                            in self.variableNameMap.iteritems())
+        column_index['time'] = 0
+        return BlockStore(block, column_index)
 
     def graph(self, varNames, title=None):
         """
@@ -330,6 +814,69 @@ class SimulatorBase(object):
         pass
 
 
+    def derived_parameters(self, param):
+        '''
+        Compute the hidden parameters, that contain expressions of the 
+        dynamic function, which depend only on parameters (for example 
+        1/Yxs). Called before each simulation, so that changes of the 
+        parameters are seen by the solver's functions (dynamic_rhs, 
+        dynamic_ensemble, and dynamic if it writes into a buffer). 
+        The methods dynamic, jacobian and algebraic compute the expressions
+        at each call.
+        param: ParamStorage; the parameters can be numbers or arrays.
+        Generated classes re-implement this method if necessary.
+        '''
+        pass
+
+
+    #Generated classes re-implement this method
+    dynamic_rhs = None
+    '''
+    Compute only the time derivatives, for the solver: 
+    dynamic_rhs(time, state_vars). Uses the hidden parameters that are 
+    computed by derived_parameters. None if the solver can use dynamic(...).
+    '''
+
+
+    #Generated classes re-implement this method
+    jacobian = None
+    '''
+    Compute the Jacobian matrix of the differential equations:
+    jacobian(time, state_vars)[i,j] = d dynamic(...)[i] / d state_vars[j]
+    None if the Jacobian is not available; the solver then uses 
+    finite differences.
+    '''
+
+    #Generated classes re-implement this method
+    algebraic = None
+    '''
+    Compute the algebraic variables for many points in time at once:
+    algebraic(time_vec, state_matrix)[i_time, i_alg_var]
+    The rows of state_matrix are the state vectors at the times in 
+    time_vec. None if not available; then dynamic(...) is called for 
+    each point in time.
+    '''
+
+    #Generated classes (C backend) re-implement these attributes
+    cSource = None
+    '''
+    C source code of the differential equations, or None. The C function 
+    is used by the solvers instead of the dynamic method:
+    void dynamic(double time, const double *y, const double *p, double *out)
+    '''
+    cParameterNames = []
+    '''Attribute names of the parameters, in the order of the C function's
+    parameter array p.'''
+
+    #Generated classes (compiled with --specialize) re-implement this attribute
+    rhsSource = None
+    '''
+    Python source of the differential equations, or None. The source 
+    defines the function dynamic(time, state_vars); the parameters are 
+    accessed as param.<name>. See: specialize
+    '''
+
+
     def final(self, state_alg_vars):
         '''
         Display and save simulation results.
@@ -348,54 +895,778 @@ class SimulatorBase(object):
 #        pass
 
 
-    def simulateDynamic(self):
+    def _createSolver(self, rhs, jac=None, sparsity=None, 
+                      t_end=float('inf')):
+        '''
+        Create the ODE solver object.
+        
+        The solver is selected with self.solver_method, the tolerances with 
+        self.rtol, self.atol. Options from the command line (SOLVER_OPTIONS) 
+        take precedence.
+        
+        If no solver is selected, it is chosen automatically: 
+        For large systems with a sparse Jacobian the BDF method with 
+        sparse finite differences and sparse linear algebra is used. 
+        Otherwise the Adams method of vode with functional iteration is 
+        used. The Jacobian function is only used by the solvers for stiff 
+        problems, which must be selected explicitly (for example 
+        "vode_bdf", "BDF", "Radau").
+        
+        ARGUMENTS
+        ---------
+        rhs: function(time, state_vars)
+            Right hand side of the ODE.
+        jac: function(time, state_vars) or None
+            Computes the Jacobian matrix of rhs.
+        sparsity: sparse matrix or None
+            Sparsity pattern of the Jacobian matrix.
+        t_end: float
+            End time of the simulation.
+        '''
+        method = SOLVER_OPTIONS.get('method', self.solver_method)
+        rtol = SOLVER_OPTIONS.get('rtol', self.rtol)
+        atol = SOLVER_OPTIONS.get('atol', self.atol)
+        step = SOLVER_OPTIONS.get('step', self.solver_step)
+        #Sparse finite differences are only useful for large systems
+        if sparsity is not None and \
+           sparsity.shape[0] < self.sparseSolverMinSize:
+            sparsity = None
+            
+        if method is None:
+            method = 'BDF' if sparsity is not None else 'vode'
+        factory = findSolver(method)
+        solver = factory(rhs, jac, sparsity, rtol, atol, t_end)
+        if hasattr(solver, 'stepSize'):
+            solver.stepSize = step
+        return solver
+        
+        
+    def rhsFunction(self):
+        '''
+        Return the right hand side of the ODE as a function, that can be 
+        used by the solvers: function(time, state_vars) -> time derivatives
+        
+        If the dynamic method writes into a buffer (self.rhsBuffered), 
+        the buffer is created here, and the function returns the same 
+        buffer at each call.
+        
+        If there is C code for the differential equations (self.cSource),
+        the returned function calls the C function, which is compiled if 
+        necessary. The parameters are copied into an array here; changes 
+        of the parameters later are not seen by the function.
+        
+        If self.specializeParams is True, the function is created from 
+        source code, where the current parameter values are constants.
+        '''
+        self.derived_parameters(self.param)
+        if self.cSource is not None:
+            return self._cRhsFunction()
+        if self.specializeParams:
+            return self._specializedRhsFunction()
+        if not self.rhsBuffered:
+            return self.dynamic if self.dynamic_rhs is None \
+                   else self.dynamic_rhs
+        out = zeros(self.stateVectorLen, 'float64')
+        dynamic = self.dynamic
+        def rhs(time, state_vars):
+            return dynamic(time, state_vars, out)
+        return rhs
+
+    def _cRhsFunction(self):
+        '''
+        Return the right hand side of the ODE, computed by the C function 
+        in self.cSource. See: rhsFunction
+        '''
+        params = array([getattr(self.param, name) 
+                        for name in self.cParameterNames], 'float64')
+        if self.specializeParams:
+            #The parameters become constants: "const double p_x = 1.5;"
+            literals = [_cLiteral(value) for value in params]
+            c_source = re.sub(r'double (p_\w+) = p\[(\d+)\];', 
+                              lambda m: 'const double %s = %s;' 
+                                        % (m.group(1), 
+                                           literals[int(m.group(2))]),
+                              self.cSource)
+            c_dynamic = loadDynamicFunction(c_source)
+        else:
+            c_dynamic = loadDynamicFunction(self.cSource)
+        #The state variables are copied into a buffer, which is faster 
+        #than getting the pointer to the solver's array.
+        state_buf = zeros(self.stateVectorLen, 'float64')
+        out = zeros(self.stateVectorLen, 'float64')
+        params_ptr = params.ctypes.data
+        state_ptr = state_buf.ctypes.data
+        out_ptr = out.ctypes.data
+        def rhs(time, state_vars):
+            state_buf[:] = state_vars
+            c_dynamic(time, state_ptr, params_ptr, out_ptr)
+            return out
+        #the arrays must live as long as the function
+        rhs.arrays = (params, state_buf, out)
+        return rhs
+
+
+    def _specializedRhsFunction(self):
+        '''
+        Return the right hand side of the ODE, created from self.rhsSource,
+        with the current parameter values as constants. See: rhsFunction
+        '''
+        names = sorted(set(re.findall(r'\bparam\.(\w+)', self.rhsSource)))
+        values = tuple(float(getattr(self.param, name)) for name in names)
+        if self._specializedRhs[0] == values:
+            return self._specializedRhs[1]
+        literals = dict(zip(names, [_pyLiteral(value) for value in values]))
+        source = re.sub(r'\bparam\.(\w+)', 
+                        lambda m: literals[m.group(1)], self.rhsSource)
+        #The function sees the names of the generated module (sin, array,...)
+        namespace = dict(sys.modules[self.__class__.__module__].__dict__)
+        exec compile(source, '<specialized %s>' % self.__class__.__name__, 
+                     'exec') in namespace
+        self._specializedRhs = (values, namespace['dynamic'])
+        return namespace['dynamic']
+
+
+    def specialize(self, on=True):
+        '''
+        Use the parameter values as constants in the differential equations.
+        The solvers then call a function, where the parameters are literal
+        numbers instead of attributes of self.param. This is faster, when 
+        many simulations are done with the same parameters (for example with
+        different initial values), because each set of parameter values 
+        needs a new function (for the C backend the C compiler is run).
+        
+        The values are taken when a simulation starts, changes of the 
+        parameters are therefore always seen. simulateEnsemble is not 
+        affected.
+        
+        ARGUMENTS
+        ---------
+        on: bool
+            True: use constant parameters; False: normal behavior.
+        '''
+        if on and self.rhsSource is None and self.cSource is None:
+            raise ValueError('The simulation class has no source code for '
+                             'the differential equations. '
+                             'Compile with option --specialize.')
+        self.specializeParams = on
+        
+        
+    def recordToFile(self, file_name, chunk_size=10000):
+        '''
+        Write the results of simulateDynamic to disk while they are computed,
+        instead of keeping them in memory. Needed for very long simulations. 
+        
+        The results are stored in chunks of chunk_size rows (points in time). 
+        After the simulation self.resultArray and self.time are read only 
+        arrays, which read the data from disk when it is accessed. The file 
+        contains a table (see storage.ChunkedRecorder) with time as the 
+        first column, and one column for each variable.
+        
+        ARGUMENTS
+        ---------
+        file_name: str or None
+            Name of the file. None: keep results in memory.
+        chunk_size: int
+            Number of rows that are written at once.
+        '''
+        self.recordFileName = file_name
+        self.recordChunkSize = chunk_size
+
+
+    def checkpointToFile(self, file_name, times):
+        '''
+        Write checkpoints while simulateDynamic or continueDynamic are 
+        running, so that a long simulation can be resumed if it crashes.
+        
+        When the simulation reaches one of the given points in time, its 
+        state is written into the file (see saveCheckpoint); the previous 
+        checkpoint is overwritten. To resume the simulation:
+            >>> sim.loadCheckpoint('foo.ckpt')
+            >>> sim.continueDynamic()
+        
+        Checkpoints are only written when the results are kept in memory,
+        not when they are recorded to a file (see recordToFile).
+        
+        ARGUMENTS
+        ---------
+        file_name: str or None
+            Name of the file. None: write no checkpoints.
+        times: iterable of float
+            Points in time at which checkpoints are written.
+        '''
+        self.checkpointFileName = file_name
+        self.checkpointTimes = sorted(times)
+
+
+    def simulateDynamic(self, run_final=True):
         """
         Perform a dynamic simulation.
 
         The results can be displayed with the graph(...) function and stored
         with the store function. The funcion getAttributes(...) returns the
         simulation result of a speciffic attribute.
+        If run_final is False, the final method is not called.
         """
+        self.stats = SimulationStats()
         #Compute the initial values if necessary.
-        if self.initialValues == None:
+        if self.initialValues is None:
+            start = wallTime()
             self.initialize()
+            self.stats.time_initialize = wallTime() - start
+        if self.recordFileName is not None:
+            self._simulateDynamicRecording(run_final)
+            return
+        #create the array of output time points. Note: no rounding is better
+        time = linspace(0.0, self.simulation_time,
+                        self.simulation_time/self.reporting_interval + 1)
+        #Create space for storing simulation results
+        self._allocateResults(len(time))
+        self.time[:] = time
+        self.resultArray[0,0:self.stateVectorLen] = self.initialValues
+        #create integrator object and care for intitial values
+        solver = self._createSolver(self.rhsFunction(), self.jacobian, 
+                                    self.jacobianSparsity, self.time[-1])
+        solver.set_initial_value(self.initialValues, self.time[0])
+        #compute the numerical solution
+        i = self._integrateWithCheckpoints(solver, 1)
+        #generate run time error, run final function
+        #TODO: set exit state to 1
+        #TODO: terminate simulation?
+        self._finishRun(solver, self.time[0], self.resultArray[i-1,:],
+                        run_final)
+
+
+    def _allocateResults(self, n_times):
+        '''
+        Create the array for the results of a dynamic simulation, 
+        self.resultBlock: dim 1: time; dim 2: time and the variables.
+        Time is column 0, the vector of variables (state and algebraic) 
+        lies horizontally behind it. self.time and self.resultArray are 
+        views of the block. Fortran order: the time series of each 
+        variable is contiguous.
+        '''
+        self.resultBlock = zeros((n_times, 
+                                  1 + self.stateVectorLen + self.algVectorLen),
+                                 'float64', order='F')
+        self._linkResults()
+
+
+    def _linkResults(self, n_times=None):
+        '''
+        Create self.time and self.resultArray as views of self.resultBlock. 
+        n_times: if not None, only the first n_times rows are used.
+        '''
+        if n_times is not None:
+            self.resultBlock = self.resultBlock[:n_times]
+        self.time = self.resultBlock[:, 0]
+        self.resultArray = self.resultBlock[:, 1:]
+
+
+    def _simulateDynamicRecording(self, run_final=True):
+        '''
+        Perform a dynamic simulation, and write the results to the file
+        self.recordFileName while they are computed. Only one chunk of 
+        results is kept in memory.
+        '''
+        n_vars = self.stateVectorLen + self.algVectorLen
+        n_times = int(self.simulation_time/self.reporting_interval + 1)
+        dt = self.simulation_time / max(n_times - 1, 1)
+        chunk_size = self.recordChunkSize
+        #one chunk of results; time is the first column
+        chunk = zeros((chunk_size, n_vars + 1), 'float64')
+        recorder = ChunkedRecorder(self.recordFileName, n_vars + 1, 
+                                   chunk_size)
+        #create integrator object and care for intitial values
+        solver = self._createSolver(self.rhsFunction(), self.jacobian, 
+                                    self.jacobianSparsity, 
+                                    self.simulation_time)
+        solver.set_initial_value(self.initialValues, 0.0)
+        #compute the numerical solution, chunk after chunk
+        for i_first in range(0, n_times, chunk_size):
+            n_rows = min(chunk_size, n_times - i_first)
+            rows = chunk[:n_rows]
+            time = rows[:, 0]
+            time[:] = arange(i_first, i_first + n_rows) * dt
+            i_start = 0
+            if i_first == 0:
+                rows[0, 1:1 + self.stateVectorLen] = self.initialValues
+                i_start = 1
+            if i_first + n_rows == n_times:
+                time[-1] = self.simulation_time
+            n_valid = self._integrateRows(solver, time, rows[:, 1:], i_start)
+            recorder.append(rows[:n_valid])
+            if n_valid < n_rows:
+                break
+        #access results on disk
+        self.resultBlock = recorder.finish()
+        self._linkResults()
+        #generate run time error, run final function
+        self._finishRun(solver, 0.0, array(self.resultArray[-1,:]),
+                        run_final)
+
+
+    def continueDynamic(self, extra_duration=None, run_final=True):
+        '''
+        Continue a dynamic simulation, without calling initialize.
+        
+        The simulation starts at the last computed point in time, with 
+        the last computed values of the state variables. Parameters may be 
+        changed before calling this function. The new results are appended 
+        to the existing results (self.time, self.resultArray).
+        
+        ARGUMENTS
+        ---------
+        extra_duration: float or None
+            The simulation is extended by this amount of time.
+            None: continue until self.simulation_time; to resume a 
+            simulation from a checkpoint (see loadCheckpoint).
+        run_final: bool
+            If True the final method is called.
+        '''
+        if self.resultArray is None:
+            raise ValueError('There are no results to continue. '
+                             'Call simulateDynamic or loadCheckpoint first.')
+        self.stats = SimulationStats()
+        t_start = self.time[-1]
+        if extra_duration is not None:
+            self.simulation_time = t_start + extra_duration
+        #create the new output time points
+        n_new = int(round((self.simulation_time - t_start) 
+                          / self.reporting_interval))
+        if n_new < 1:
+            if t_start >= self.simulation_time:
+                return
+            n_new = 1
+        time_new = t_start + arange(1, n_new + 1) * self.reporting_interval
+        time_new[-1] = self.simulation_time
+        #Create space for the new results, behind the old results
+        n_old = len(self.time)
+        old_time, old_results = self.time, self.resultArray
+        self._allocateResults(n_old + n_new)
+        self.time[:n_old] = old_time
+        self.time[n_old:] = time_new
+        self.resultArray[:n_old] = old_results
+        #create integrator object, start at the last state
+        solver = self._createSolver(self.rhsFunction(), self.jacobian, 
+                                    self.jacobianSparsity, self.time[-1])
+        solver.set_initial_value(
+                array(self.resultArray[n_old - 1, 0:self.stateVectorLen]), 
+                t_start)
+        #compute the numerical solution
+        i = self._integrateWithCheckpoints(solver, n_old)
+        #remove unused space
+        self._linkResults(i)
+        #generate run time error, run final function
+        self._finishRun(solver, t_start, self.resultArray[i-1,:], run_final)
+
+
+    def _finishRun(self, solver, t_start, final_values, run_final):
+        '''
+        Common work at the end of a dynamic simulation: store the solver's
+        statistics in self.stats, report errors, and run the final method.
+
+        ARGUMENTS
+        ---------
+        solver:
+            The ODE solver.
+        t_start: float
+            Start time of the simulation.
+        final_values: array
+            Last row of the results, argument for the final method.
+        run_final: bool
+            If True the final method is called.
+        '''
+        stats = self.stats
+        for name, value in solverStatistics(solver).iteritems():
+            setattr(stats, name, value)
+        if stats.steps_accepted:
+            stats.step_mean = (solver.t - t_start) / stats.steps_accepted
+        #generate run time error
+        if not solver.successful():
+            print >> sys.stderr, 'error: simulation was terminated'
+        #run final function
+        if run_final:
+            start = wallTime()
+            self.final(final_values)
+            stats.time_final = wallTime() - start
+
+
+    def _integrateWithCheckpoints(self, solver, i_start):
+        '''
+        Compute the numerical solution at the points in time 
+        self.time[i_start:], store it in self.resultArray, and write 
+        checkpoints at the points in time self.checkpointTimes.
+        
+        RETURNS
+        -------
+        Number of rows that contain valid results.
+        '''
+        i = i_start
+        if self.checkpointFileName is not None:
+            for t_check in self.checkpointTimes:
+                #first point in time at or after the checkpoint time
+                i_stop = searchsorted(self.time, t_check) + 1
+                if i_stop <= i or i_stop > len(self.time):
+                    continue
+                i = self._integrateRows(solver, self.time[:i_stop], 
+                                        self.resultArray[:i_stop], i)
+                if not solver.successful():
+                    return i
+                self.saveCheckpoint(self.checkpointFileName, i)
+        return self._integrateRows(solver, self.time, self.resultArray, i)
+
+
+    def saveCheckpoint(self, file_name, n_rows=None):
+        '''
+        Store the state of a dynamic simulation in a file, so that it can 
+        be continued later. The file contains the results, the parameters, 
+        and the solution parameters. The simulation can be continued from 
+        the last stored point in time; the internal state of the ODE solver 
+        is not stored, the solver is restarted.
+        
+        The file is replaced atomically, a crash while writing does not 
+        destroy the previous checkpoint.
+        
+        ARGUMENTS
+        ---------
+        file_name: str
+            Name of the file.
+        n_rows: int or None
+            Only the first n_rows points in time are stored. 
+            None: all results are stored.
+        '''
+        if n_rows is None:
+            n_rows = len(self.time)
+        checkpoint = {
+            'class_name': self.__class__.__name__,
+            'time': array(self.time[:n_rows]),
+            'resultArray': array(self.resultArray[:n_rows]),
+            'param': dict(self.param.__dict__),
+            'initialValues': self.initialValues,
+            'stateVectorLen': self.stateVectorLen,
+            'algVectorLen': self.algVectorLen,
+            'variableNameMap': self.variableNameMap,
+            'simulation_time': self.simulation_time,
+            'reporting_interval': self.reporting_interval,
+            'solver_method': self.solver_method,
+            'rtol': self.rtol,
+            'atol': self.atol,
+            'solver_step': self.solver_step}
+        tmp_name = file_name + '.tmp'
+        tmp_file = open(tmp_name, 'wb')
+        try:
+            cPickle.dump(checkpoint, tmp_file, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            tmp_file.close()
+        os.rename(tmp_name, file_name)
+
+
+    def loadCheckpoint(self, file_name):
+        '''
+        Load the state of a dynamic simulation, which was stored with 
+        saveCheckpoint. Then the simulation can be continued with 
+        continueDynamic. Calling initialize is not necessary.
+        
+        ARGUMENTS
+        ---------
+        file_name: str
+            Name of the file.
+        '''
+        in_file = open(file_name, 'rb')
+        try:
+            checkpoint = cPickle.load(in_file)
+        finally:
+            in_file.close()
+        class_name = checkpoint.pop('class_name')
+        if class_name != self.__class__.__name__:
+            raise ValueError('Checkpoint was written by "%s" not by "%s".' 
+                             % (class_name, self.__class__.__name__))
+        self.param.__dict__.update(checkpoint.pop('param'))
+        for name, value in checkpoint.iteritems():
+            setattr(self, name, value)
+
+
+    def _integrateRows(self, solver, time, rows, i_start):
+        '''
+        Compute the numerical solution at the points in time in time[i_start:]
+        and store it in rows. The algebraic variables are computed too.
+        
+        ARGUMENTS
+        ---------
+        solver: 
+            The ODE solver, already initialized.
+        time: array
+            The points in time. Changed if the solver does not hit them.
+        rows: array
+            Storage for results, one row per point in time; state variables
+            first, then algebraic variables. rows[:i_start] must already 
+            contain the state variables.
+        i_start: int
+            Index of the first point in time that is computed.
+            
+        RETURNS
+        -------
+        Number of rows that contain valid results.
+        '''
+        start = wallTime()
+        i = i_start
+        while solver.successful() and i < len(time):
+            #do time step
+            solver.integrate(time[i])
+            #save state vars (and time)
+            time[i] = solver.t #in case solver does not hit end time
+            rows[i,0:self.stateVectorLen] = solver.y
+            i += 1
+        start_alg = wallTime()
+        #compute algebraic variables, for all new points in time at once.
+        #(Row i_start - 1 may contain only initial values.)
+        i_alg = max(i_start - 1, 0)
+        self._computeAlgebraicVariables(time[i_alg:i], rows[i_alg:i])
+        self.stats.time_integrate += start_alg - start
+        self.stats.time_algebraic += wallTime() - start_alg
+        return i
+
+
+    def _computeAlgebraicVariables(self, time, rows):
+        '''
+        Compute the algebraic variables from the state variables.
+        
+        ARGUMENTS
+        ---------
+        time: array
+            The points in time.
+        rows: array
+            One row per point in time; state variables first, then 
+            algebraic variables. The algebraic variables are stored here.
+        '''
+        if self.algVectorLen == 0 or len(time) == 0:
+            return
+        state_matrix = rows[:, 0:self.stateVectorLen]
+        if self.algebraic is not None:
+            #One vectorized call for all points in time
+            rows[:, self.stateVectorLen:] = (                               #IGNORE:E1102
+                    self.algebraic(time, state_matrix))
+        else:
+            for i in range(len(time)):
+                rows[i, self.stateVectorLen:] = (                           #IGNORE:E1111
+                        self.dynamic(time[i], state_matrix[i], 
+                                     returnAlgVars=True))
+
+
+    def simulateEnsemble(self, param_sets=None, init_sets=None):
+        """
+        Perform many dynamic simulations with different parameters or 
+        initial values at once.
+
+        All simulation runs are computed together by one call to the solver; 
+        the differential equations are evaluated for all runs at once by the
+        vectorized method dynamic_ensemble(...). This is much faster than 
+        calling simulateDynamic() in a loop, when there are many runs.
+        
+        ARGUMENTS
+        ---------
+        param_sets: list of dict or None
+            One dict per simulation run. Maps parameter names (as they 
+            appear in the Siml language) to values. Parameters that are not 
+            mentioned keep the value from the initialize method. Parameters
+            that are computed from other parameters in the initialize 
+            method are not recomputed.
+        init_sets: list of dict or None
+            One dict per simulation run. Maps state variable names to 
+            initial values. 
+            
+        If both lists are given they must have the same length.
+        
+        RETURNS
+        -------
+        Array with the results; it is also stored in 
+        self.ensembleResultArray. Dimensions: [run, time, variable]
+        The results of a single variable can be retrieved with 
+        getEnsembleAttribute(...). The final method is not called.
+        """
+        param_sets = [] if param_sets is None else list(param_sets)
+        init_sets = [] if init_sets is None else list(init_sets)
+        if param_sets and init_sets and len(param_sets) != len(init_sets):
+            raise ValueError('param_sets and init_sets must have equal length.')
+        n_runs = max(len(param_sets), len(init_sets), 1)
+        param_sets = param_sets or [{}] * n_runs
+        init_sets = init_sets or [{}] * n_runs
+        #Compute the initial values if necessary.
+        if self.initialValues is None:
+            self.initialize()
+        n_state = self.stateVectorLen
+            
+        #Create parameters with one value per run
+        ens_param = ParamStorage()
+        for siml_name, attr_name in self.parameterNameMap.iteritems():
+            setattr(ens_param, attr_name,
+                    ones((n_runs,), 'float64') * getattr(self.param, attr_name))
+        for i_run, param_set in enumerate(param_sets):
+            for siml_name, value in param_set.iteritems():
+                if siml_name not in self.parameterNameMap:
+                    raise KeyError('Unknown parameter: %s' % siml_name)
+                attr_name = self.parameterNameMap[siml_name]
+                getattr(ens_param, attr_name)[i_run] = value
+        self.derived_parameters(ens_param)
+        #Create initial values: [variable, run]
+        init_vals = zeros((n_state, n_runs), 'float64')
+        init_vals += self.initialValues.reshape((n_state, 1))
+        for i_run, init_set in enumerate(init_sets):
+            for siml_name, value in init_set.iteritems():
+                index = self.variableNameMap.get(siml_name, n_state)
+                if index >= n_state:
+                    raise KeyError('Unknown state variable: %s' % siml_name)
+                init_vals[index, i_run] = value
+                
+        #The solver sees one long vector, the variables of each run are
+        #adjacent (Fortran order); the Jacobian is block diagonal.
+        #The solvers of module integrators work directly on the 2D array 
+        #[variable, run].
+        def ensemble_rhs(time, state_vec):
+            state_vars = state_vec.reshape((n_state, n_runs), order='F')
+            state_dt = self.dynamic_ensemble(time, state_vars, ens_param)
+            if state_vec.ndim == 2:
+                return state_dt
+            return state_dt.ravel(order='F')
+        def alg_vars(time, state_vec):
+            state_vars = state_vec.reshape((n_state, n_runs), order='F')
+            return self.dynamic_ensemble(time, state_vars, ens_param, 
+                                         returnAlgVars=True).T
+        
         #create the array of output time points. Note: no rounding is better
         self.time = linspace(0.0, self.simulation_time,
                              self.simulation_time/self.reporting_interval + 1)
         #Create space for storing simulation results
-        #dim 1: time; dim 2: the different variables
-        #-> vector of variables (state and algebraic) lies horizontally
-        self.resultArray = zeros((len(self.time),
-                                  self.stateVectorLen + self.algVectorLen),
-                                 'float64')
-        self.resultArray[0,0:self.stateVectorLen] = self.initialValues
+        self.ensembleResultArray = zeros((n_runs, len(self.time),
+                                          n_state + self.algVectorLen), 
+                                         'float64')
+        state_vec0 = init_vals.ravel(order='F')
+        self.ensembleResultArray[:,0,0:n_state] = init_vals.T
+        self.ensembleResultArray[:,0,n_state:] = alg_vars(self.time[0], 
+                                                          state_vec0)
+        #The Jacobian of all runs is block diagonal
+        sparsity = None
+        if self.jacobianSparsity is not None:
+            sparsity = scipy.sparse.kron(scipy.sparse.identity(n_runs), 
+                                         self.jacobianSparsity, format='csc')
         #create integrator object and care for intitial values
-        solver = (odeInt(self.dynamic).set_integrator('vode', nsteps = 5000) #IGNORE:E1102
-                                      .set_initial_value(self.initialValues,
-                                                         self.time[0]))
+        solver = self._createSolver(ensemble_rhs, sparsity=sparsity, 
+                                    t_end=self.time[-1])
+        if isinstance(solver, (FixedStepSolver, Dopri45)):
+            solver.set_initial_value(init_vals, self.time[0])
+        else:
+            solver.set_initial_value(state_vec0, self.time[0])
         #compute the numerical solution
         i=1
         while solver.successful() and i < len(self.time):
-            #do time step
             solver.integrate(self.time[i])
-            #save state vars (and time)
             self.time[i] = solver.t #in case solver does not hit end time
-            self.resultArray[i,0:self.stateVectorLen] = solver.y
-            #compute algebraic variables (again)
-            self.resultArray[i,self.stateVectorLen:] = (                   #IGNORE:E1111
-                    self.dynamic(solver.t, solver.y, returnAlgVars=True))
+            self.ensembleResultArray[:,i,0:n_state] = (
+                    solver.y.reshape((n_state, n_runs), order='F').T)
+            self.ensembleResultArray[:,i,n_state:] = alg_vars(solver.t, 
+                                                              solver.y)
             i += 1
-        #generate run time error
         if not solver.successful():
             print >> sys.stderr, 'error: simulation was terminated'
-            #TODO: set exit state to 1
-            #TODO: terminate simulation?
-            #return
-        #run final function
-        self.final(self.resultArray[i-1,:])
+        return self.ensembleResultArray
+    
 
+    def sweep(self, grid, workers=None):
+        """
+        Perform many dynamic simulations with different parameters, initial 
+        values, or initialization functions; in parallel on several 
+        processor cores.
+        
+        Each combination of settings is a dict, that maps names to values:
+            * Parameter names (as they appear in the Siml language): the 
+              parameter gets the value after the initialization.
+            * State variable names: the initial value.
+            * Names of initialization functions ('initialize', 'init_*'): 
+              the tuple of arguments for this function. If there is no 
+              initialization function in the dict, initialize() is called.
+        The simulation object is copied for each worker process, changes to
+        its settings (solver, parameters) are therefore used in the sweep. 
+        The final method is not called.
+        
+        ARGUMENTS
+        ---------
+        grid: dict or list of dict
+            list: the combinations of settings, one dict per simulation run.
+            dict: each value is a list, all combinations of the list 
+                  elements are computed. 
+                  Example: {'D':[0.1, 0.2], 'init_r1':[(0.5,), (1.0,)]}
+        workers: int or None
+            Number of worker processes. None: number of processor cores.
+            1: compute all runs in the current process.
+            
+        RETURNS
+        -------
+        storage.EnsembleStore: store['x'][i_run, i_time] 
+        Besides the variables it contains all parameters; 
+        store.combinations contains the combinations of settings.
+        """
+        combinations = sweepCombinations(grid)
+        #Copy of the simulation object without results, used by the workers
+        template = copy.copy(self)
+        template.time = None
+        template.resultArray = None
+        template.resultBlock = None
+        template.ensembleResultArray = None
+        template.param = copy.deepcopy(self.param)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(combinations))
+        if workers <= 1:
+            _initSweepWorker(template)
+            runs = map(_runSweepCombination, combinations)
+        else:
+            #The worker processes are forked, each gets its own copy of 
+            #the simulation object.
+            pool = multiprocessing.Pool(workers, _initSweepWorker, (template,))
+            try:
+                runs = pool.map(_runSweepCombination, combinations, 
+                                chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        return EnsembleStore.fromRuns(runs, combinations)
+
+
+    def _runCombination(self, combination):
+        '''
+        Compute one simulation run of a sweep. 
+        combination: dict; see sweep(...)
+        Returns the results, and all parameters, in a BlockStore.
+        '''
+        #Call initialization function
+        init_name, init_args = 'initialize', ()
+        for name, value in combination.iteritems():
+            if name == 'initialize' or name.startswith('init_'):
+                init_name = name
+                init_args = tuple(value) if isinstance(value, (tuple, list)) \
+                            else (value,)
+        getattr(self, init_name)(*init_args)
+        #Set parameters and initial values
+        for name, value in combination.iteritems():
+            if name == init_name:
+                continue
+            elif name in self.parameterNameMap:
+                setattr(self.param, self.parameterNameMap[name], value)
+            elif self.variableNameMap.get(name, self.stateVectorLen) \
+                                                    < self.stateVectorLen:
+                self.initialValues[self.variableNameMap[name]] = value
+            else:
+                raise KeyError('Unknown parameter or state variable: %s' 
+                               % name)
+        self.simulateDynamic(run_final=False)
+        #store results and parameters
+        result = self.getResults()
+        for name, attr_name in self.parameterNameMap.iteritems():
+            result[name] = float(getattr(self.param, attr_name))
+        return result
 
-    def simulateSteadyState(self):
+
+    def simulateSteadyState(self, x0=None, time=0.0):
         """
         Perform a stady state simulation.
 
@@ -406,48 +1677,172 @@ class SimulatorBase(object):
         is found, depends on the initial guess. A steady state solution is a
         vector of all variables. This vector is appended to the array of results.
         Usually one will compute a series of stady state solutions, each with
-        slightly different parameters.
+        slightly different parameters; see also steadyStateSweep(...).
 
+        The solution is computed with a hybrid Newton method (Powell's hybrid 
+        method, scipy.optimize.root), the Jacobian matrix is computed with 
+        the jacobian(...) method if it exists.
+        
         Initial guess: When there are no prior results, the initial values are
-        (ab)used as an initial guess; otherwise the latest results are used as
+        (ab)used as an initial guess; otherwise the latest solution is used as
         the initial guess.
         In the time array the count of current simulation is stored. This way the
         graph function still produces useful graphs with steady state simulations.
+        If no solution is found, an error message is printed and a row of 
+        nan is appended to the results.
 
         The results can be displayed with the graph(...) function and stored
         with the store function. The funcion getAttributes(...) returns the
         simulation result of a speciffic attribute.
+        
+        ARGUMENTS
+        ---------
+        x0: array or None
+            Initial guess for the state variables. None: use the initial 
+            values, or the latest solution.
+        time: float
+            Time at which the differential equations are evaluated. Steady 
+            states only exist if the equations don't depend on time.
+            
+        RETURNS
+        -------
+        True if a solution was found, False otherwise.
         """
-
-        raise Exception('This method is currently broken!')
-
-        #TODO: Use flag self._isSteadyStateStart instead of self.time
-        if not hasattr(self, 'time'):
-            #this is the first call in a row of steady state simulations - setup everything
-            lastResult = -1
-            self.resultArray = array([[0]], 'float64')
-            self.time = array([0], 'float64')
-            self.initialize()    #initial guess for root finder: initial values abused
+        #Compute the initial values if necessary.
+        if self.initialValues is None:
+            self.initialize()
+        n_vars = self.stateVectorLen + self.algVectorLen
+        if self.resultArray is None or self.time is None:
+            #this is the first call in a row of steady state simulations
+            self.resultArray = zeros((0, n_vars), 'float64')
+            self.time = zeros((0,), 'float64')
+            self._steadyStateGuess = None
+        if x0 is None:
+            x0 = self._steadyStateGuess
+        if x0 is None:
             x0 = self.initialValues
-            t0 = -1
-        else:
-            lastResult = shape(self.resultArray)[0]-1
-            x0 = self.resultArray[lastResult, 0:self.stateVectorLen] #initial guess for root finder: last result
-            t0 = self.time[lastResult]
-
+        
         #compute the state variables of the steady state solution
-        (xmin, msg) = minpack.leastsq(self.dynamic, x0, (t0)) #funcion will also report local minima that are no roots. Caution!
-##        xmin = optimize.fsolve(self.dynamic, x0, (0)) #function is always stuck in one (the trivial) minimum
+        rhs = self.rhsFunction()
+        def fun(state_vars):
+            return array(rhs(time, state_vars), 'float64')
+        if self.jacobian is not None:
+            jac = lambda state_vars: self.jacobian(time, state_vars) #IGNORE:E1102
+        else:
+            jac = None
+        sol = scipy.optimize.root(fun, array(x0, 'float64'), jac=jac, 
+                                  method='hybr')
+        
         #also compute the algebraic variables
-        currRes = ones(4) #dummy to make pydev show no error
-        #currRes = self.outputEquations(xmin)
+        row = zeros((1, n_vars), 'float64')
+        if sol.success:
+            row[0, 0:self.stateVectorLen] = sol.x
+            self._computeAlgebraicVariables(array([time], 'float64'), row)
+            self._steadyStateGuess = sol.x
+        else:
+            print >> sys.stderr, 'error: no steady state solution found: ' \
+                                 + sol.message
+            row[:] = float('nan')
         #expand the storage and save the results
-        self.resultArray = resize(self.resultArray,
-                                  (lastResult+2,
-                                   self.stateVectorLen + self.algVectorLen))
-        self.resultArray[lastResult+1,:] = currRes[0,:]
-        self.time = resize(self.time, (lastResult+2,))
-        self.time[lastResult+1] = t0 + 1
+        self.resultArray = vstack((self.resultArray, row))
+        self.time = hstack((self.time, [len(self.time)]))
+        return bool(sol.success)
+
+
+    def steadyStateSweep(self, param_name, values):
+        """
+        Compute steady state solutions for a series of parameter values
+        (natural parameter continuation). Used to compute operating curves.
+        
+        One parameter is set to the values in the list one after the other, 
+        and simulateSteadyState is called. The initial guess for each 
+        solution is extrapolated (linearly) from the two previous solutions, 
+        therefore the values should change in small steps. The previous 
+        results are deleted.
+        
+        After the sweep self.time contains the parameter values; so the 
+        graph(...) function shows the operating curves. The parameter gets 
+        its original value back. Parameters that are computed from other 
+        parameters in the initialize method are not recomputed.
+        
+        ARGUMENTS
+        ---------
+        param_name: str
+            Name of the parameter as it appears in the Siml language. 
+            Example: 'r.mu_max'
+        values: sequence of float
+            The parameter values.
+            
+        RETURNS
+        -------
+        Array with the results: [parameter value, variable]; it is also 
+        stored in self.resultArray. Where no solution was found it contains 
+        nan.
+        """
+        attr_name = self.parameterNameMap[param_name]
+        if self.initialValues is None:
+            self.initialize()
+        old_value = getattr(self.param, attr_name)
+        self.clear()
+        try:
+            previous = [] #the latest solutions: [(value, state_vars), ...]
+            for value in values:
+                setattr(self.param, attr_name, value)
+                x0 = None
+                if len(previous) == 2 and previous[1][0] != previous[0][0]:
+                    #linear extrapolation from the previous solutions
+                    (p0, x_0), (p1, x_1) = previous
+                    x0 = x_1 + (x_1 - x_0) * (value - p1) / (p1 - p0)
+                success = self.simulateSteadyState(x0)
+                if not success and x0 is not None:
+                    #try again, starting at the latest solution
+                    self.resultArray = self.resultArray[:-1]
+                    self.time = self.time[:-1]
+                    success = self.simulateSteadyState()
+                if success:
+                    state_vars = self.resultArray[-1, 0:self.stateVectorLen]
+                    previous = (previous + [(value, state_vars)])[-2:]
+                else:
+                    previous = []
+        finally:
+            setattr(self.param, attr_name, old_value)
+        self.time = array(values, 'float64')
+        return self.resultArray
+
+
+
+def sweepCombinations(grid):
+    '''
+    Create the combinations of settings for a parameter sweep.
+    
+    grid: dict or list of dict
+        list: returned unchanged (as a list).
+        dict: each value is a list; a list of dicts with all combinations 
+              of the list elements is returned. 
+              
+    Example: 
+        >>> sweepCombinations({'a':[1, 2], 'b':[3]})
+        [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    '''
+    if not isinstance(grid, dict):
+        return list(grid)
+    names = sorted(grid.keys())
+    return [dict(zip(names, values)) 
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+#The simulation object of a worker process of a sweep
+_sweepSimulator = None
+
+def _initSweepWorker(simulator):
+    '''Store the simulation object of a worker process.'''
+    global _sweepSimulator #pylint:disable-msg=W0603
+    _sweepSimulator = simulator
+
+
+def _runSweepCombination(combination):
+    '''Compute one simulation run of a sweep, in a worker process.'''
+    return _sweepSimulator._runCombination(combination) #pylint:disable-msg=W0212
 
 
 
@@ -464,13 +1859,19 @@ def secureShow():
     show()
 
 
-def runSimulations(simulationClassList):
-    '''Instantiate simulation objects and run dynamic simulations'''
+def runSimulations(simulationClassList, print_stats=False):
+    '''
+    Instantiate simulation objects and run dynamic simulations.
+    If print_stats is True, print the statistics of each simulation.
+    '''
     if not isinstance(simulationClassList, list):
         simulationClassList = [simulationClassList]
     for simClass in simulationClassList:
         simObj = simClass()
         simObj.simulateDynamic()
+        if print_stats:
+            print 'statistics of simulation %s:' % simClass.__name__
+            print simObj.stats
 
 
 def parseCommandLineOptions(simulationClassList):
@@ -513,9 +1914,42 @@ def parseCommandLineOptions(simulationClassList):
                        help='specify debug areas to control printing of ' \
                             'debug information.',
                        metavar='<area,...>')
+    optPars.add_option('--solver', dest='solver',
+                       help='use this ODE solver, instead of the one ' \
+                            'specified in the Siml program. Available: %s' 
+                            % ', '.join(sorted(SOLVERS.keys())),
+                       metavar='<name>')
+    optPars.add_option('--rtol', dest='rtol', type='float',
+                       help='relative tolerance of the ODE solver',
+                       metavar='<number>')
+    optPars.add_option('--atol', dest='atol', type='float',
+                       help='absolute tolerance of the ODE solver',
+                       metavar='<number>')
+    optPars.add_option('--step', dest='step', type='float',
+                       help='step size of the fixed step ODE solvers',
+                       metavar='<number>')
+    optPars.add_option('--stats', dest='stats',
+                       action="store_true", default=False,
+                       help='print statistics of the ODE solver and the ' \
+                            'time spent in the phases of each simulation')
     
     #do the parsing
     options, _args = optPars.parse_args()
+    
+    #Set the solver options, they override the Siml program
+    SOLVER_OPTIONS.clear()
+    if options.solver:
+        try:
+            findSolver(options.solver)
+        except ValueError, err:
+            optPars.error('option "--solver": %s' % str(err))
+        SOLVER_OPTIONS['method'] = options.solver
+    if options.rtol is not None:
+        SOLVER_OPTIONS['rtol'] = options.rtol
+    if options.atol is not None:
+        SOLVER_OPTIONS['atol'] = options.atol
+    if options.step is not None:
+        SOLVER_OPTIONS['step'] = options.step or None
 
     #print start message
     if options.prepend_newline:
@@ -549,7 +1983,7 @@ def parseCommandLineOptions(simulationClassList):
     #TODO: code to run the simulation is a mess.
     #There are three different places where simulations are run!
     if options.run == 'all': #special argument 'all': -r all
-        runSimulations(simulationClassList)
+        runSimulations(simulationClassList, options.stats)
         if options.show_graphs:
             secureShow()
         sys.exit(0)
@@ -566,14 +2000,14 @@ def parseCommandLineOptions(simulationClassList):
             optPars.error('option "-r": invalid number of simulation object: %d'
                           % num)
         #run simulation
-        runSimulations(simulationClassList[num])
+        runSimulations(simulationClassList[num], options.stats)
         if options.show_graphs:
             secureShow()
         sys.exit(0)
 
     #default action: run all simulations
     #print 'Freeode (%s) main function ...' % ast.progVersion
-    runSimulations(simulationClassList)
+    runSimulations(simulationClassList, options.stats)
     if options.show_graphs:
         secureShow()
     sys.exit(0)
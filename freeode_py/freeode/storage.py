@@ -39,19 +39,137 @@ The classes have several convenience functions :
 Diferences:
     ArrayStore can only store time series (variables).
     DictStore can store variables and parameters.
+
+BlockStore is a DictStore whose time series are the columns of one 2D array
+in Fortran order. Each time series is a contiguous view into the array.
+
+EnsembleStore keeps the results of many simulation runs; it is a DictStore
+where each observation is one simulation run.
+
+ChunkedRecorder writes a table of numbers to disk while it is computed,
+for results that are too big for the memory. 
+
+RunningStats computes descriptive statistics in one pass over the data, 
+chunk by chunk.
 '''
 
 from __future__ import division
 
 from numpy import ndarray, array, hstack, zeros, isnan, all, empty, float #IGNORE:W0622
+from numpy import memmap, nan, save as saveNpy, load as loadNpy
+from numpy import asfortranarray, asarray, where, fmin, fmax, sqrt, floor
+import os
 import copy
 import cPickle
+import json
 import csv
 import datetime
+import itertools
 import pylab
 
 
 
+def _readOnly(arr):
+    '''Return a read only view of an array.'''
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
+def _csvDataLines(fileObj):
+    '''Iterate over the lines of a CSV file; skip comments and blank lines.'''
+    for line in fileObj:
+        if line.startswith('#') or not line.strip():
+            continue
+        yield line
+
+
+def _parseCSVChunk(lines, numCols):
+    '''
+    Convert lines of comma separated numbers to a 2D array, one row per line.
+    Cells that do not contain a number become nan.
+    '''
+    #fast path: numbers only, let Numpy convert the strings
+    if all([line.count(',') == numCols - 1 for line in lines]):
+        cells = ','.join(lines).split(',')
+        try:
+            return array(cells, float).reshape(len(lines), numCols)
+        except ValueError:
+            pass
+    #slow path: quoted cells, empty cells, text
+    rows = list(csv.reader(lines))
+    for row in rows:
+        if len(row) != numCols:
+            raise ValueError('Each line of the CSV file must contain %d '
+                             'values. Wrong line: %s' % (numCols, ','.join(row)))
+    return array([map(BaseStore.str2float, row) for row in rows], 
+                 float).reshape(len(rows), numCols)
+
+
+def readCSVColumns(lineIter, numRows=None, chunkSize=10000):
+    '''
+    Read a table of numbers from a CSV file: A line with the attribute 
+    names, then lines with numbers. The lines are read and converted in 
+    chunks, and copied into preallocated arrays, one per column. 
+    
+    Arguments:
+    lineIter  : iterator over the lines, without comments (_csvDataLines)
+    numRows   : number of lines with numbers; None: read until the end
+    chunkSize : number of lines that are converted at once
+    
+    Returns:
+    nameList, columns
+    nameList  : the attribute names; list of str
+    columns   : the numbers; 2D numpy.ndarray, 
+                columns[i] are the numbers of attribute nameList[i]
+    '''
+    nameList = map(BaseStore.stripStr, csv.reader([lineIter.next()]).next())
+    numCols = len(nameList)
+    columns = empty((numCols, chunkSize if numRows is None else numRows), 
+                    float)
+    numObs = 0
+    while numRows is None or numObs < numRows:
+        if numRows is not None:
+            chunkSize = min(chunkSize, numRows - numObs)
+        chunk = list(itertools.islice(lineIter, chunkSize))
+        if not chunk:
+            break
+        #grow the arrays
+        if numObs + len(chunk) > columns.shape[1]:
+            newColumns = empty((numCols, 2 * columns.shape[1]), float)
+            newColumns[:, 0:numObs] = columns[:, 0:numObs]
+            columns = newColumns
+        columns[:, numObs:numObs + len(chunk)] = \
+            _parseCSVChunk(chunk, numCols).T
+        numObs += len(chunk)
+    if numObs < columns.shape[1]:
+        columns = columns[:, 0:numObs].copy()
+    return nameList, columns
+
+
+def writeCSVColumns(fileObj, nameList, columns, chunkSize=10000):
+    '''
+    Write a table of numbers to a CSV file: A line with the attribute 
+    names, then lines with numbers. The numbers are converted in chunks.
+    
+    Arguments:
+    fileObj   : the file; it should be buffered.
+    nameList  : the attribute names; list of str
+    columns   : the numbers; list of 1D numpy.ndarray, one per attribute
+    chunkSize : number of lines that are converted at once
+    '''
+    writer = csv.writer(fileObj)
+    writer.writerow(nameList)
+    numObs = len(columns[0]) if len(columns) > 0 else 0
+    chunk = empty((min(chunkSize, numObs), len(columns)), float)
+    for start in xrange(0, numObs, chunkSize):
+        stop = min(start + chunkSize, numObs)
+        for iCol, column in enumerate(columns):
+            chunk[0:stop - start, iCol] = column[start:stop]
+        writer.writerows(chunk[0:stop - start].tolist())
+
+
+
 class BaseStore(object):
     '''
     Base class for the numeric containers. 
@@ -79,7 +197,7 @@ class BaseStore(object):
     @staticmethod 
     def _getExtension(fileName):
         '''Find the file extension of a filename.'''
-        return fileName.split('.')[-1].strip()
+        return fileName.rstrip(os.sep).split('.')[-1].strip()
 
     @staticmethod 
     def str2float(inStr):
@@ -124,6 +242,111 @@ class BaseStore(object):
         return
 
 
+    def _columnChunks(self, attrNames, chunkSize):
+        '''
+        Iterate over the values of attributes in chunks. Attributes of 
+        the same shape are processed together. 
+        
+        Yields (indices, chunk):
+        indices : the attributes in the chunk are attrNames[i] for i in indices
+        chunk   : 2D array, one column per attribute, at most about chunkSize 
+                  rows. The array is reused for the next chunk.
+        '''
+        values = [self[name] for name in attrNames]
+        groups = {}
+        for i, val in enumerate(values):
+            groups.setdefault(val.shape, []).append(i)
+        for shape, indices in sorted(groups.items()):
+            #2D attributes (EnsembleStore): chunks of whole rows
+            rowSize = 1
+            for size in shape[1:]:
+                rowSize *= size
+            step = max(1, chunkSize // max(rowSize, 1))
+            chunk = empty((min(step, shape[0]) * rowSize, len(indices)), float)
+            for start in xrange(0, shape[0], step):
+                stop = min(start + step, shape[0])
+                numVals = (stop - start) * rowSize
+                for iCol, iAttr in enumerate(indices):
+                    chunk[0:numVals, iCol] = values[iAttr][start:stop].ravel()
+                yield indices, chunk[0:numVals]
+    
+    def statistics(self, attrNames=None, chunkSize=10000):
+        '''
+        Compute descriptive statistics of attributes, in one pass over the 
+        data, chunkSize values at a time. nan values are ignored. 
+        Arguments:
+            attrNames : list of attribute names; None means all attributes.
+            chunkSize : number of values per attribute that are processed 
+                        at once.
+        Returns:
+            RunningStats; one column per attribute.
+        '''
+        if attrNames is None:
+            attrNames = sorted(self.attributeNames()) #IGNORE:E1111
+        stats = RunningStats(len(attrNames), list(attrNames))
+        for indices, chunk in self._columnChunks(attrNames, chunkSize):
+            stats.update(chunk, indices)
+        return stats
+    
+    def windowStatistics(self, window, attrNames=None, timeName='time', 
+                         chunkSize=10000):
+        '''
+        Compute descriptive statistics of attributes in time windows. 
+        The windows have the length "window" and start at the first point 
+        in time. nan values are ignored.
+        
+        The attributes must have the same shape as the time. For an 
+        EnsembleStore the time is a 2D array, one row per run; the 
+        statistics of each window contain the values of all runs. Points 
+        in time that are nan (padding of shorter runs) are ignored.
+        Arguments:
+            window    : length of the time windows; float
+            attrNames : list of attribute names; None means all attributes 
+                        with the shape of the time, except the time.
+            timeName  : name of the attribute that contains the time.
+            chunkSize : number of values per attribute that are processed 
+                        at once.
+        Returns:
+            windowStarts, windowStats
+            windowStarts : start time of each window that contains data; 
+                           1D array
+            windowStats  : RunningStats for each window; list
+        '''
+        time = self[timeName]
+        if attrNames is None:
+            attrNames = sorted(name for name in self.attributeNames() #IGNORE:E1111
+                               if name != timeName and 
+                               getattr(self[name], 'shape', None) == time.shape)
+        attrNames = list(attrNames)
+        for name in attrNames:
+            if getattr(self[name], 'shape', None) != time.shape:
+                raise ValueError('Attribute "%s" must have the same shape as '
+                                 '"%s".' % (name, timeName))
+        #first point in time; of all runs for an EnsembleStore
+        tStart = time[0] if time.ndim == 1 else fmin.reduce(time[:, 0])
+        windowStats = {}
+        #The time is the last column of the chunks, the attributes and the 
+        #time have the same shape, and are therefore in the same chunks.
+        for indices, chunk in self._columnChunks(attrNames + [timeName], 
+                                                 chunkSize):
+            columns, chunkTime = indices[:-1], chunk[:, -1]
+            isValid = ~isnan(chunkTime)
+            if not isValid.all():
+                chunk, chunkTime = chunk[isValid], chunkTime[isValid]
+            windowIds = floor((chunkTime - tStart) / window).astype(int)
+            #rows of the same window are consecutive, when time increases
+            bounds = [0] + list((windowIds[1:] != windowIds[:-1]).nonzero()[0] 
+                                + 1) + [len(windowIds)]
+            for begin, end in zip(bounds[:-1], bounds[1:]):
+                wStats = windowStats.get(windowIds[begin])
+                if wStats is None:
+                    wStats = RunningStats(len(attrNames), attrNames)
+                    windowStats[windowIds[begin]] = wStats
+                wStats.update(chunk[begin:end, :-1], columns)
+        windowIds = sorted(windowStats.keys())
+        windowStarts = array(windowIds, float) * window + tStart
+        return windowStarts, [windowStats[i] for i in windowIds]
+    
     def computeStats(self, attrNames):
         ''' 
         Print descriptive statistics on selected attributes
@@ -134,6 +357,7 @@ class BaseStore(object):
         if len(attrNames) == 0:
             attrNames = self.attributeNames() #IGNORE:E1111
             attrNames.sort()
+        statistics = self.statistics(attrNames)
         
         stats = ''
         #stats += '\n============================================================================== \n'
@@ -146,16 +370,13 @@ class BaseStore(object):
         stats += 'attribute            min          max          mean         std.dev      nan \n'
         stats += '============================================================================== \n'
 
-        for name1 in attrNames:
-            var1 = self[name1]
-            #compute some statistics
-            whereNan = isnan(var1)
-            varNoNan = var1[whereNan == False] #remove nan values from vector
-            minValStr =  '%g' % varNoNan.min()
-            maxValStr =  '%g' % varNoNan.max()
-            meanValStr = '%g' % varNoNan.mean()
-            stdDevStr =  '%g' % varNoNan.std()
-            sumNanStr =  '%g' % sum(whereNan)
+        mean, stdDev = statistics.mean(), statistics.std()
+        for i, name1 in enumerate(attrNames):
+            minValStr =  '%g' % statistics.min[i]
+            maxValStr =  '%g' % statistics.max[i]
+            meanValStr = '%g' % mean[i]
+            stdDevStr =  '%g' % stdDev[i]
+            sumNanStr =  '%g' % statistics.numNan[i]
             stats += '%-20s %-12s %-12s %-12s %-12s %-12s \n' \
                % (name1, minValStr, maxValStr, meanValStr, stdDevStr, sumNanStr)    
         return stats
@@ -193,10 +414,10 @@ class ArrayStore(BaseStore):
         self.attrNameDict = {}
         '''The attribute names, and associated collumn indices: {'foo':0, 'bar':1}''' 
         #initialize from data
-        if varArray != None or nameList != None:
+        if varArray is not None or nameList is not None:
             self.createFromData(varArray, nameList)
         #initialize from from file 
-        elif fileName != None:
+        elif fileName is not None:
             self.load(fileName)
             
 
@@ -238,8 +459,17 @@ class ArrayStore(BaseStore):
                 + repr(self.attributeNames()) + ')'
     
     def copy(self):
-        '''Create a deep copy of the object'''
-        return copy.deepcopy(self)
+        '''
+        Create a copy of the object, that shares the array with the original
+        (copy on write). The shared array becomes read only, in the original 
+        and in the copy; it is copied when an attribute is changed with 
+        store['x'] = ... . Use copy.deepcopy(store) for a writable copy.
+        '''
+        if self.dataArray is not None and self.dataArray.flags.writeable:
+            self.dataArray = _readOnly(self.dataArray)
+        newStore = copy.copy(self)
+        newStore.attrNameDict = self.attrNameDict.copy()
+        return newStore
     
     def clear(self):
         '''Remove all data from the object.'''
@@ -299,40 +529,13 @@ class ArrayStore(BaseStore):
 
     def _loadCSV(self, fileName):
         '''Load data from a csv file.'''
-        #Uses the CSV reader and an entirey hommade algorithm.
-        #however there are library functions for doing this, that are  
-        #probably faster:
-        #    scipy.io.read_array
-        #    pylab's load function (seems to be fastest)
-        
-        #read whole file at once
         f = open(fileName, 'r')
-        lines = f.readlines() 
-        f.close()
-        
-        #self.clear()
-        #delete lines that the csv reader can not understand
-        for i in range(len(lines)-1,-1,-1):
-            #delete comment lines
-            if lines[i].startswith('#'):
-                del lines[i]
-            #delete blank lines (conaining only whitespace)
-            if len(lines[i].strip()) == 0:
-                del lines[i]
-                
-        #interpret remaining lines as CSV
-        reader = csv.reader(lines)
-        varNameList = reader.next() #first line: attribute names
-        varNameList = map(self.stripStr, varNameList) #remove leading trailing spaces
-        #put numbers into nested list
-        dataList = []
-        for line in reader:
-            lineFloat = map(self.str2float, line) #convert strings to floating point
-            dataList.append(lineFloat)       #append to nested list
-        #convert nested list to array
-        dataArray = array(dataList)
+        try:
+            varNameList, columns = readCSVColumns(_csvDataLines(f))
+        finally:
+            f.close()
         #put data into internal structures
-        self.createFromData(dataArray, varNameList)
+        self.createFromData(columns.T, varNameList)
 
 
     def _loadPickle(self, fileName):
@@ -369,7 +572,7 @@ class ArrayStore(BaseStore):
 
     def _saveCSV(self, fileName):
         '''Dump the data into a csv file'''
-        f = open(fileName, 'w')
+        f = open(fileName, 'w', 2**16)
         #write header - time and date
         today = datetime.datetime.today()
         date = today.date().isoformat()
@@ -377,10 +580,8 @@ class ArrayStore(BaseStore):
         f.write('#Generated on %s - %s\n' % (date, time))
         f.write('\n')
         #write data
-        writer = csv.writer(f)
         nameList = self.attributeNames() #get sorted list of attribute names
-        writer.writerow(nameList)   #write the attribute names
-        writer.writerows(self.dataArray) #write the numeric data
+        writeCSVColumns(f, nameList, [self[name] for name in nameList])
         f.close()
 
 
@@ -489,6 +690,8 @@ class ArrayStore(BaseStore):
         #change existing data
         if varName in self.attrNameDict:
             i = self.attrNameDict[varName]
+            if not self.dataArray.flags.writeable: #shared with a copy
+                self.dataArray = self.dataArray.copy()
             self.dataArray[:,i] = newVals
             return self
         #add new attribute 
@@ -568,10 +771,10 @@ class DictStore(BaseStore):
         self._numObs = None
         '''Number of observations (items) in time series (number of array elements)'''
         #initialize from data
-        if varArray != None or nameList != None or valDict != None:
+        if varArray is not None or nameList is not None or valDict is not None:
             self.createFromData(varArray, nameList, valDict)
         #initialize from from file 
-        elif fileName != None:
+        elif fileName is not None:
             self.load(fileName)
 
 
@@ -582,7 +785,7 @@ class DictStore(BaseStore):
         '''
         self.dataDict = {}
         #use data from array and name list
-        if varArray != None or nameList != None:
+        if varArray is not None or nameList is not None:
             #Construct an Array Store object (to do all the type checking)
             tempStore = ArrayStore(varArray, nameList)
             #determine the number of observations
@@ -591,7 +794,7 @@ class DictStore(BaseStore):
             for name in nameList:
                 self[name] = tempStore[name]
         #if a dictionary of values is given, take the data out of it
-        if valDict != None:
+        if valDict is not None:
             if not isinstance(valDict, dict):
                 raise TypeError('Argument "valDict" must be of type "dict"') 
             #get data from dict and put it into object
@@ -615,8 +818,23 @@ class DictStore(BaseStore):
         return repStr
     
     def copy(self):
-        '''Create a deep copy of the object'''
-        return copy.deepcopy(self)
+        '''
+        Create a copy of the object, that shares the arrays with the original
+        (copy on write). The shared arrays become read only, in the original 
+        and in the copy; assigning a new array to an attribute with 
+        store['x'] = ... changes only one of the objects. 
+        Use copy.deepcopy(store) for a copy with writable arrays.
+        '''
+        self._shareArrays()
+        newStore = copy.copy(self)
+        newStore.dataDict = self.dataDict.copy()
+        return newStore
+    
+    def _shareArrays(self):
+        '''Make the arrays read only, so that copies can share them.'''
+        for name, val in self.dataDict.items():
+            if isinstance(val, ndarray) and val.flags.writeable:
+                self.dataDict[name] = _readOnly(val)
     
     def clear(self):
         '''Remove all data from the object.'''
@@ -680,6 +898,11 @@ class DictStore(BaseStore):
         'csv' : When the filename ends in '.csv' the routine tries to 
                 interpret the file as comma seperated values. The attribute 
                 names must be in the first row
+        'simres' : A directory with one ".npy" file per time series. 
+                The time series are memory mapped, only the parts that 
+                are accessed are read from disk. 
+                A file (not a directory) with this extension is in pickle 
+                format; older versions stored results this way.
         Any other extension is considered to mean a file in Python's pickle
         format.
         
@@ -698,51 +921,30 @@ class DictStore(BaseStore):
         # opening the file for reading
         if fext == 'csv':
             self._loadCSV(fileName)
+        elif fext == 'simres' and not os.path.isfile(fileName):
+            self._loadSimres(fileName)
         else: #fext == 'dstore':
             self._loadPickle(fileName)
 
 
     def _loadCSV(self, fileName):
         '''Load data from a csv file.'''
-        #Uses the CSV reader and an entirey hommade algorithm.
-        #however there are library functions for doing this, that are  
-        #probably faster:
-        #    scipy.io.read_array
-        #    pylab's load function (seems to be fastest)
-        
-        #read whole file at once
         f = open(fileName, 'r')
-        lines = f.readlines() 
-        f.close()
-        
-        #self.clear()
-        #delete lines that the csv reader can not understand
-        for i in range(len(lines)-1,-1,-1):
-            #delete comment lines
-            if lines[i].startswith('#'):
-                del lines[i]
-            #delete blank lines (conaining only whitespace)
-            if len(lines[i].strip()) == 0:
-                del lines[i]
-                
-        #interpret remaining lines as  CSV
-        reader = csv.reader(lines)
-        #First two lines: scalar values (parameters)
-        nameList = reader.next() #read parameter names
-        nameList = map(self.stripStr, nameList) #remove leading or trailing spaces
-        dataList = reader.next() #read parameter values
-        dataList = map(self.str2float, dataList) #convert strings to floating point
-        self.dataDict = dict(zip(nameList, dataList)) #put data into internal dict
-        #Following lines until end: array values (attributes)
-        nameList = reader.next() #read parameter names
-        nameList = map(self.stripStr, nameList) #remove leading or trailing spaces
-        #put numbers into nested list
-        dataList = []
-        for line in reader:
-            lineFloat = map(self.str2float, line) #convert strings to floating point
-            dataList.append(lineFloat)   #append to nested list
-        dataArray = array(dataList).T    #convert nested list to array
-        self.dataDict.update(dict(zip(nameList, dataArray))) #add data to internal dict
+        try:
+            lines = _csvDataLines(f)
+            #First two lines: scalar values (parameters)
+            paramNames, paramValues = readCSVColumns(lines, numRows=1)
+            #Following lines until end: array values (attributes)
+            varNames, columns = readCSVColumns(lines)
+        finally:
+            f.close()
+        #put data into internal dict
+        self.dataDict = {}
+        for name, values in zip(paramNames, paramValues):
+            self.dataDict[name] = float(values[0])
+        self._numObs = columns.shape[1] if varNames else None
+        for name, values in zip(varNames, columns):
+            self.dataDict[name] = values
 
 
     def _loadPickle(self, fileName):
@@ -754,6 +956,31 @@ class DictStore(BaseStore):
         f.close()
 
 
+    def _loadSimres(self, fileName):
+        '''
+        Load data from a directory in "simres" format (see _saveSimres).
+        The time series are memory mapped copy on write: changes are not 
+        written back to the files.
+        
+        Returns:
+        The header; dict
+        '''
+        f = open(os.path.join(fileName, 'header.json'), 'r')
+        header = json.load(f)
+        f.close()
+        if header.get('format') != 'simres':
+            raise ValueError('Not a simulation result in "simres" format: %s' 
+                             % fileName)
+        self.dataDict = {}
+        self._numObs = header['numObs']
+        for name, value in header['parameters'].iteritems():
+            self.dataDict[str(name)] = value
+        for name, colFile in header['columns'].iteritems():
+            self.dataDict[str(name)] = loadNpy(os.path.join(fileName, colFile),
+                                               mmap_mode='c')
+        return header
+
+
     def save(self, file_name):
         '''
         Store the data in a CSV or Pickle file.
@@ -770,6 +997,12 @@ class DictStore(BaseStore):
             * In each block of information, the first row contains the 
               attribute names, subsequent rows contain the numeric values.
                 
+        'simres' : When the filename ends in '.simres' a directory is 
+            created, that contains one binary file per time series, in 
+            Numpy's ".npy" format, and a header "header.json" with the 
+            parameters and the attribute names. Loading this format is fast, 
+            because the time series are memory mapped. 
+                
         For any other extension a file in Python's "pickle" format (version 2) 
         is created.
         
@@ -781,6 +1014,8 @@ class DictStore(BaseStore):
             
             When the filename ends with ".csv" a human readable file with 
             comma separated values is created.
+            When it ends with ".simres" a directory with binary files is 
+            created.
             Otherwise Python's "pickle" format (version 2) is used. 
         
         RETURNS
@@ -791,13 +1026,15 @@ class DictStore(BaseStore):
         fext = self._getExtension(file_name)
         if fext == 'csv':
             self._saveCSV(file_name)
+        elif fext == 'simres':
+            self._saveSimres(file_name)
         else: #elif fext == 'pickle':
             self._savePickle(file_name)
 
 
     def _saveCSV(self, fileName):
         '''Dump the data into a csv file'''
-        f = open(fileName, 'w')
+        f = open(fileName, 'w', 2**16)
         #write header - time and date
         today = datetime.datetime.today()
         date = today.date().isoformat()
@@ -815,10 +1052,7 @@ class DictStore(BaseStore):
         #Get arrays, assemble them in a big array, and write them
         f.write('#Variables:\n')
         varNames = self.variableNames()
-        tempStore = self.extract(varNames)
-        writer.writerow(tempStore.dataDict.keys())   #write the names
-        tempArray = array(tempStore.dataDict.values()).T #convert dict values to big array
-        writer.writerows(tempArray) #write the values 
+        writeCSVColumns(f, varNames, [self.dataDict[name] for name in varNames])
         f.close()
 
 
@@ -828,6 +1062,43 @@ class DictStore(BaseStore):
         cPickle.dump(self, f, 2)
         f.close()
 
+
+    def _saveSimres(self, fileName, extraHeader=None):
+        '''
+        Store the data in a directory: One ".npy" file per time series, 
+        and a header "header.json" with the parameter values and the names 
+        of the time series' files. Files of an earlier result in the 
+        directory are removed.
+        
+        Arguments:
+        fileName    : name of the directory; string
+        extraHeader : additional entries for the header; dict
+        '''
+        #replace a pickle file of an older version
+        if os.path.isfile(fileName):
+            os.remove(fileName)
+        if not os.path.isdir(fileName):
+            os.makedirs(fileName)
+        for oldFile in os.listdir(fileName):
+            if oldFile.endswith('.npy') or oldFile == 'header.json':
+                os.remove(os.path.join(fileName, oldFile))
+        header = {'format':'simres', 'version':1, 'numObs':self._numObs,
+                  'parameters':{}, 'columns':{}}
+        for iCol, name in enumerate(sorted(self.dataDict.keys())):
+            value = self.dataDict[name]
+            if isinstance(value, ndarray):
+                colFile = 'col%d.npy' % iCol
+                saveNpy(os.path.join(fileName, colFile), value)
+                header['columns'][name] = colFile
+            else:
+                header['parameters'][name] = value
+        if extraHeader:
+            header.update(extraHeader)
+        #the header is written last: it marks a complete result
+        f = open(os.path.join(fileName, 'header.json'), 'w')
+        json.dump(header, f, indent=1, sort_keys=True, default=float)
+        f.close()
+
     def __delitem__(self, attrName):
         '''
         Delete specified attribute from the DataStore.
@@ -986,6 +1257,451 @@ class DictStore(BaseStore):
     
     
     
+class BlockStore(DictStore):
+    '''
+    DictStore whose time series are stored in a single 2D array.
+    
+    The array (self.block) is in Fortran order, each attribute is one column;
+    the time series in self.dataDict are views of the columns, they are 
+    contiguous in memory. A memory mapped array (numpy.memmap, see 
+    loadRecording) is used as it is; its data stays on disk. Pickling the object (and copy.deepcopy) copies the 
+    array in one piece, self.copy() shares it. Replacing or deleting a time 
+    series removes it from the block; new time series are stored like in 
+    DictStore. 
+    '''
+    
+    #Defaults for objects that were not created from an array
+    block = None
+    '''The time series; 2D numpy.ndarray in Fortran order'''
+    columnIndex = {}
+    '''Column in self.block of each time series; dict {name: index}'''
+
+    def createFromData(self, varArray=None, nameList=None, valDict=None):
+        '''
+        Create object from a 2D array and the names of its columns; 
+        and also a dict of arrays or floats. 
+        
+        Arguments:
+        varArray : the data; 2D numpy.ndarray, each attribute is a column.
+                   The array is copied if it is not in Fortran order, 
+                   unless it is a numpy.memmap.
+        nameList : the attribute names; list of str, or a dict 
+                   {name: column index} if not all columns have a name.
+        valDict  : Dictionary of name value pairs
+        '''
+        self.dataDict = {}
+        self.block = None
+        self.columnIndex = {}
+        if varArray is not None or nameList is not None:
+            if not isinstance(varArray, ndarray) or varArray.ndim != 2:
+                raise TypeError('Argument "varArray" must be a 2D numpy.ndarray.')
+            if isinstance(nameList, dict):
+                columnIndex = dict(nameList)
+            elif len(nameList) == varArray.shape[1]:
+                columnIndex = dict((name, i) for i, name in enumerate(nameList))
+            else:
+                raise ValueError('"nameList" must have an entry for each ' 
+                                 'column of "varArray"')
+            for name in columnIndex:
+                if not isinstance(name, str):
+                    raise TypeError('attribute names must be strings.')
+            if isinstance(varArray, memmap) and varArray.dtype == float:
+                self.block = varArray
+            else:
+                self.block = asfortranarray(varArray, float)
+            self.columnIndex = columnIndex
+            self._numObs = self.block.shape[0]
+            self._linkColumns()
+        if valDict is not None:
+            if not isinstance(valDict, dict):
+                raise TypeError('Argument "valDict" must be of type "dict"') 
+            for name, val in valDict.iteritems():
+                self[name] = val
+            
+            
+    def _linkColumns(self):
+        '''Put views of the block's columns into self.dataDict.'''
+        for name, index in self.columnIndex.iteritems():
+            self.dataDict[name] = self.block[:, index]
+        
+        
+    def __getstate__(self):
+        '''Pickle and copy the block, but not the views of its columns.'''
+        state = self.__dict__.copy()
+        state['dataDict'] = dict((name, val) 
+                                 for name, val in self.dataDict.iteritems()
+                                 if name not in self.columnIndex)
+        return state
+    
+    def __setstate__(self, state):
+        '''Recreate the views of the block's columns after unpickling.'''
+        self.__dict__.update(state)
+        self._linkColumns()
+        
+        
+    def _shareArrays(self):
+        '''Make the arrays read only, so that copies can share them.'''
+        if self.block is not None and self.block.flags.writeable:
+            self.block = _readOnly(self.block)
+            self._linkColumns()
+        DictStore._shareArrays(self)
+        
+        
+    def clear(self):
+        '''Remove all data from the object.'''
+        DictStore.clear(self)
+        self.block = None
+        self.columnIndex = {}
+        
+        
+    def load(self, fileName):
+        '''Load data from a file. See DictStore.load'''
+        self.block = None
+        self.columnIndex = {}
+        DictStore.load(self, fileName)
+        
+        
+    def __setitem__(self, varName, newVal):
+        '''
+        Change the values of one time series (through []).
+        If the attribute name is unknown to the object, the attribute is added.
+        A replaced time series is no longer stored in the block.
+        '''
+        DictStore.__setitem__(self, varName, newVal)
+        if varName in self.columnIndex:
+            del self.columnIndex[varName]
+            
+            
+    def __delitem__(self, attrName):
+        '''Delete specified attribute from the store.'''
+        DictStore.__delitem__(self, attrName)
+        if attrName in self.columnIndex:
+            del self.columnIndex[attrName]
+    
+    
+    
+class EnsembleStore(DictStore):
+    '''
+    Results of many simulation runs (for example a parameter sweep). 
+    
+    Each observation is one simulation run: 
+        store['x'][i_run, i_time] is variable x of run i_run, 
+        store['p'][i_run]         is parameter p of run i_run.
+    'time' is an array too, because the runs can have different durations.
+    The time series of runs with less points in time are padded with nan.
+    
+    The settings that created each run are in self.combinations; 
+    the results of a single run can be retrieved with self.run(i_run).
+    '''
+    
+    def __init__(self, valDict=None, combinations=None, fileName=None):
+        '''
+        Arguments:
+        valDict      : Dictionary of name: array pairs. 
+        combinations : list of dicts; the settings of each run.
+        fileName     : name of a file from which the object's contents is 
+                       loaded.
+        '''
+        self.combinations = [] if combinations is None else list(combinations)
+        '''The settings of each simulation run; list of dict'''
+        DictStore.__init__(self, valDict=valDict, fileName=fileName)
+        
+        
+    @staticmethod
+    def fromRuns(runs, combinations=None):
+        '''
+        Create an EnsembleStore from the results of single simulation runs. 
+        
+        Arguments:
+        runs         : list of DictStore, one per simulation run. 
+                       All runs must have the same attributes.
+        combinations : list of dicts; the settings of each run.
+        
+        Returns:
+        EnsembleStore
+        '''
+        valDict = {}
+        if runs:
+            nTimes = max([run.numObs() for run in runs])
+            for name in runs[0].attributeNames():
+                #parameters: one value per run
+                if name not in runs[0].variableNames():
+                    valDict[name] = array([float(run.dataDict[name]) 
+                                           for run in runs])
+                    continue
+                #variables: one row per run, padded with nan
+                data = empty((len(runs), nTimes), 'float64')
+                data.fill(nan)
+                for iRun, run in enumerate(runs):
+                    vals = run[name]
+                    data[iRun, 0:len(vals)] = vals
+                valDict[name] = data
+        return EnsembleStore(valDict, combinations)
+            
+            
+    def numRuns(self):
+        '''Return the number of simulation runs.'''
+        return self.numObs() if self.dataDict else 0
+    
+    
+    def run(self, iRun):
+        '''
+        Return the results of a single simulation run as a DictStore. 
+        The time series are not padded with nan.
+        '''
+        #number of valid points in time
+        time = self.dataDict['time'][iRun]
+        nTimes = len(time) - isnan(time[::-1]).argmin()
+        result = DictStore()
+        for name, val in self.dataDict.iteritems():
+            if val.ndim == 2:
+                result[name] = val[iRun, 0:nTimes]
+            else:
+                result[name] = float(val[iRun])
+        return result
+        
+        
+    def copy(self):
+        '''Create a copy on write copy of the object. See DictStore.copy'''
+        newStore = DictStore.copy(self)
+        newStore.combinations = copy.deepcopy(self.combinations)
+        return newStore
+    
+    
+    def clear(self):
+        '''Remove all data from the object.'''
+        DictStore.clear(self)
+        self.combinations = []
+        
+        
+    def _saveSimres(self, fileName, extraHeader=None):
+        '''Store the data in "simres" format, with the combinations.'''
+        extraHeader = dict(extraHeader or {}, combinations=self.combinations)
+        DictStore._saveSimres(self, fileName, extraHeader)
+        
+        
+    def _loadSimres(self, fileName):
+        '''Load data in "simres" format, with the combinations.'''
+        header = DictStore._loadSimres(self, fileName)
+        self.combinations = [dict((str(name), value) 
+                                  for name, value in combination.iteritems())
+                             for combination in header.get('combinations', [])]
+        return header
+        
+        
+        
+class ChunkedRecorder(object):
+    '''
+    Store a table of numbers on disk, while it is computed.
+    
+    Rows are appended at the end of the table. They are collected in a 
+    buffer of chunkSize rows; when the buffer is full it is appended to 
+    the file. The file contains the raw numbers (float64, row after row) 
+    and nothing else. The recorded data is read back with 
+    loadRecording(...), which does not load it into memory.
+    
+    Usage:
+        rec = ChunkedRecorder('results.bin', 3)
+        rec.append(array([[0., 1., 2.]]))
+        data = rec.finish()
+    '''
+    def __init__(self, fileName, numCols, chunkSize=10000):
+        '''
+        ARGUMENTS
+        ---------
+        fileName: str
+            Name of the file. An existing file is overwritten.
+        numCols: int
+            Number of columns of the table.
+        chunkSize: int
+            Number of rows that are written to disk at once.
+        '''
+        object.__init__(self)
+        self.fileName = fileName
+        '''Name of the file'''
+        self.numCols = numCols
+        '''Number of columns of the table'''
+        self.numRows = 0
+        '''Number of rows that have been appended'''
+        self._buffer = empty((chunkSize, numCols), 'float64')
+        self._bufferRows = 0
+        self._file = open(fileName, 'wb')
+        
+        
+    def append(self, rows):
+        '''
+        Append rows at the end of the table. 
+        rows: 2D array, shape: (number of rows, numCols)
+        '''
+        rows = array(rows, 'float64', copy=False, ndmin=2)
+        if rows.shape[1] != self.numCols:
+            raise ValueError('Wrong number of columns: %d, expected: %d.'
+                             % (rows.shape[1], self.numCols))
+        chunkSize = self._buffer.shape[0]
+        iStart = 0
+        while iStart < rows.shape[0]:
+            nCopy = min(chunkSize - self._bufferRows, rows.shape[0] - iStart)
+            self._buffer[self._bufferRows:self._bufferRows + nCopy] = \
+                                            rows[iStart:iStart + nCopy]
+            self._bufferRows += nCopy
+            iStart += nCopy
+            if self._bufferRows == chunkSize:
+                self.flush()
+        self.numRows += rows.shape[0]
+            
+            
+    def flush(self):
+        '''Write the buffered rows to disk.'''
+        self._buffer[:self._bufferRows].tofile(self._file)
+        self._file.flush()
+        self._bufferRows = 0
+        
+        
+    def finish(self):
+        '''
+        Write the remaining rows to disk, and close the file. 
+        Returns the recorded data (see loadRecording).
+        '''
+        self.flush()
+        self._file.close()
+        return loadRecording(self.fileName, self.numCols)
+
+
+
+def loadRecording(fileName, numCols):
+    '''
+    Access a table that was written by ChunkedRecorder. 
+    
+    The data is not loaded into memory; it is read from disk when it is
+    accessed (numpy.memmap, read only).
+    
+    ARGUMENTS
+    ---------
+    fileName: str
+        Name of the file.
+    numCols: int
+        Number of columns of the table.
+        
+    RETURNS
+    -------
+    Array like object, shape: (number of rows, numCols)
+    '''
+    numRows = os.path.getsize(fileName) // (8 * numCols)
+    if numRows == 0:
+        #memmap can not map empty files
+        return zeros((0, numCols), 'float64')
+    return memmap(fileName, 'float64', 'r', shape=(numRows, numCols))
+    
+    
+    
+class RunningStats(object):
+    '''
+    Descriptive statistics of the columns of a table of numbers: number of 
+    values, number of nan, minimum, maximum, mean and standard deviation. 
+    nan values are ignored.
+    
+    The data is given in chunks of rows (update), so that big tables, for 
+    example recordings on disk (see loadRecording), are processed without 
+    loading them into memory. Means and squared deviations of the chunks 
+    are combined with the method of Chan et al., a generalization of 
+    Welford's algorithm that is numerically stable.
+    '''
+    
+    def __init__(self, numCols, names=None):
+        '''
+        Arguments:
+        numCols : number of columns
+        names   : names of the columns; list of str.
+        '''
+        self.names = names
+        '''Names of the columns; list of str or None'''
+        self.count = zeros(numCols)
+        '''Number of values that are not nan'''
+        self.numNan = zeros(numCols)
+        '''Number of nan values'''
+        self.min = empty(numCols)
+        self.min.fill(nan)
+        self.max = self.min.copy()
+        self._mean = zeros(numCols)
+        self._m2 = zeros(numCols)
+        '''Sum of squared differences from the mean'''
+        
+        
+    @staticmethod
+    def fromArray(data, chunkSize=10000, names=None):
+        '''
+        Compute the statistics of the columns of a 2D array, chunkSize rows 
+        at a time. The array may be a numpy.memmap (see loadRecording). 
+        '''
+        stats = RunningStats(data.shape[1], names)
+        for start in xrange(0, data.shape[0], chunkSize):
+            stats.update(data[start:start + chunkSize])
+        return stats
+    
+    
+    def update(self, chunk, columns=slice(None)):
+        '''
+        Add data to the statistics.
+        
+        Arguments:
+        chunk   : 2D array, one row per observation; one column per column 
+                  of the statistics, or per column in the argument columns.
+        columns : the columns of the statistics that are updated; 
+                  list of int or slice.
+        '''
+        chunk = asarray(chunk, float)
+        if chunk.ndim == 1:
+            chunk = chunk.reshape(-1, 1)
+        isNan = isnan(chunk)
+        numNan = isNan.sum(0)
+        count = chunk.shape[0] - numNan
+        #mean and squared deviations of the chunk, without the nan values
+        mean = where(isNan, 0., chunk).sum(0) / where(count > 0, count, 1)
+        deviation = where(isNan, 0., chunk - mean)
+        m2 = (deviation * deviation).sum(0)
+        self._combine(columns, count, mean, m2)
+        self.numNan[columns] += numNan
+        if chunk.shape[0] > 0:
+            self.min[columns] = fmin(self.min[columns], fmin.reduce(chunk, 0))
+            self.max[columns] = fmax(self.max[columns], fmax.reduce(chunk, 0))
+        
+        
+    def merge(self, other):
+        '''
+        Add the statistics of other data with the same columns, for example 
+        of an other simulation run.
+        '''
+        self._combine(slice(None), other.count, other._mean, other._m2)
+        self.numNan += other.numNan
+        self.min = fmin(self.min, other.min)
+        self.max = fmax(self.max, other.max)
+        
+        
+    def _combine(self, columns, count, mean, m2):
+        '''Combine count, mean and squared deviations of two data sets.'''
+        oldCount = self.count[columns]
+        total = oldCount + count
+        delta = mean - self._mean[columns]
+        ratio = count / where(total > 0, total, 1)
+        self._mean[columns] += delta * ratio
+        self._m2[columns] += m2 + delta * delta * oldCount * ratio
+        self.count[columns] = total
+        
+        
+    def mean(self):
+        '''Return the means of the columns; nan for columns without data.'''
+        return where(self.count > 0, self._mean, nan)
+    
+    
+    def std(self):
+        '''
+        Return the (population) standard deviations of the columns; 
+        nan for columns without data.
+        '''
+        return sqrt(self._m2 / where(self.count > 0, self.count, nan))
+    
+    
+    
 #------------ testcode -------------------------------------------------------
 if __name__ == '__main__':
 
@@ -1074,6 +1790,12 @@ if __name__ == '__main__':
             '''ArrayStore: Test copying the DataStore object'''
             newStore = self.store.copy()
             self.assertTrue(newStore == self.store)
+            #copy on write
+            self.assertTrue(newStore.dataArray.base is self.store.dataArray.base)
+            self.assertRaises(ValueError, newStore['b'].__setitem__, 0, 42)
+            newStore['b'] = ones(6)
+            self.assertTrue(all(newStore['b'] == 1))
+            self.assertTrue(all(self.store['b'] == self.numData[:, 1]))
     
             
         def test_clear(self):
@@ -1257,6 +1979,19 @@ if __name__ == '__main__':
             '''DictStore: Test copying the DataStore object'''
             newStore = self.store.copy()
             self.assertTrue(newStore == self.store)
+            #copy on write: arrays are shared and read only
+            self.assertTrue(newStore['b'].base is self.store['b'].base)
+            self.assertRaises(ValueError, newStore['b'].__setitem__, 0, 42)
+            self.assertRaises(ValueError, self.store['b'].__setitem__, 0, 42)
+            oldB = self.store['b']
+            newStore['b'] = ones(6)
+            newStore['p'] = 3.
+            self.assertTrue(self.store['b'] is oldB)
+            self.assertEqual(self.store['p'][0], 10)
+            #deep copies are writable
+            newStore = copy.deepcopy(self.store)
+            newStore['b'][0] = 42
+            self.assertNotEqual(self.store['b'][0], 42)
     
             
         def test_clear(self):
@@ -1338,6 +2073,61 @@ if __name__ == '__main__':
             #newStore.save('test_dictstore1.csv')
             self.assertTrue(self.store == newStore)
             
+            
+        def test_readCSVColumns(self):
+            '''DictStore: Test the chunked CSV reader.'''
+            lines = ['a, b\n', '1,2\n', '3,"4"\n', '5,foo\n', '7,8\n', '9,10\n']
+            #chunks with 2 lines; the arrays must grow; text becomes nan
+            names, columns = readCSVColumns(iter(lines), chunkSize=2)
+            self.assertEqual(names, ['a', 'b'])
+            self.assertTrue(all(columns[0] == array([1., 3., 5., 7., 9.])))
+            self.assertTrue(isnan(columns[1, 2]))
+            self.assertEqual(columns[1, 4], 10.)
+            #read a fixed number of lines, continue with the next table
+            lineIter = iter(lines)
+            names, columns = readCSVColumns(lineIter, numRows=1)
+            self.assertEqual(columns.shape, (2, 1))
+            names, columns = readCSVColumns(lineIter)
+            self.assertEqual(names, ['3', '4'])
+            self.assertEqual(columns.shape, (2, 3))
+            #all lines must have the same number of values
+            self.assertRaises(ValueError, readCSVColumns, 
+                              iter(['a,b\n', '1,2\n', '3\n']))
+            #also when the number of values in the chunk is right
+            self.assertRaises(ValueError, readCSVColumns, 
+                              iter(['a,b\n', '1,2,3\n', '4\n']))
+            
+            
+        def test_save_load_simres(self):
+            '''DictStore: Test saving and loading "simres" directories.'''
+            fileName = 'test_dictstore.simres'
+            self.store.save(fileName)
+            newStore = DictStore()
+            newStore.load(fileName)
+            self.assertTrue(self.store == newStore)
+            self.assertTrue(isinstance(newStore['b'], memmap))
+            #changes are not written to the file
+            newStore['b'][0] = 42
+            newStore.load(fileName)
+            self.assertTrue(self.store == newStore)
+            #save again, with fewer attributes
+            del self.store['b']
+            self.store.save(fileName)
+            newStore.load(fileName)
+            self.assertTrue(self.store == newStore)
+            
+            
+        def test_load_pickled_simres(self):
+            '''DictStore: Load a ".simres" file of older versions (pickle).'''
+            fileName = 'test_dictstore_old.simres'
+            self.store._savePickle(fileName)
+            newStore = DictStore(fileName=fileName)
+            self.assertTrue(self.store == newStore)
+            #saving replaces the file with a directory
+            newStore.save(fileName)
+            self.assertTrue(os.path.isdir(fileName))
+            self.assertTrue(self.store == DictStore(fileName=fileName))
+            
          
         def test_info(self):
             '''DictStore: Try the info function.'''   
@@ -1388,6 +2178,213 @@ if __name__ == '__main__':
             self.assertTrue(newStore != self.store)
             
 
+    class TestBlockStore(unittest.TestCase):
+        '''Unit tests for the BlockStore class'''
+        
+        def setUp(self):
+            '''perform common setup tasks for each test'''
+            self.numData = linspace(0, 29, 30).reshape(6, 5)
+            self.store = BlockStore(self.numData, ['a','b','c','d','time'])
+            self.store['p'] = 10.
+            
+        def test__init__(self):
+            '''BlockStore: columns are contiguous views of the block'''
+            self.assertTrue(self.store.block.flags.f_contiguous)
+            self.assertTrue(self.store['b'].flags.c_contiguous)
+            self.assertTrue(all(self.store['b'] == self.numData[:, 1]))
+            self.assertEqual(self.store.numObs(), 6)
+            self.assertEqual(set(self.store.variableNames()), 
+                             set(['a','b','c','d','time']))
+            #dict of names: indices; not all columns need a name
+            store = BlockStore(self.numData, {'b':1, 'time':4})
+            self.assertEqual(sorted(store.attributeNames()), ['b', 'time'])
+            self.assertRaises(ValueError, BlockStore, self.numData, ['a'])
+            
+        def test_copy(self):
+            '''BlockStore: copies and pickles contain one block'''
+            for newStore in [copy.deepcopy(self.store), 
+                             cPickle.loads(cPickle.dumps(self.store, 2))]:
+                self.assertTrue(isinstance(newStore, BlockStore))
+                self.assertTrue(newStore == self.store)
+                newStore['b'][0] = 42
+                self.assertEqual(newStore.block[0, 1], 42)
+                self.assertNotEqual(self.store['b'][0], 42)
+            #copy on write: the block is shared
+            newStore = self.store.copy()
+            self.assertTrue(newStore == self.store)
+            self.assertTrue(newStore.block is self.store.block)
+            self.assertRaises(ValueError, newStore['b'].__setitem__, 0, 42)
+            newStore['b'] = ones(6)
+            self.assertTrue(all(self.store['b'] == self.numData[:, 1]))
+            
+        def test__setitem__(self):
+            '''BlockStore: replaced attributes are removed from the block'''
+            newData = array([0., 1., 0., 1., 0., 1.])
+            self.store['b'] = newData
+            del self.store['c']
+            newStore = self.store.copy()
+            self.assertTrue(all(newStore['b'] == newData))
+            self.assertFalse('c' in newStore)
+            self.assertEqual(newStore.block[0, 1], 1.)
+            
+            
+    class TestEnsembleStore(unittest.TestCase):
+        '''Unit tests for the EnsembleStore class'''
+        
+        def setUp(self):
+            '''perform common setup tasks for each test'''
+            #two runs with different number of points in time
+            self.run0 = DictStore(valDict={'time':linspace(0, 2, 3), 
+                                           'x':array([1., 2., 3.]), 'p':1.})
+            self.run1 = DictStore(valDict={'time':linspace(0, 1, 2), 
+                                           'x':array([4., 5.]), 'p':2.})
+            self.store = EnsembleStore.fromRuns([self.run0, self.run1], 
+                                                [{'p':1.}, {'p':2.}])
+            
+        def test_fromRuns(self):
+            self.assertEqual(self.store.numRuns(), 2)
+            self.assertEqual(self.store['x'].shape, (2, 3))
+            self.assertTrue(isnan(self.store['x'][1, 2]))
+            self.assertTrue((self.store['p'] == array([1., 2.])).all())
+            self.assertEqual(self.store.combinations[1], {'p':2.})
+            
+        def test_run(self):
+            self.assertTrue(self.store.run(0) == self.run0)
+            self.assertTrue(self.store.run(1) == self.run1)
+            
+        def test_copy(self):
+            newStore = self.store.copy()
+            self.assertTrue(isinstance(newStore, EnsembleStore))
+            self.assertEqual(newStore.combinations, self.store.combinations)
+            
+        def test_save_load_simres(self):
+            fileName = 'test_ensemblestore.simres'
+            self.store.save(fileName)
+            newStore = EnsembleStore(fileName=fileName)
+            self.assertTrue(newStore.run(1) == self.run1)
+            self.assertEqual(newStore.combinations, self.store.combinations)
+            
+            
+    class TestRunningStats(unittest.TestCase):
+        '''Unit tests for the RunningStats class'''
+        
+        def setUp(self):
+            '''perform common setup tasks for each test'''
+            self.data = linspace(0, 29, 30).reshape(10, 3) ** 2
+            self.data[2, 1] = nan
+            self.data[:, 2] = nan
+            
+        def checkStats(self, stats, data):
+            '''Compare the statistics with the results of Numpy.'''
+            col = data[:, 0]
+            self.assertEqual(stats.count[0], len(col))
+            self.assertEqual((stats.min[0], stats.max[0]), 
+                             (col.min(), col.max()))
+            self.assertAlmostEqual(stats.mean()[0], col.mean(), 10)
+            self.assertAlmostEqual(stats.std()[0], col.std(), 10)
+            col = data[:, 1][~isnan(data[:, 1])]
+            self.assertEqual(stats.numNan[1], 1)
+            self.assertAlmostEqual(stats.mean()[1], col.mean(), 10)
+            self.assertAlmostEqual(stats.std()[1], col.std(), 10)
+            #column without values
+            self.assertEqual(stats.count[2], 0)
+            self.assertTrue(isnan(stats.mean()[2]) and isnan(stats.std()[2])
+                            and isnan(stats.min[2]))
+            
+        def test_update(self):
+            '''RunningStats: data in chunks of different sizes'''
+            for chunkSize in [1, 3, 10]:
+                self.checkStats(RunningStats.fromArray(self.data, chunkSize), 
+                                self.data)
+            
+        def test_merge(self):
+            '''RunningStats: combine statistics of parts of the data'''
+            stats = RunningStats.fromArray(self.data[0:4])
+            stats.merge(RunningStats.fromArray(self.data[4:]))
+            self.checkStats(stats, self.data)
+            
+        def test_store_statistics(self):
+            '''RunningStats: statistics of stores, in time windows'''
+            store = DictStore(valDict={'time':linspace(0, 9, 10), 
+                                       'a':self.data[:, 0], 'p':2.})
+            stats = store.statistics(['a', 'p'], chunkSize=3)
+            self.assertEqual(stats.names, ['a', 'p'])
+            self.assertEqual(stats.mean()[1], 2.)
+            self.assertAlmostEqual(stats.std()[0], self.data[:, 0].std(), 10)
+            starts, wStats = store.windowStatistics(4., ['a'], chunkSize=3)
+            self.assertTrue(all(starts == array([0., 4., 8.])))
+            self.assertEqual([s.count[0] for s in wStats], [4, 4, 2])
+            self.assertEqual(wStats[1].min[0], self.data[4, 0])
+            self.assertEqual(wStats[2].max[0], self.data[9, 0])
+            #2D attributes of EnsembleStore
+            ens = EnsembleStore({'x':self.data[:, 0:2].T.copy()})
+            stats = ens.statistics(['x'], chunkSize=4)
+            self.assertEqual((stats.count[0], stats.numNan[0]), (19, 1))
+            
+        def test_ensemble_window_statistics(self):
+            '''RunningStats: time windows of an EnsembleStore'''
+            #the second run is shorter, it is padded with nan
+            runs = [DictStore(valDict={'time':linspace(0, 9, 10), 
+                                       'a':self.data[:, 0], 
+                                       'b':-self.data[:, 0], 'p':1.}), 
+                    DictStore(valDict={'time':linspace(0, 5, 6), 
+                                       'a':self.data[0:6, 1], 
+                                       'b':-self.data[0:6, 0], 'p':2.})]
+            ens = EnsembleStore.fromRuns(runs)
+            for chunkSize in [3, 7, 10000]:
+                starts, wStats = ens.windowStatistics(4., chunkSize=chunkSize)
+                self.assertTrue(all(starts == array([0., 4., 8.])))
+                self.assertEqual(wStats[0].names, ['a', 'b'])
+                #window 0: run 0 rows 0..3, run 1 rows 0..3 (one nan)
+                self.assertEqual(list(wStats[0].count), [7, 8])
+                self.assertEqual(list(wStats[1].count), [6, 6])
+                self.assertEqual(list(wStats[2].count), [2, 2])
+                self.assertEqual(wStats[1].max[0], 
+                                 max(self.data[7, 0], self.data[5, 1]))
+                self.assertEqual(wStats[1].min[1], -self.data[7, 0])
+                self.assertEqual(wStats[2].min[1], -self.data[9, 0])
+            #parameters have a different shape than the time
+            self.assertRaises(ValueError, ens.windowStatistics, 4., ['p'])
+            
+            
+    class TestChunkedRecorder(unittest.TestCase):
+        '''Unit tests for the ChunkedRecorder class'''
+        
+        def setUp(self):
+            '''perform common setup tasks for each test'''
+            self.numData = linspace(0, 69, 70).reshape(14, 5) #IGNORE:E1101
+            self.fileName = 'test-chunked-recorder.bin'
+            
+        def tearDown(self):
+            '''delete the file'''
+            os.remove(self.fileName)
+            
+        def test_append(self):
+            #append rows in pieces that do not fit the chunks
+            rec = ChunkedRecorder(self.fileName, 5, chunkSize=4)
+            rec.append(self.numData[0])
+            rec.append(self.numData[1:6])
+            #full chunks are already on disk
+            self.assertEqual(len(loadRecording(self.fileName, 5)), 4)
+            rec.append(self.numData[6:])
+            self.assertEqual(rec.numRows, 14)
+            data = rec.finish()
+            self.assertTrue(isinstance(data, memmap))
+            self.assertTrue((data == self.numData).all())
+            self.assertTrue((loadRecording(self.fileName, 5) == 
+                             self.numData).all())
+            
+        def test_empty(self):
+            rec = ChunkedRecorder(self.fileName, 5)
+            data = rec.finish()
+            self.assertEqual(data.shape, (0, 5))
+            
+        def test_append_error(self):
+            rec = ChunkedRecorder(self.fileName, 5)
+            self.assertRaises(ValueError, rec.append, self.numData[:, 0:4])
+            rec.finish()
+            
+            
 #------ Run the tests --------------------------------------------------------
 #    #perform the doctests
 #    def doDoctest():
@@ -1400,6 +2397,10 @@ if __name__ == '__main__':
     testSuite = unittest.TestSuite()
     testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestArrayStore))
     testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestDictStore))
+    testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBlockStore))
+    testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestEnsembleStore))
+    testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestRunningStats))
+    testSuite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestChunkedRecorder))
     unittest.TextTestRunner(verbosity=2).run(testSuite)
 
     #pylab.show()
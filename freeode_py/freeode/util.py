@@ -961,8 +961,13 @@ def compile_run(in_name, test_suffix='_testprog',
     '''
     Compile and run a simulation. 
     
-    Returns the simulation's text output (stdout). The created files are removed
-    after the simulation has been run.
+    Returns the simulation's text output (stdout). 
+    
+    The program is compiled and run in the current process (see
+    simlcompiler.compile_string), no files are created. Only if extra_args 
+    are given, or graphs should be shown, the compiler is started as a 
+    separate process; the created files are removed after the simulation 
+    has been run.
     
     Arguments
     ---------
@@ -990,6 +995,9 @@ def compile_run(in_name, test_suffix='_testprog',
            'The input file must have the extension *.siml'
     out_base = in_name[:-5] + test_suffix
     
+    if not extra_args and no_graphs:
+        return _compile_run_in_process(in_name, run_sims)
+    
     #create the bash command
     outname_args = ' -o %s ' % (out_base + '.py')
     run_args = '-r %s ' % run_sims
@@ -1009,3 +1017,38 @@ def compile_run(in_name, test_suffix='_testprog',
     if clean_up:
         os.remove(out_base+'.py')
     return res_txt
+
+
+def _compile_run_in_process(in_name, run_sims='all'):
+    '''
+    Compile and run a simulation in the current process, see compile_run.
+    Returns the text output (stdout) of the simulation. 
+    '''
+    #imported here, because this module is imported by the compiler
+    from StringIO import StringIO
+    from freeode.simlcompiler import compile_string
+    from freeode import simulatorbase
+    
+    siml_text = open(in_name, 'r').read()
+    #Compile and run simulation(s) like new processes would; catch the output
+    global_sets = [DEBUG_AREAS, simulatorbase.DEBUG_AREAS, 
+                   simulatorbase.SOLVER_OPTIONS]
+    old_contents = [set_or_dict.copy() for set_or_dict in global_sets]
+    for set_or_dict in global_sets:
+        set_or_dict.clear()
+    old_stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        module = compile_string(siml_text, in_name)
+        classes = module.simulationClasses
+        if run_sims != 'all':
+            classes = classes[int(run_sims)]
+        simulatorbase.runSimulations(classes)
+        del sys.modules[module.__name__]
+        res_txt = sys.stdout.getvalue()
+    finally:
+        sys.stdout = old_stdout
+        for set_or_dict, old_content in zip(global_sets, old_contents):
+            set_or_dict.clear()
+            set_or_dict.update(old_content)
+    debug_print('Program output: \n', res_txt, sep='')
+    return res_txt
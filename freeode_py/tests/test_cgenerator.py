@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#    Copyright (C) 2009 - 2010 by Eike Welk                                *
+#    eike.welk@gmx.net                                                     *
+#                                                                          *
+#    License: GPL                                                          *
+#                                                                          *
+#    This program is free software; you can redistribute it and/or modify  *
+#    it under the terms of the GNU General Public License as published by  *
+#    the Free Software Foundation; either version 2 of the License, or     *
+#    (at your option) any later version.                                   *
+#                                                                          *
+#    This program is distributed in the hope that it will be useful,       *
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#    GNU General Public License for more details.                          *
+#                                                                          *
+#    You should have received a copy of the GNU General Public License     *
+#    along with this program; if not, write to the                         *
+#    Free Software Foundation, Inc.,                                       *
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             *
+#***************************************************************************
+
+"""
+Test code for the "cgenerator.py" and "clibrary.py" modules
+"""
+
+from __future__ import division
+from __future__ import absolute_import              #IGNORE:W0410
+
+from py.test import skip as skip_test # pylint: disable-msg=F0401,E0611,W0611
+from py.test import fail as fail_test # pylint: disable-msg=F0401,E0611,W0611
+
+from freeode.util import assert_raises
+
+
+
+def skip_without_c_compiler():
+    '''Skip the test if there is no C compiler.'''
+    from distutils.spawn import find_executable
+    from freeode.clibrary import C_COMPILER
+    if find_executable(C_COMPILER) is None:
+        skip_test('C compiler "%s" not found.' % C_COMPILER)
+
+
+
+def test_CExpressionGenerator_1(): #IGNORE:C01111
+    msg = 'Test creation of C expression strings. Check all operators'
+    #skip_test(msg)
+    print msg
+    from freeode.cgenerator import CExpressionGenerator
+    from freeode.util import func
+    from freeode.interpreter import IFloat, IBool, BUILTIN_LIB
+    from freeode.ast import RoleConstant, NodeFuncCall, NodeParentheses
+
+    e_gen = CExpressionGenerator()
+    #create some variables and numbers
+    a = IFloat()
+    a.target_name = 'a'
+    b = IFloat()
+    b.target_name = 'param.b'
+    t = IFloat()
+    t.target_name = 'time'
+    c = IFloat(2)
+    c.role = RoleConstant
+
+    #Get some functions that are converted into C operators
+    add = func(IFloat.__add__)
+    mul = func(IFloat.__mul__)
+    pow = func(IFloat.__pow__)
+    mod = func(IFloat.__mod__)
+    neg = func(IFloat.__neg__)
+    lt = func(IFloat.__lt__)
+    not_ = func(IBool.__siml_not__)
+    and_ = func(IBool.__siml_and2__)
+
+    #variables have prefixes, binary operators are in parentheses
+    expr = NodeFuncCall(add, (a, NodeFuncCall(mul, (b, t))))
+    expr_str = e_gen.create_expression(expr)
+    print expr_str
+    assert expr_str == '(v_a + (p_b * time))'
+    #power and modulo are functions
+    expr = NodeFuncCall(pow, (a, NodeFuncCall(mod, (b, c))))
+    expr_str = e_gen.create_expression(expr)
+    print expr_str
+    assert expr_str == 'pow(v_a, siml_mod(p_b, 2.0))'
+    #prefix operators
+    expr = NodeFuncCall(not_, (NodeFuncCall(and_, (NodeFuncCall(lt, (a, b)),
+                                                   NodeFuncCall(neg, (c,)))),))
+    expr_str = e_gen.create_expression(expr)
+    print expr_str
+    assert expr_str == '!(((v_a < p_b) && -(2.0)))'
+    #parentheses
+    expr = NodeParentheses((a,))
+    assert e_gen.create_expression(expr) == '(v_a)'
+    #functions; max with three arguments
+    expr = NodeFuncCall(BUILTIN_LIB.max, (a, b, c))
+    expr_str = e_gen.create_expression(expr)
+    print expr_str
+    assert expr_str == 'fmax(fmax(v_a, p_b), 2.0)'
+    expr = NodeFuncCall(BUILTIN_LIB.abs, (a,))
+    assert e_gen.create_expression(expr) == 'fabs(v_a)'
+
+
+
+def test_CProgramGenerator__compare_python():
+    msg = \
+    '''
+    Test the C backend: The results of a simulation must be the same
+    with differential equations in C and in Python. The model uses
+    all kinds of operators, functions and "if" statements.
+    '''
+    #skip_test(msg)
+    print msg
+    skip_without_c_compiler()
+
+    import os
+    from numpy import abs as np_abs
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.cgenerator import CProgramGenerator
+    from freeode.interpreter import Interpreter
+
+    prog_text = \
+'''
+class Oscillator:
+    data x, v, a, e, s: Float
+    data k, d, y: Float param
+
+    func initialize(this):
+        k = 3; d = 0.2; y = 1.5
+        x = 1; v = 0; s = 0
+        solution_parameters(10, 0.1)
+
+    func dynamic(this):
+        a = -k * x - d * v
+        if x > 0.5 and not v > 1:
+            e = x ** 2 % 0.3
+        elif x < -0.5 or v < -1:
+            e = max(max(x, v), -0.2) - abs(v)
+        else:
+            e = sqrt(exp(x)) + log(y) - sin(time) * cos(x) / tan(1 + y)
+        $x = v
+        $v = a + min(e, 0.1)
+        $s = 0
+        print(e)
+
+compile Oscillator
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    sims = intp.get_compiled_objects()
+    #create the Python program, and the program with C backend
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', sims)
+    cg = CProgramGenerator()
+    cg.create_program('foo.siml', sims)
+    #print cg.get_buffer()
+
+    #write the buffers into files, import the files as modules
+    #progname must be unique! otherwise race condition!
+    modules = []
+    for gen, progname in [(pg, 'testprog_CProgramGenerator__compare_py'),
+                          (cg, 'testprog_CProgramGenerator__compare_c')]:
+        prog_text_file = open(progname + '.py','w')
+        prog_text_file.write(gen.get_buffer())
+        prog_text_file.close()
+        modules.append(__import__(progname))
+    py_module, c_module = modules
+    assert py_module.Oscillator.cSource is None
+    assert 'void dynamic(' in c_module.Oscillator.cSource
+
+    #the BDF method with Newton iteration is insensitive to the last bits 
+    #of the time derivatives, that differ between C and Python
+    sim_py = py_module.Oscillator()
+    sim_py.solver_method = 'vode_bdf'
+    sim_py.simulateDynamic()
+    sim_c = c_module.Oscillator()
+    sim_c.solver_method = 'vode_bdf'
+    sim_c.simulateDynamic()
+    #the solver really calls the C function
+    assert hasattr(sim_c.rhsFunction(), 'arrays')
+    assert np_abs(sim_c.resultArray - sim_py.resultArray).max() < 1e-12
+    #all branches of the "if" statement were taken
+    x = sim_c.getAttribute('x')
+    assert x.max() > 0.5 and x.min() < -0.5
+
+    #parameters are copied when the simulation starts
+    sim_c.param.k = 2
+    sim_c.simulateDynamic()
+    sim_py.param.k = 2
+    sim_py.simulateDynamic()
+    assert np_abs(sim_c.resultArray - sim_py.resultArray).max() < 1e-12
+    #the parameters are constants in the C code
+    sim_c.specialize()
+    sim_c.simulateDynamic()
+    assert np_abs(sim_c.resultArray - sim_py.resultArray).max() < 1e-12
+
+    #clean up
+    for progname in ['testprog_CProgramGenerator__compare_py',
+                     'testprog_CProgramGenerator__compare_c']:
+        os.remove(progname + '.py')
+        os.remove(progname + '.pyc')
+
+
+
+def test_CProgramGenerator__derived_parameters():
+    msg = \
+    '''
+    Test the C backend with hidden parameters, that contain expressions
+    depending only on parameters. They are at the end of the parameter 
+    array, and are recomputed when the simulation starts.
+    '''
+    #skip_test(msg)
+    print msg
+    skip_without_c_compiler()
+
+    import os
+    from numpy import abs as np_abs
+    from freeode.cgenerator import CProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.optimizer import (check_simulation_objects,
+                                   optimize_simulation_objects)
+
+    prog_text = \
+'''
+class Oscillator:
+    data x, v: Float
+    data k, m, d: Float param
+
+    func initialize(this):
+        k = 3; m = 2; d = 0.2
+        x = 1; v = 0
+        solution_parameters(10, 0.1)
+
+    func dynamic(this):
+        $x = v
+        $v = -k / m * x - d * v
+
+compile Oscillator
+'''
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    sims = intp.get_compiled_objects()
+    check_simulation_objects(sims)
+    optimize_simulation_objects(sims)
+    cg = CProgramGenerator()
+    cg.create_program('foo.siml', sims)
+
+    progname = 'testprog_CProgramGenerator__derived_parameters'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(cg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    assert module.Oscillator.cParameterNames[-1] == '_derived1'
+
+    sim = module.Oscillator()
+    sim.initialize()
+    sim.param.m = 3
+    sim.simulateDynamic()
+    #compare with the Python function
+    sim.cSource = None
+    res_c = sim.resultArray
+    sim.simulateDynamic()
+    assert np_abs(res_c - sim.resultArray).max() < 1e-12
+    assert sim.param._derived1 == -1
+
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+
+def test_buildLibrary__error():
+    msg = 'Errors of the C compiler are reported with CBuildError.'
+    #skip_test(msg)
+    print msg
+    skip_without_c_compiler()
+
+    from freeode.clibrary import loadLibrary, CBuildError
+
+    assert_raises(CBuildError, None, loadLibrary,
+                  'this is no C code;\n')
+
+
+
+def test_cacheDirectory():
+    msg = \
+    '''
+    The cache directory of the shared libraries is created only accessible
+    by the current user; directories, where other users can write, are
+    refused. Libraries of different compiler options are distinct.
+    '''
+    #skip_test(msg)
+    print msg
+
+    import os
+    import stat
+    import shutil
+    import tempfile
+    from freeode import clibrary
+    from freeode.clibrary import cacheDirectory, libraryKey, CBuildError
+
+    tmp_dir = tempfile.mkdtemp()
+    old_cache_dir, old_flags = clibrary.CACHE_DIR, clibrary.C_FLAGS
+    try:
+        #new directory: only the user has access
+        clibrary.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+        assert cacheDirectory() == clibrary.CACHE_DIR
+        assert stat.S_IMODE(os.stat(clibrary.CACHE_DIR).st_mode) == 0700
+        #directory where everybody can write
+        os.chmod(clibrary.CACHE_DIR, 0777)
+        assert_raises(CBuildError, None, cacheDirectory)
+        #the compiler options are part of the libraries' names
+        key = libraryKey('int x;\n')
+        clibrary.C_FLAGS = old_flags + ['-DFOO']
+        assert libraryKey('int x;\n') != key
+    finally:
+        clibrary.CACHE_DIR, clibrary.C_FLAGS = old_cache_dir, old_flags
+        shutil.rmtree(tmp_dir)
+
+
+
+if __name__ == '__main__':
+    # Debugging code may go here.
+    test_CProgramGenerator__compare_python()
+    pass #pylint:disable-msg=W0107
@@ -377,6 +377,278 @@ compile A
 
 
 
+def test_SymbolicDifferentiator_1(): #IGNORE:C01111
+    msg = '''Test symbolic differentiation of the dynamic function. 
+    Test structure of the Jacobian and zero fill in "if" statements.'''
+    #skip_test(msg)
+    print msg
+    
+    from freeode.optimizer import SymbolicDifferentiator
+    from freeode.interpreter import Interpreter
+    from freeode.ast import NodeAssignment, NodeIfStmt
+    from freeode.util import DotName
+
+    prog_text = \
+'''
+class A:
+    data p1: Float param
+    data x, y, z, a, b: Float
+    
+    func dynamic(this): 
+        a = p1 * x
+        if y > p1:
+            b = y * x
+        else:
+            b = p1 
+        $x = a
+        $y = b + sin(a) 
+        $z = p1 + 1
+        
+compile A
+'''
+
+    #interpret the program
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, None, 'test')
+    sim = intp.get_compiled_objects()[0]
+    #create Python names, the differentiator needs them
+    for name, attr in sim.attributes.iteritems():
+        attr.target_name = '_'.join(name).replace('$', 'D')
+    x, y, z = [sim.get_attribute(DotName(n)) for n in ['x', 'y', 'z']]
+    b = sim.get_attribute(DotName('b'))
+    dynamic = sim.get_attribute(DotName('dynamic'))
+    
+    diff = SymbolicDifferentiator()
+    stmts, jac = diff.create_jacobian(dynamic.statements, 
+                                      [x.time_derivative, y.time_derivative, 
+                                       z.time_derivative], 
+                                      [x, y, z])
+    #Test structure of the Jacobian: None means structural zero
+    assert jac[0][0] is not None and jac[0][1] is None and jac[0][2] is None
+    assert jac[1][0] is not None and jac[1][1] is not None and jac[1][2] is None
+    assert jac[2][0] is None and jac[2][1] is None and jac[2][2] is None
+    
+    #The derivatives of b are set to 0 in the else clause
+    if_stmt = [stmt for stmt in stmts if isinstance(stmt, NodeIfStmt)][0]
+    else_clause = if_stmt.clauses[1]
+    targets = set([id(stmt.target) for stmt in else_clause.statements 
+                   if isinstance(stmt, NodeAssignment)])
+    assert id(diff.deriv_vars[(b, x)]) in targets
+    assert id(diff.deriv_vars[(b, y)]) in targets
+    for stmt in else_clause.statements[1:]:
+        assert stmt.expression is SymbolicDifferentiator.ZERO
+
+
+
+def test_CommonSubexpressionEliminator_1(): #IGNORE:C01111
+    msg = '''Test common subexpression elimination. Repeated expressions
+    are computed once in temporary variables; assignments change the 
+    value of expressions; clauses of "if" statements are separate.'''
+    #skip_test(msg)
+    print msg
+    
+    from freeode.optimizer import (CommonSubexpressionEliminator, 
+                                   optimize_simulation_objects)
+    from freeode.interpreter import Interpreter
+    from freeode.ast import (NodeAssignment, NodeIfStmt, 
+                             RoleTemporaryVariable)
+    from freeode.util import DotName
+
+    prog_text = \
+'''
+class A:
+    data p1: Float param
+    data x, y, a, b, c, e: Float
+    
+    func dynamic(this): 
+        e = x
+        a = p1 * (e - y) + sin(e - y) 
+        b = p1 * (e - y)
+        e = 2
+        c = e - y
+        if a > 1 and b * 2 > 1:
+            $x = (a + b) * b * 2
+            $y = (a + b) * 3
+        else:
+            $x = b * 2 
+            $y = a
+        
+compile A
+'''
+
+    #interpret the program
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, None, 'test')
+    sim = intp.get_compiled_objects()[0]
+    optimize_simulation_objects([sim])
+    dynamic = sim.get_attribute(DotName('dynamic'))
+    
+    temps = [stmt for stmt in dynamic.statements 
+             if isinstance(stmt, NodeAssignment) and 
+                isinstance(stmt.target.__siml_role__, type) and
+                issubclass(stmt.target.__siml_role__, RoleTemporaryVariable)]
+    #"e - y" and "p1 * (e - y)" are computed once; "e" is changed before 
+    #"c = e - y"
+    assert len(dynamic.statements) == 8
+    assert len(temps) == 2
+    assert [t.target.target_name for t in temps] == ['_cse1', '_cse2']
+    assert temps[0] is dynamic.statements[1]
+    assert temps[1] is dynamic.statements[2]
+    #the temporary variables replace the expressions
+    assert dynamic.statements[4].expression is temps[1].target
+    #the right operand of "and" is not searched (b * 2)
+    if_stmt = dynamic.statements[7]
+    assert isinstance(if_stmt, NodeIfStmt)
+    #clauses are optimized separately: "(a + b)" in first clause
+    assert len(if_stmt.clauses[0].statements) == 3
+    assert len(if_stmt.clauses[1].statements) == 2
+    #the data flow decorations were updated
+    assert temps[0].target in dynamic.outputs
+    
+    #Expressions without repetitions are not changed
+    cse = CommonSubexpressionEliminator()
+    stmts = if_stmt.clauses[1].statements
+    assert cse.eliminate_statement_list(stmts)[0].expression \
+           is stmts[0].expression
+           
+           
+           
+def test_ParameterExpressionHoister_1(): #IGNORE:C01111
+    msg = '''Test moving expressions that depend only on parameters out of
+    the dynamic function. Products are reordered; identical expressions 
+    share one hidden parameter; clauses of "if" statements are not 
+    changed; excluded parameters are not moved.'''
+    #skip_test(msg)
+    print msg
+    
+    from freeode.optimizer import ParameterExpressionHoister
+    from freeode.pygenerator import ExpressionGenerator
+    from freeode.interpreter import Interpreter, CodeGeneratorObject
+    from freeode.util import DotName
+
+    prog_text = \
+'''
+class A:
+    data k, m, c: Float param
+    data x, v, a: Float
+    
+    func dynamic(this): 
+        a = -k / m * x - c * v / m
+        if x > k / m:
+            $x = v * k * m
+        else:
+            $x = v
+        $v = a + sin(k / m) + c / m
+        
+compile A
+'''
+
+    #interpret the program
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, None, 'test')
+    sim = intp.get_compiled_objects()[0]
+    #the code generator would create the names
+    for name, attr in sim.attributes.iteritems():
+        if isinstance(attr, CodeGeneratorObject):
+            attr.target_name = str(name)
+    ParameterExpressionHoister().hoist_simulation_object(sim)
+    dynamic = sim.get_attribute(DotName('dynamic'))
+    e_gen = ExpressionGenerator()
+    expr_str = lambda expr: e_gen.create_expression(expr)
+    
+    derived = sim.derived_parameters
+    print [(d.target.target_name, expr_str(d.expression)) for d in derived]
+    assert [expr_str(d.expression) for d in derived] == \
+           ['(-k) / m', 'c / m', 'k / m', 'sin(k / m, )']
+    assert derived[0].target.target_name == 'param._derived1'
+    #products are reordered
+    assert expr_str(dynamic.statements[0].expression) == \
+           'x * param._derived1 - v * param._derived2'
+    #the if statement's condition is changed, the clauses are not
+    if_stmt = dynamic.statements[1]
+    assert expr_str(if_stmt.clauses[0].condition) == 'x > param._derived3'
+    assert expr_str(if_stmt.clauses[0].statements[0].expression) == \
+           'v * k * m'
+    #identical expressions are computed once
+    assert expr_str(dynamic.statements[2].expression) == \
+           'a + param._derived4 + param._derived2'
+    
+    #excluded parameters are not moved 
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, None, 'test')
+    sim = intp.get_compiled_objects()[0]
+    for name, attr in sim.attributes.iteritems():
+        if isinstance(attr, CodeGeneratorObject):
+            attr.target_name = str(name)
+    k = sim.get_attribute(DotName('k'))
+    ParameterExpressionHoister([k]).hoist_simulation_object(sim)
+    assert [expr_str(d.expression) for d in sim.derived_parameters] == \
+           ['c / m']
+           
+           
+           
+def test_DeadStatementEliminator_1(): #IGNORE:C01111
+    msg = '''Test removing the statements, that compute only algebraic 
+    variables, from the statements that compute the time derivatives.'''
+    #skip_test(msg)
+    print msg
+    
+    from freeode.optimizer import DeadStatementEliminator
+    from freeode.interpreter import Interpreter
+    from freeode.ast import NodeIfStmt
+    from freeode.util import DotName
+
+    prog_text = \
+'''
+class A:
+    data k: Float param
+    data x, v, a, b, c, e, sty: Float
+    
+    func dynamic(this): 
+        a = k * x
+        b = a + 1
+        sty = b * x
+        c = 0
+        if x > v:
+            e = 2 * a
+            c = sty
+        else:
+            e = 3
+        $x = v
+        $v = -a - e
+        
+compile A
+'''
+
+    #interpret the program
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, None, 'test')
+    sim = intp.get_compiled_objects()[0]
+    dynamic = sim.get_attribute(DotName('dynamic'))
+    x_dt = sim.get_attribute(DotName('x$time'))
+    v_dt = sim.get_attribute(DotName('v$time'))
+    stmts = dynamic.statements
+    
+    rhs_stmts = DeadStatementEliminator().eliminate_statement_list(
+                                                    stmts, [x_dt, v_dt])
+    #"b", "sty", "c" are not needed
+    assert len(rhs_stmts) == 4
+    assert rhs_stmts[0] is stmts[0]
+    if_stmt = rhs_stmts[1]
+    assert isinstance(if_stmt, NodeIfStmt)
+    assert len(if_stmt.clauses[0].statements) == 1
+    assert if_stmt.clauses[1].statements is stmts[4].clauses[1].statements
+    assert rhs_stmts[2:] == stmts[5:]
+    #the original statements are not changed
+    assert len(stmts) == 7
+    assert len(stmts[4].clauses[0].statements) == 2
+    #nothing is removed: the original list is returned
+    assert DeadStatementEliminator().eliminate_statement_list(
+                                                rhs_stmts, [x_dt, v_dt]) \
+           is rhs_stmts
+           
+           
+           
 if __name__ == '__main__':
     # Debugging code may go here.
     test_VariableUsageChecker_1()
@@ -258,6 +258,8 @@ compile A
     a.simulateDynamic()
     x_vals = a.getResults()['x']
     assert abs(x_vals[-1] - 30) < 1e-6
+    #the time series of each variable is contiguous
+    assert a.resultArray.flags.f_contiguous and x_vals.flags.c_contiguous
     
     #clean up
     os.remove(progname + '.py')
@@ -499,6 +501,1485 @@ compile A
 
 
 
+def test_ProgramGenerator__simulate_ensemble():
+    msg = \
+    ''' 
+    Test the vectorized ensemble simulation: The generated method 
+    dynamic_ensemble(...) computes many simulation runs at once.
+    Compare the results with individual runs of simulateDynamic().
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class A:
+    data x, y: Float 
+    data v: Float
+    data k, lim: Float param
+
+    func initialize(this):
+        k = 1
+        lim = 1.5
+        x = 1
+        y = 0
+        solution_parameters(duration = 5, reporting_interval = 0.5)
+        
+    func init_xy(this, x0, y0):
+        k = 1
+        lim = 1.5
+        x = x0
+        y = y0
+        solution_parameters(duration = 5, reporting_interval = 0.5)
+        
+    func dynamic(this):
+        v = min(x, lim)
+        if x > lim and not time > 3:
+            $x = -k * x
+            if y < 0.5:
+                $y = 2
+            else:
+                $y = 1
+        elif time > 4 or x < 0.5:
+            $x = -0.1
+            $y = -0.5 * y
+        else:
+            $x = -0.5 * k * v
+            $y = 0.1 * max(x, y)
+        print("dynamic: ", x)
+        
+compile A
+'''
+    
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__simulate_ensemble'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #Simulate several runs at once
+    init_vals = [(1, 0), (0.2, 3), (2, 0.1), (1.6, 1)]
+    k_vals = [1, 0.5, 2, 1.2]
+    a = module.A()
+    a.initialize()
+    res = a.simulateEnsemble(
+                param_sets=[{'k':k} for k in k_vals],
+                init_sets=[{'x':x0, 'y':y0} for x0, y0 in init_vals])
+    n_times = len(a.time)
+    assert res.shape == (4, n_times, 4)
+    assert a.getEnsembleAttribute('x').shape == (4, n_times)
+    #Simulate the runs individually and compare the results
+    for i in range(4):
+        b = module.A()
+        b.init_xy(*init_vals[i])
+        b.param.k = k_vals[i]
+        b.simulateDynamic()
+        for name in ['x', 'y', 'v']:
+            err = np_abs(a.getEnsembleAttribute(name)[i, 1:] 
+                         - b.getAttribute(name)[1:]).max()
+            assert err < 1e-3
+    #Algebraic variables are also computed for the initial values
+    assert (a.getEnsembleAttribute('time')[0] == 0)
+    assert (a.getEnsembleAttribute('v')[:, 0] == [1, 0.2, 1.5, 1.5]).all()
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+
+def test_ProgramGenerator__jacobian():
+    msg = \
+    ''' 
+    Test the generated jacobian(...) method. Compare its results with 
+    Jacobian matrices that are computed with finite differences.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import array, zeros, abs as np_abs
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class A:
+    data x, y, z: Float 
+    data v, w: Float
+    data k: Float param
+
+    func initialize(this):
+        k = 0.7
+        x = 1; y = 2; z = 0.5
+        solution_parameters(duration = 0.2, reporting_interval = 0.1)
+        
+    func dynamic(this):
+        v = min(x, k * y) + abs(z - y)
+        if x > y:
+            w = x**2 / y - exp(-z) 
+        elif z < 1:
+            w = sqrt(x) * log(y) + x % 0.3
+        else:
+            w = k
+        $x = -k * v + sin(x) * cos(y)
+        $y = w * tan(z) - max(z, 0.5) ** y
+        $z = -z + time
+        
+compile A
+'''
+    
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__jacobian'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    a = module.A()
+    a.initialize()
+    #states: x, y, z; test all branches of the "if" statement
+    for state in [array([1.2, 0.8, 0.3]), array([0.65, 1.1, 0.4]), 
+                  array([0.65, 1.1, 1.4])]:
+        jac = a.jacobian(0.5, state)
+        jac_fd = zeros((3, 3))
+        for j in range(3):
+            h = 1e-6
+            state_p, state_m = state.copy(), state.copy()
+            state_p[j] += h; state_m[j] -= h
+            jac_fd[:, j] = (a.dynamic(0.5, state_p) - 
+                            a.dynamic(0.5, state_m)) / (2 * h)
+        assert np_abs(jac - jac_fd).max() < 1e-6
+    #the Jacobian is used by the solver
+    a.simulateDynamic()
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+
+def test_ProgramGenerator__jacobian_sparsity():
+    msg = \
+    ''' 
+    Test the sparsity pattern of the Jacobian, and the sparse solver that 
+    uses it. The model is a chain of coupled oscillators.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    n_osc = 30
+    prog_text = \
+'''
+class Oscillator:
+    data x, v, F: Float 
+    data c: Float param
+    
+    func dynamic(this):
+        $x = v
+        $v = -c * x - 0.1 * v + F
+
+class Chain:
+    data %s: Oscillator
+    
+    func initialize(this):
+%s
+        solution_parameters(duration = 10, reporting_interval = 1)
+        
+    func dynamic(this):
+        o0.F = 0
+%s
+%s
+        
+compile Chain
+''' % (', '.join(['o%d' % i for i in range(n_osc)]),
+       '\n'.join(['        o%d.c = %d; o%d.x = 1; o%d.v = 0' % (i, i+1, i, i) 
+                  for i in range(n_osc)]),
+       '\n'.join(['        o%d.F = o%d.x - o%d.x' % (i, i-1, i) 
+                  for i in range(1, n_osc)]),
+       '\n'.join(['        o%d.dynamic()' % i for i in range(n_osc)]))
+    
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__jacobian_sparsity'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    a = module.Chain()
+    a.initialize()
+    #Test the sparsity pattern: it must contain the Jacobian's structure
+    pattern = a.jacobianSparsity.toarray()
+    assert pattern.shape == (2 * n_osc, 2 * n_osc)
+    #$x = v; $v = f(x, v, x of previous oscillator)
+    assert pattern.sum() == n_osc + 2 * n_osc + (n_osc - 1)
+    jac = a.jacobian(0, a.initialValues)
+    assert (jac[pattern == 0] == 0).all()
+    
+    #Simulate with sparse solver and with the regular solver
+    a.simulateDynamic()
+    res_sparse = a.resultArray.copy()
+    b = module.Chain()
+    b.sparseSolverMinSize = 1000000
+    b.initialize()
+    b.simulateDynamic()
+    assert np_abs(res_sparse - b.resultArray).max() < 1e-3
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__solver_selection():
+    msg = \
+    ''' 
+    Test selecting the ODE solver with solution_parameters(method=...), 
+    and overriding it on the command line. All solvers must compute 
+    the same result.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from subprocess import Popen, PIPE
+    from numpy import abs as np_abs, exp
+    import freeode.simulatorbase as simulatorbase
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class A:
+    data x: Float 
+    data k: Float param
+    
+    func initialize(this):
+        x = 1; k = 0.5
+        solution_parameters(4, 1, method = "dopri5", rtol = 1e-8)
+        
+    func dynamic(this):
+        $x = -k * x
+        
+    func final(this):
+        print(x)
+        
+compile A
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__solver_selection'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #the method from the Siml program is stored
+    a = module.A()
+    a.initialize()
+    assert a.solver_method == 'dopri5'
+    assert a.rtol == 1e-8
+    #every registered solver computes the correct result
+    #(except "verlet", which needs a separable system)
+    for name in simulatorbase.SOLVERS.keys():
+        if name == 'verlet':
+            continue
+        a = module.A()
+        a.initialize()
+        a.set_solution_parameters(method=name, step=0.01)
+        a.simulateDynamic()
+        x_exact = exp(-0.5 * a.getAttribute('time'))
+        assert np_abs(a.getAttribute('x') - x_exact).max() < 1e-5, name
+    #unknown solvers are rejected, names are case insensitive
+    assert simulatorbase.findSolver('rk45') is simulatorbase.SOLVERS['RK45']
+    try:
+        simulatorbase.findSolver('foo')
+    except ValueError:
+        pass
+    else:
+        assert False, 'findSolver must raise ValueError'
+    
+    #override the solver on the command line
+    proc = Popen(['python', progname + '.py', '-r', '0', '--no-graphs', 
+                  '--solver=RK45', '--rtol=1e-9'], stdout=PIPE)
+    output = proc.communicate()[0]
+    assert proc.returncode == 0
+    assert '%.4f' % exp(-2) in output
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__numpy_solvers():
+    msg = \
+    ''' 
+    Test the ODE solvers that are written with Numpy: "rk4", "dopri45", 
+    "verlet". They compute ensembles directly on the array [variable, run].
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, cos, sqrt, log2
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.integrators import Verlet
+    
+    prog_text = \
+'''
+class A:
+    data x, v: Float 
+    data k: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 1
+        solution_parameters(10, 0.5, method = "rk4", step = 0.1)
+        
+    func dynamic(this):
+        $x = v
+        $v = -k * x
+        
+class B:
+    data x, v: Float 
+    
+    func initialize(this):
+        x = 1; v = 0
+        solution_parameters(10, 0.5, method = "verlet")
+        
+    func dynamic(this):
+        $x = v
+        $v = -x - 0.1 * v
+        
+compile A
+compile B
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__numpy_solvers'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    def error(sim):
+        x_exact = cos(sqrt(sim.param.k) * sim.getAttribute('time'))
+        return np_abs(sim.getAttribute('x') - x_exact).max()
+    
+    #the step size is taken from the Siml program
+    a = module.A()
+    a.initialize()
+    assert a.solver_method == 'rk4' and a.solver_step == 0.1
+    #order of convergence: rk4: 4, verlet: 2
+    for method, order in [('rk4', 4), ('verlet', 2)]:
+        errors = []
+        for step in [0.1, 0.05]:
+            a = module.A()
+            a.initialize()
+            a.set_solution_parameters(method=method, step=step)
+            a.simulateDynamic()
+            assert a.stats.steps_accepted == 100 * 0.1 / step
+            errors.append(error(a))
+        assert abs(log2(errors[0] / errors[1]) - order) < 0.2, method
+    #the step size control of dopri45 keeps the error small
+    a = module.A()
+    a.initialize()
+    a.set_solution_parameters(method='dopri45', rtol=1e-8, atol=1e-10)
+    a.simulateDynamic()
+    assert error(a) < 1e-6
+    assert a.stats.steps_accepted > 0 and a.stats.rhs_calls > 0
+    #verlet conserves energy
+    a = module.A()
+    a.initialize()
+    a.set_solution_parameters(duration=1000, reporting_interval=10,
+                              method='verlet', step=0.1)
+    a.simulateDynamic()
+    energy = a.getAttribute('x')**2 + a.getAttribute('v')**2
+    assert np_abs(energy - 1).max() < 0.01
+    #verlet rejects systems that are not separable
+    b = module.B()
+    b.initialize()
+    try:
+        b.simulateDynamic()
+    except ValueError:
+        pass
+    else:
+        assert False, 'Verlet must reject non separable system.'
+    assert (Verlet(lambda t, y: y[::-1] * [1, -1]).set_initial_value([1, 0])
+            .kickVars.tolist() in ([True, False], [False, True]))
+    
+    #ensembles are computed on the 2D array, results equal single runs
+    k_vals = [0.5, 1, 2, 4]
+    for method in ['rk4', 'dopri45', 'verlet']:
+        a = module.A()
+        a.initialize()
+        a.set_solution_parameters(method=method, step=0.05)
+        res = a.simulateEnsemble(param_sets=[{'k':k} for k in k_vals],
+                                 init_sets=[{'x':1} for k in k_vals])
+        assert res.shape == (4, 21, 3)
+        for i, k in enumerate(k_vals):
+            b = module.A()
+            b.initialize()
+            b.set_solution_parameters(method=method, step=0.05)
+            b.param.k = k
+            b.simulateDynamic()
+            err = np_abs(a.getEnsembleAttribute('x')[i] 
+                         - b.getAttribute('x')).max()
+            if method == 'dopri45':
+                #common step size of all runs
+                assert err < 1e-4, method
+            else:
+                assert err < 1e-12, method
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+
+def test_ProgramGenerator__common_subexpressions():
+    msg = \
+    ''' 
+    Test common subexpression elimination: the optimized program must 
+    compute the same results as the original program. This includes the 
+    vectorized methods (temporary variables in "if" statements), the 
+    Jacobian and the sensitivity equations.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, sin
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.optimizer import (check_simulation_objects, 
+                                   optimize_simulation_objects)
+    
+    prog_text = \
+'''
+class A:
+    data x, v, a: Float 
+    data k, d: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 2; d = 0.3
+        solution_parameters(5, 0.5, rtol = 1e-9, atol = 1e-12)
+        
+    func dynamic(this):
+        a = -k * (x - sin(time)) - d * v * abs(v)
+        if x - sin(time) > 0:
+            $x = v + 0.1 * (x - sin(time)) ** 2
+            $v = a - 0.1 * (x - sin(time)) ** 2
+        else:
+            $x = v
+            $v = a + k * (x - sin(time))
+        
+compile A
+'''
+    progname = 'testprog_ProgramGenerator__common_subexpressions'
+    modules = []
+    for optimize in [False, True]:
+        #interpret the compile time code
+        intp = Interpreter()
+        intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+        sims = intp.get_compiled_objects()
+        check_simulation_objects(sims)
+        if optimize:
+            optimize_simulation_objects(sims, sensitivity_params=['k'])
+        #create the output text
+        pg = ProgramGenerator(sensitivity_params=['k'])
+        pg.create_program('foo.siml', sims)
+        #print pg.get_buffer()
+        #write the buffer into a file, import the file as a module
+        #progname must be unique! otherwise race condition!
+        prog_text_file = open(progname + str(optimize) + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        modules.append(__import__(progname + str(optimize)))
+    module_orig, module_opt = modules
+    assert '_cse1' in open(progname + 'True.py').read()
+    
+    a, b = module_orig.A(), module_opt.A()
+    for sim in a, b:
+        sim.initialize()
+        sim.simulateDynamic()
+    assert np_abs(a.resultArray - b.resultArray).max() < 1e-12
+    #x - sin(time) changes its sign: both clauses were used
+    x_rel = b.getAttribute('x') - sin(b.getAttribute('time'))
+    assert x_rel.max() > 0 and x_rel.min() < 0
+    #the vectorized methods
+    ens_a = a.simulateEnsemble([{'k':1}, {'k':3}])
+    ens_b = b.simulateEnsemble([{'k':1}, {'k':3}])
+    assert np_abs(ens_a - ens_b).max() < 1e-12
+    assert np_abs(a.algebraic(a.time, a.resultArray[:, 0:4])
+                  - b.algebraic(b.time, b.resultArray[:, 0:4])).max() < 1e-12
+    #the Jacobian
+    y = a.resultArray[3, 0:4]
+    assert np_abs(a.jacobian(1.5, y) - b.jacobian(1.5, y)).max() < 1e-12
+    
+    #clean up
+    for optimize in [False, True]:
+        os.remove(progname + str(optimize) + '.py')
+        os.remove(progname + str(optimize) + '.pyc')
+
+
+
+def test_ProgramGenerator__derived_parameters():
+    msg = \
+    ''' 
+    Test moving expressions, that depend only on parameters, out of the 
+    dynamic function. The hidden parameters must be recomputed when 
+    parameters are changed after initialize, also for simulateEnsemble.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, array
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.optimizer import (check_simulation_objects, 
+                                   optimize_simulation_objects)
+    
+    prog_text = \
+'''
+class A:
+    data x, v, a: Float 
+    data k, m, d, fMax, fMin, ramp: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 2; m = 3; d = 0.3
+        fMax = 2; fMin = 0.5; ramp = 10
+        solution_parameters(5, 0.5, rtol = 1e-9, atol = 1e-12)
+        
+    func dynamic(this):
+        a = -k / m * x - d * v / m
+        $x = v
+        $v = a + sin(time * (fMax - fMin) / ramp)
+        
+compile A
+'''
+    progname = 'testprog_ProgramGenerator__derived_parameters'
+    modules = []
+    for optimize in [False, True]:
+        #interpret the compile time code
+        intp = Interpreter()
+        intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+        sims = intp.get_compiled_objects()
+        check_simulation_objects(sims)
+        if optimize:
+            optimize_simulation_objects(sims)
+        #create the output text
+        pg = ProgramGenerator()
+        pg.create_program('foo.siml', sims)
+        #print pg.get_buffer()
+        #write the buffer into a file, import the file as a module
+        #progname must be unique! otherwise race condition!
+        prog_text_file = open(progname + str(optimize) + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        modules.append(__import__(progname + str(optimize)))
+    module_orig, module_opt = modules
+    assert 'param._derived3' in open(progname + 'True.py').read()
+    
+    a, b = module_orig.A(), module_opt.A()
+    for sim in a, b:
+        sim.initialize()
+        sim.simulateDynamic()
+    #products are reordered, the results differ slightly
+    assert np_abs(a.resultArray - b.resultArray).max() < 1e-8
+    #parameters are changed after initialize
+    for sim in a, b:
+        sim.param.m = 1
+        sim.simulateDynamic()
+    assert np_abs(a.resultArray - b.resultArray).max() < 1e-8
+    assert b.param._derived1 == -2
+    #the vectorized method
+    ens_a = a.simulateEnsemble([{'m':2}, {'ramp':5}])
+    ens_b = b.simulateEnsemble([{'m':2}, {'ramp':5}])
+    assert np_abs(ens_a - ens_b).max() < 1e-8
+    #the public methods see changes of the parameters without simulation
+    y = array([1., 0.5])
+    for sim in a, b:
+        sim.param.m = 4
+    assert np_abs(a.dynamic(0, y) - b.dynamic(0, y)).max() < 1e-12
+    assert np_abs(a.jacobian(0, y) - b.jacobian(0, y)).max() < 1e-12
+    assert np_abs(a.dynamic(0, y, returnAlgVars=True) -
+                  b.dynamic(0, y, returnAlgVars=True)).max() < 1e-12
+    assert np_abs(a.algebraic(array([0., 1.]), array([y, y])) -
+                  b.algebraic(array([0., 1.]), array([y, y]))).max() < 1e-12
+
+    #clean up
+    for optimize in [False, True]:
+        os.remove(progname + str(optimize) + '.py')
+        os.remove(progname + str(optimize) + '.pyc')
+
+
+
+def test_ProgramGenerator__specialize():
+    msg = \
+    ''' 
+    Test parameter specialization: the parameters are constants in the 
+    function that is called by the solver. The results must be the same, 
+    changes of the parameters must be seen.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.util import assert_raises
+    
+    prog_text = \
+'''
+class A:
+    data x, v, a: Float 
+    data k, d: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 2; d = 0.3
+        solution_parameters(5, 0.5)
+        
+    func dynamic(this):
+        a = -k * x - d * v
+        $x = v
+        $v = a
+        
+compile A
+'''
+    progname = 'testprog_ProgramGenerator__specialize'
+    modules = []
+    for specialize in [False, True]:
+        intp = Interpreter()
+        intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+        sims = intp.get_compiled_objects()
+        pg = ProgramGenerator(specialize=specialize)
+        pg.create_program('foo.siml', sims)
+        #print pg.get_buffer()
+        #progname must be unique! otherwise race condition!
+        prog_text_file = open(progname + str(specialize) + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        modules.append(__import__(progname + str(specialize)))
+    module_orig, module_spec = modules
+    
+    a, b = module_orig.A(), module_spec.A()
+    assert a.rhsSource is None and b.rhsSource is not None
+    for sim in a, b:
+        sim.initialize()
+        sim.simulateDynamic()
+    assert np_abs(a.resultArray - b.resultArray).max() < 1e-12
+    #the solver gets a function, with constant parameters
+    rhs = b.rhsFunction()
+    assert rhs is not b.dynamic
+    assert rhs.func_code.co_names.count('param') == 0
+    assert b.rhsFunction() is rhs
+    #parameters are changed
+    for sim in a, b:
+        sim.param.k = 5
+        sim.simulateDynamic()
+    assert np_abs(a.resultArray - b.resultArray).max() < 1e-12
+    assert b.rhsFunction() is not rhs
+    #switch off specialization
+    b.specialize(False)
+    assert b.rhsFunction() == b.dynamic
+    #classes without source code can not be specialized
+    assert_raises(ValueError, None, a.specialize)
+    
+    #clean up
+    for specialize in [False, True]:
+        os.remove(progname + str(specialize) + '.py')
+        os.remove(progname + str(specialize) + '.pyc')
+
+
+
+def test_ProgramGenerator__algebraic():
+    msg = \
+    ''' 
+    Test the vectorized method that computes the algebraic variables 
+    for all points in time at once. It must compute the same values as 
+    the dynamic method.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, array
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class A:
+    data x, v, F, E: Float 
+    data k: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 2
+        solution_parameters(10, 0.1)
+        
+    func dynamic(this):
+        if x > 0:
+            F = -k * x
+        else:
+            F = -0.5 * k * x
+        E = 0.5 * v**2 + 0.5 * k * x**2 + sin(time)
+        $x = v
+        $v = F
+        
+compile A
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__algebraic'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    a = module.A()
+    a.initialize()
+    a.simulateDynamic()
+    n_state = a.stateVectorLen
+    #compute the algebraic variables with the dynamic method
+    alg_ref = array([a.dynamic(t, a.resultArray[i, :n_state], True) 
+                     for i, t in enumerate(a.time)])
+    assert alg_ref.shape == a.resultArray[:, n_state:].shape
+    assert np_abs(alg_ref - a.resultArray[:, n_state:]).max() < 1e-12
+    #the "if" statement was really taken in both directions
+    F = a.getAttribute('F')
+    assert (F > 0).any() and (F < 0).any()
+    
+    #without the vectorized method the results are the same
+    b = module.A()
+    b.algebraic = None
+    b.simulateDynamic()
+    assert np_abs(b.resultArray - a.resultArray).max() < 1e-12
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__buffer_rhs():
+    msg = \
+    ''' 
+    Test the dynamic method that writes into a preallocated buffer. 
+    Compare it with the regular dynamic method, and report the number 
+    of calls per second for both variants (micro benchmark).
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    import time
+    from numpy import abs as np_abs, zeros
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class Damper:
+    data x, v, F, E: Float 
+    data k, d, m: Float param
+    
+    func initialize(this):
+        x = 1; v = 0
+        k = 2; d = 0.1; m = 1.5
+        solution_parameters(20, 0.1)
+        
+    func dynamic(this):
+        if x > 0:
+            F = -k * x - d * v
+        else:
+            F = -0.5 * k * x - d * v
+        E = 0.5 * m * v**2 + 0.5 * k * x**2
+        $x = v
+        $v = F / m + 0.1 * sin(time)
+        
+compile Damper
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    
+    #Create one program for each variant of the dynamic method
+    modules = {}
+    for buffer_rhs in [False, True]:
+        pg = ProgramGenerator(buffer_rhs=buffer_rhs)
+        pg.create_program('foo.siml', intp.get_compiled_objects())
+        #print pg.get_buffer()
+        #progname must be unique! otherwise race condition!
+        progname = 'testprog_ProgramGenerator__buffer_rhs_%d' % buffer_rhs
+        prog_text_file = open(progname + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        modules[buffer_rhs] = __import__(progname)
+        
+    sims = {}
+    for buffer_rhs, module in modules.iteritems():
+        sim = module.Damper()
+        sim.initialize()
+        sims[buffer_rhs] = sim
+        assert sim.rhsBuffered == buffer_rhs
+    #The buffer is filled and returned
+    out = zeros(2, 'float64')
+    y = sims[False].initialValues
+    assert sims[True].dynamic(0.5, y, out) is out
+    assert np_abs(out - sims[False].dynamic(0.5, y)).max() == 0
+    
+    #Micro benchmark: calls of the right hand side per second
+    n_calls = 10000
+    for buffer_rhs, sim in sims.iteritems():
+        rhs = sim.rhsFunction()
+        t_start = time.time()
+        for _ in xrange(n_calls):
+            rhs(0.5, y)
+        duration = time.time() - t_start
+        print 'buffer_rhs = %s: %.0f RHS calls per second' \
+              % (buffer_rhs, n_calls / max(duration, 1e-9))
+    
+    #Both variants compute the same simulation results
+    for sim in sims.itervalues():
+        sim.simulateDynamic()
+    assert np_abs(sims[True].resultArray - 
+                  sims[False].resultArray).max() < 1e-12
+    
+    #clean up
+    for buffer_rhs in [False, True]:
+        progname = 'testprog_ProgramGenerator__buffer_rhs_%d' % buffer_rhs
+        os.remove(progname + '.py')
+        os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__record_to_file():
+    msg = \
+    ''' 
+    Test writing the simulation results to disk while they are computed.
+    The results must be the same as the results that are kept in memory.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, memmap
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class A:
+    data x, v, E: Float 
+    data k: Float param
+    
+    func initialize(this):
+        x = 1; v = 0; k = 2
+        solution_parameters(10, 0.1)
+        
+    func dynamic(this):
+        E = 0.5 * v**2 + 0.5 * k * x**2
+        $x = v
+        $v = -k * x
+        
+compile A
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__record_to_file'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #Results in memory
+    a = module.A()
+    a.simulateDynamic()
+    #Results on disk. The chunk size does not divide the number of rows.
+    rec_file_name = progname + '.bin'
+    b = module.A()
+    b.recordToFile(rec_file_name, chunk_size=7)
+    b.simulateDynamic()
+    assert isinstance(b.resultArray, memmap)
+    assert b.resultArray.shape == a.resultArray.shape
+    assert np_abs(b.resultArray - a.resultArray).max() < 1e-12
+    assert np_abs(b.getAttribute('time') - a.getAttribute('time')).max() == 0
+    assert np_abs(b.getAttribute('E') - a.getAttribute('E')).max() < 1e-12
+    res = b.getResults()
+    assert np_abs(res['x'] - a.getAttribute('x')).max() < 1e-12
+    #getResults does not load the recorded results into memory
+    assert isinstance(res.block, memmap)
+    assert not res.block.flags.owndata
+    assert not res['x'].flags.owndata
+    #results in memory are not copied either
+    assert a.getResults().block is a.resultBlock
+    #The file has one column per variable, and time
+    assert os.path.getsize(rec_file_name) == \
+           8 * a.resultArray.shape[0] * (a.resultArray.shape[1] + 1)
+    
+    #clean up
+    del b, res
+    os.remove(rec_file_name)
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__steady_state():
+    msg = \
+    ''' 
+    Test the steady state solver and parameter sweeps with steady state 
+    solutions. The model is a chemostat, with a known analytic solution.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, linspace, array
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class Chemostat:
+    data S, X, mu: Float 
+    data mu_max, Ks, Yxs, Sf, D: Float param
+    
+    func initialize(this):
+        S = 0.2; X = 9
+        mu_max = 0.32; Ks = 0.01; Yxs = 0.5; Sf = 20; D = 0.3
+        
+    func dynamic(this):
+        mu = mu_max * S / (S + Ks)
+        $X = mu * X - D * X
+        $S = -1/Yxs * mu * X + D * (Sf - S)
+        
+compile Chemostat
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__steady_state'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    def analytic_solution(D):
+        '''Steady state of the chemostat: S, X, mu'''
+        S = 0.01 * D / (0.32 - D)
+        return S, 0.5 * (20 - S), D
+    
+    #Single steady state solution
+    a = module.Chemostat()
+    a.initialize()
+    a.clear()
+    assert a.simulateSteadyState()
+    assert a.resultArray.shape == (1, 4)
+    S, X, mu = analytic_solution(0.3)
+    assert abs(a.getAttribute('S')[0] - S) < 1e-9
+    assert abs(a.getAttribute('X')[0] - X) < 1e-9
+    assert abs(a.getAttribute('mu')[0] - mu) < 1e-9
+    #The next solution is appended
+    a.param.D = 0.28
+    assert a.simulateSteadyState()
+    assert a.resultArray.shape == (2, 4)
+    assert abs(a.getAttribute('S')[1] - analytic_solution(0.28)[0]) < 1e-9
+    assert list(a.getAttribute('time')) == [0, 1]
+    
+    #Sweep: operating curve
+    values = linspace(0.3, 0.02, 29)
+    res = a.steadyStateSweep('D', values)
+    assert res.shape == (29, 4)
+    assert (a.getAttribute('time') == values).all()
+    S, X, mu = array([analytic_solution(D) for D in values]).T
+    assert np_abs(a.getAttribute('S') - S).max() < 1e-9
+    assert np_abs(a.getAttribute('X') - X).max() < 1e-9
+    assert np_abs(a.getAttribute('mu') - mu).max() < 1e-9
+    #The parameter has its original value
+    assert a.param.D == 0.28
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__sweep():
+    msg = \
+    ''' 
+    Test parameter sweeps with several worker processes. The results must 
+    be the same as the results of single simulations.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, isnan
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.storage import EnsembleStore
+    
+    prog_text = \
+'''
+class Growth:
+    data x, y: Float 
+    data r, k: Float param
+    
+    func initialize(this):
+        x = 1; y = 0; r = 0.5; k = 10
+        solution_parameters(10, 1)
+        
+    func init_duration(this, duration, r_in):
+        x = 1; y = 0; r = r_in; k = 10
+        solution_parameters(duration, 1)
+        
+    func dynamic(this):
+        y = x * 2
+        $x = r * x * (1 - x / k)
+        
+compile Growth
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__sweep'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #Grid of parameters and initial values, all combinations are computed
+    sim = module.Growth()
+    res = sim.sweep({'r':[0.5, 1, 2], 'x':[1, 2]}, workers=2)
+    assert isinstance(res, EnsembleStore)
+    assert res.numRuns() == 6
+    assert res['x'].shape == (6, 11)
+    assert len(res.combinations) == 6
+    for i_run, combination in enumerate(res.combinations):
+        #compute the same simulation alone
+        single = module.Growth()
+        single.initialize()
+        single.param.r = combination['r']
+        single.initialValues[single.variableNameMap['x']] = combination['x']
+        single.simulateDynamic()
+        assert np_abs(res['x'][i_run] - single.getAttribute('x')).max() < 1e-12
+        assert np_abs(res['y'][i_run] - single.getAttribute('y')).max() < 1e-12
+        assert res['r'][i_run] == combination['r']
+        assert res['k'][i_run] == 10
+        
+    #Initialization functions with arguments; runs with different duration
+    res = sim.sweep([{'init_duration':(5, 1)}, {'init_duration':(10, 2)}], 
+                    workers=1)
+    assert res['time'].shape == (2, 11)
+    assert isnan(res['time'][0, 6:]).all()
+    assert list(res['r']) == [1, 2]
+    run0 = res.run(0)
+    assert len(run0['time']) == 6 and run0['time'][-1] == 5
+    single = module.Growth()
+    single.init_duration(5, 1)
+    single.simulateDynamic()
+    assert np_abs(run0['x'] - single.getAttribute('x')).max() < 1e-12
+    #The simulation object itself is unchanged
+    assert sim.resultArray is None
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__sensitivity():
+    msg = \
+    ''' 
+    Test the forward sensitivity equations. The model is exponential 
+    growth, where the sensitivities are known analytically:
+    x = x0 * exp(r*t); dx/dr = t * x; dx/dx0 = exp(r*t)
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, exp
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    from freeode.optimizer import (check_simulation_objects, 
+                                   optimize_simulation_objects)
+    from freeode.util import UserException
+    
+    prog_text = \
+'''
+class Growth:
+    data x, y: Float 
+    data r, x0, k: Float param
+    
+    func initialize(this):
+        r = 0.3; x0 = 2; k = 5
+        x = x0
+        y = k
+        solution_parameters(2, 0.5)
+        
+    func dynamic(this):
+        $x = r * x
+        $y = 0
+        
+compile Growth
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    sims = intp.get_compiled_objects()
+    
+    for buffer_rhs in [False, True]:
+        #create the output text
+        pg = ProgramGenerator(buffer_rhs, ['r', 'x0'])
+        pg.create_program('foo.siml', sims)
+        #print pg.get_buffer()
+        
+        #write the buffer into a file, import the file as a module
+        #progname must be unique! otherwise race condition!
+        progname = 'testprog_ProgramGenerator__sensitivity_%d' % buffer_rhs
+        prog_text_file = open(progname + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        module = __import__(progname)
+        
+        a = module.Growth()
+        a.initialize()
+        #initial values of the sensitivities come from initialize
+        assert list(a.initialValues) == [2, 5, 0, 1, 0, 0]
+        a.rtol = a.atol = 1e-10
+        a.simulateDynamic()
+        t = a.getAttribute('time')
+        x = 2 * exp(0.3 * t)
+        assert np_abs(a.getAttribute('x') - x).max() < 1e-7
+        assert np_abs(a.getSensitivity('x', 'r') - t * x).max() < 1e-7
+        assert np_abs(a.getSensitivity('x', 'x0') - x / 2).max() < 1e-7
+        assert np_abs(a.getSensitivity('y', 'r')).max() == 0
+        #The Jacobian covers the sensitivity equations too
+        jac = a.jacobian(0, a.initialValues)
+        assert jac.shape == (6, 6)
+        assert jac[2, 2] == 0.3 and jac[2, 0] == 1
+        
+        #clean up
+        os.remove(progname + '.py')
+        os.remove(progname + '.pyc')
+
+    #Parameters that are computed from the sensitivity parameter,
+    #in initialize and in an other initialization function:
+    #x = x0 * exp(k*t); k = 2*r: dx/dr = 2 * t * x; k = r: dx/dr = t * x
+    prog_text = \
+'''
+class Derived:
+    data x: Float
+    data r, x0, k, m: Float param
+
+    func initialize(this):
+        r = 0.3; x0 = 2; m = 1
+        k = 2 * r
+        x = x0
+        solution_parameters(2, 0.5)
+
+    func init_slow(this, rate):
+        r = rate; x0 = 2; m = 1
+        k = r
+        x = x0
+
+    func dynamic(this):
+        $x = k / m * x
+
+compile Derived
+'''
+    for buffer_rhs, optimize in [(False, False), (True, False), (False, True)]:
+        intp = Interpreter()
+        intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+        sims = intp.get_compiled_objects()
+        check_simulation_objects(sims)
+        if optimize:
+            optimize_simulation_objects(sims, ['r'])
+        pg = ProgramGenerator(buffer_rhs, ['r'])
+        pg.create_program('foo.siml', sims)
+        #print pg.get_buffer()
+        progname = 'testprog_ProgramGenerator__sensitivity_derived_%d_%d' \
+                   % (buffer_rhs, optimize)
+        prog_text_file = open(progname + '.py','w')
+        prog_text_file.write(pg.get_buffer())
+        prog_text_file.close()
+        module = __import__(progname)
+
+        a = module.Derived()
+        a.initialize()
+        a.rtol = a.atol = 1e-10
+        a.simulateDynamic()
+        t = a.getAttribute('time')
+        x = 2 * exp(0.6 * t)
+        assert np_abs(a.getAttribute('x') - x).max() < 1e-7
+        assert np_abs(a.getSensitivity('x', 'r') - 2 * t * x).max() < 1e-6
+        assert abs(a.getSensitivity('x', 'r')[-1] - 26.56) < 0.01
+        a.init_slow(0.3)
+        a.simulateDynamic()
+        x = 2 * exp(0.3 * t)
+        assert np_abs(a.getSensitivity('x', 'r') - t * x).max() < 1e-6
+
+        os.remove(progname + '.py')
+        os.remove(progname + '.pyc')
+
+    #Unknown parameter names are an error
+    pg = ProgramGenerator(False, ['r', 'foo'])
+    try:
+        pg.create_program('foo.siml', sims)
+    except UserException, err:
+        print 'Caught expected exception:', err
+    else:
+        assert False, 'Exception expected'
+
+
+def test_ProgramGenerator__continue_dynamic():
+    msg = \
+    ''' 
+    Test continuing a dynamic simulation, and resuming it from a 
+    checkpoint.
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from numpy import abs as np_abs, exp
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class Growth:
+    data x, y: Float 
+    data r: Float param
+    
+    func initialize(this):
+        r = 0.3
+        x = 1
+        solution_parameters(2, 0.5)
+        
+    func dynamic(this):
+        $x = r * x
+        y = 2 * x
+        
+compile Growth
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__continue_dynamic'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #Continue a simulation with a different parameter value
+    a = module.Growth()
+    a.initialize()
+    a.rtol = a.atol = 1e-10
+    a.simulateDynamic()
+    a.param.r = -0.1
+    a.continueDynamic(1)
+    assert list(a.getAttribute('time')) == [0, 0.5, 1, 1.5, 2, 2.5, 3]
+    assert a.resultArray.shape == (7, 3)
+    x2 = exp(0.3 * 2)
+    assert abs(a.getAttribute('x')[4] - x2) < 1e-7
+    assert abs(a.getAttribute('x')[6] - x2 * exp(-0.1)) < 1e-7
+    assert np_abs(a.getAttribute('y') - 2 * a.getAttribute('x')).max() == 0
+    
+    #Write checkpoints, resume from the last checkpoint
+    ckpt_name = progname + '.ckpt'
+    b = module.Growth()
+    b.initialize()
+    b.rtol = b.atol = 1e-10
+    b.simulation_time = 5
+    b.checkpointToFile(ckpt_name, [1, 2.2])
+    b.simulateDynamic()
+    c = module.Growth()
+    c.loadCheckpoint(ckpt_name)
+    assert c.time[-1] == 2.5 and c.resultArray.shape == (6, 3)
+    assert c.simulation_time == 5 and c.rtol == 1e-10
+    c.continueDynamic()
+    assert (c.time == b.time).all()
+    assert np_abs(c.resultArray - b.resultArray).max() < 1e-7
+    
+    #clean up
+    os.remove(ckpt_name)
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+def test_ProgramGenerator__stats():
+    msg = \
+    ''' 
+    Test the statistics of dynamic simulations: SimulatorBase.stats
+    '''
+    #skip_test(msg)
+    print msg
+    
+    import os
+    from freeode.pygenerator import ProgramGenerator
+    from freeode.interpreter import Interpreter
+    
+    prog_text = \
+'''
+class Growth:
+    data x, y: Float 
+    data r: Float param
+    
+    func initialize(this):
+        r = 0.3
+        x = 1
+        solution_parameters(2, 0.5)
+        
+    func dynamic(this):
+        $x = r * x
+        y = 2 * x
+        
+compile Growth
+'''
+    #interpret the compile time code
+    intp = Interpreter()
+    intp.interpret_module_string(prog_text, 'foo.siml', '__main__')
+    #create the output text
+    pg = ProgramGenerator()
+    pg.create_program('foo.siml', intp.get_compiled_objects())
+    #print pg.get_buffer()
+    
+    #write the buffer into a file, import the file as a module
+    #progname must be unique! otherwise race condition!
+    progname = 'testprog_ProgramGenerator__stats'
+    prog_text_file = open(progname + '.py','w')
+    prog_text_file.write(pg.get_buffer())
+    prog_text_file.close()
+    module = __import__(progname)
+    
+    #Solver that reports its counters: vode
+    a = module.Growth()
+    a.simulateDynamic()
+    stats = a.stats
+    print stats
+    assert stats.rhs_calls > 0 and stats.steps_accepted > 0
+    assert stats.steps_rejected is not None
+    assert abs(stats.step_mean * stats.steps_accepted - 2) < 1e-12
+    assert stats.time_initialize > 0 and stats.time_integrate > 0
+    assert stats.time_algebraic > 0 and stats.time_final > 0
+    #The default solver is vode's Adams method with functional iteration, 
+    #the Jacobian is only used when a stiff solver is selected
+    assert a.jacobian is not None and stats.jac_calls == 0
+    a.solver_method = 'vode_bdf'
+    a.simulateDynamic(run_final=False)
+    assert a.stats.jac_calls > 0
+    #Solver with exact step sizes: RK45
+    a.solver_method = 'RK45'
+    a.simulateDynamic(run_final=False)
+    stats = a.stats
+    print stats
+    assert stats.rhs_calls > 0 and stats.steps_accepted > 0
+    assert 0 < stats.step_min <= stats.step_mean <= stats.step_max
+    #initialize was not called again
+    assert stats.time_initialize == 0 and stats.time_final == 0
+    #Solver where the calls are counted: dopri5
+    a.solver_method = 'dopri5'
+    a.continueDynamic(1)
+    print a.stats
+    assert a.stats.rhs_calls > 0 and a.stats.steps_accepted is None
+    
+    #clean up
+    os.remove(progname + '.py')
+    os.remove(progname + '.pyc')
+
+
+
 if __name__ == '__main__':
     # Debugging code may go here.
     test_ProgramGenerator__all_variables_visible()
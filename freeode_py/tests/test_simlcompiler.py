@@ -119,6 +119,118 @@ compile RunTest
     
   
 
+def test_do_compile__up_to_date(): #IGNORE:C01111
+    msg = '''Test do_compile: The output file is not written again,
+    if it was created from the same input with the same options.'''
+#    skip_test(msg)
+    print msg
+    
+    import os
+    from freeode.simlcompiler import SimlCompilerMain
+    
+    prog_text = \
+'''
+class A:
+    data x: Float
+
+    func dynamic(this):
+        $x = 1
+
+    func initialize(this):
+        x = 0
+        solution_parameters(2, 1)
+        
+compile A
+'''
+    base_name = 'testprog_SimlCompilerMain_up_to_date'
+    prog_text_file = open(base_name + '.siml','w')
+    prog_text_file.write(prog_text)
+    prog_text_file.close()
+    
+    def compile_and_mark(**options):
+        '''Compile, and append a comment to the output file. 
+        Return True if the program was compiled.'''
+        main = SimlCompilerMain()
+        main.input_file_name =  base_name + '.siml'
+        main.output_file_name = base_name + '.py'
+        for name, value in options.iteritems():
+            setattr(main, name, value)
+        main.do_compile()
+        prog_file = open(base_name + '.py', 'r+')
+        compiled = not prog_file.read().endswith('#mark\n')
+        prog_file.write('#mark\n')
+        prog_file.close()
+        return compiled
+    
+    assert compile_and_mark() == True
+    assert compile_and_mark() == False
+    #different options, different program, or forced compilation
+    assert compile_and_mark(specialize=True) == True
+    assert compile_and_mark(specialize=True) == False
+    assert compile_and_mark(specialize=True, force=True) == True
+    prog_text_file = open(base_name + '.siml','a')
+    prog_text_file.write('#a comment\n')
+    prog_text_file.close()
+    assert compile_and_mark(specialize=True) == True
+
+    #clean up
+    os.remove(base_name + '.siml')
+    os.remove(base_name + '.py')
+
+
+
+def test_compile_string(): #IGNORE:C01111
+    msg = '''Test compile_string: Compile a program and load it as a module,
+    in the current process, without writing files.'''
+#    skip_test(msg)
+    print msg
+    
+    import sys
+    import freeode
+    from freeode.util import UserException
+    
+    prog_text = \
+'''
+class A:
+    data x: Float
+    data k: Float param
+
+    func dynamic(this):
+        $x = -k * x
+
+    func initialize(this):
+        x = 1; k = 0.5
+        solution_parameters(2, 1)
+        
+class B:
+    data y: Float
+
+    func dynamic(this):
+        $y = 1
+
+    func initialize(this):
+        y = 0
+        solution_parameters(3, 1)
+        
+compile A
+compile B
+'''
+    module = freeode.compile_string(prog_text, 'foo.siml')
+    assert sys.modules[module.__name__] is module
+    assert [cls.__name__ for cls in module.simulationClasses] == ['A', 'B']
+    sim_a = module.A()
+    sim_a.simulateDynamic()
+    assert abs(sim_a.getAttribute('x')[-1] - 0.3679) < 0.001
+    #options of the code generator; unique module names
+    module2 = freeode.compile_string(prog_text, 'foo.siml', specialize=True)
+    assert module2.__name__ != module.__name__
+    assert module2.A.rhsSource is not None
+    #errors in the Siml program
+    assert_raises(UserException, None, freeode.compile_string, 
+                  'class A:\n    data x: Float\n\ncompile C\n')
+    
+  
+
 if __name__ == '__main__':
     # Debugging code may go here.
     #test_expression_evaluation_1()
@@ -40,11 +40,12 @@ figure() #create new figure window
 r1_vals = linspace(0.5, 3, 10)
 max_i = len(r1_vals)-1
 
-#do simulations with the different parameter values, plot results
+#do simulations with the different parameter values, on all processor cores.
+#Use alternative initialization function to supply parameter
+results = model.sweep({'init_r1': [(r1,) for r1 in r1_vals]})
+#plot results
 for i, r1 in enumerate(r1_vals):
-    model.init_r1(r1)         #Use alternative initialization function to supply parameter
-    model.simulateDynamic()   #solve ODE
-    res = model.getResults()  #get results as a storage.DictStore object
+    res = results.run(i)      #get results as a storage.DictStore object
     color_tuple = cm.jet(i/max_i)
     label_str = 'r1=%g' % r1 #create descriptive string
     plot(res['time'], res['m.N1'], label='N1: '+label_str, color=color_tuple, linestyle='-')
@@ -66,11 +67,12 @@ figure() #create new figure window
 r1_vals = linspace(0.3, 5, 10)
 max_i = len(r1_vals)-1
 
-#do simulations with the different parameter values, plot results
+#do simulations with the different parameter values, on all processor cores.
+#Use alternative initialization function to supply parameter
+results = model.sweep({'init_r1': [(r1,) for r1 in r1_vals]})
+#plot results
 for i, r1 in enumerate(r1_vals):
-    model.init_r1(r1)         #Use alternative initialization function to supply parameter
-    model.simulateDynamic()   #solve ODE
-    res = model.getResults()  #get results as a storage.DictStore object
+    res = results.run(i)      #get results as a storage.DictStore object
     color_tuple = cm.jet(i/max_i)
     label_str = 'r1=%g' % r1 #create descriptive string
     plot(res['time'], res['m.N1'], label='N1: '+label_str, color=color_tuple, linestyle='-')
@@ -3,15 +3,6 @@
 #    eike.welk@gmx.net                                                     
 
 
-
-##############################################################################
-#                           CURENTLY NOT PORTED                              #
-#                                                                            #
-#       THE NECESSARY SIML PROGRAM WOULD BE TOO COMPLEX FOR THE PARSER       #
-##############################################################################
-
-
-
 #Lotka and Volterra's model of competition of two species. (Not Predator-Prey)
 #
 #                   --- Create phase plane diagrams ---
@@ -38,6 +29,22 @@ from competition import Case1, Case2, Case3, Case4
 
 lsp = linspace
 
+
+def plot_phase_plane(mo, initN1, initN2):
+    '''
+    Simulate the model with many initial values at once (ensemble 
+    simulation), and plot the trajectories into the current figure.
+    '''
+    mo.initialize() #compute the parameters
+    init_sets = [{'m.N1':n1, 'm.N2':n2} for n1, n2 in zip(initN1, initN2)]
+    mo.simulateEnsemble(init_sets=init_sets) #solve ODE for all initial values
+    N1 = mo.getEnsembleAttribute('m.N1')     #array: [run, time]
+    N2 = mo.getEnsembleAttribute('m.N2')
+    for i in range(len(initN1)):
+        labelStr = 'N1=%g, N2=%g' % (initN1[i], initN2[i]) #create descriptive string
+        plot(N1[i], N2[i], label=labelStr)                  #plot the solution
+
+
 #Case 1 ----------------------------------------------
 #Create phase plane plot.
 #TODO: quiver plot
@@ -47,15 +54,9 @@ figure() #create new figure window
 initN1 = hstack((lsp(0.2, 4, 4),  lsp(0.1, 0.1, 4),lsp(0.1, 12, 6),lsp(12, 12, 6)  ))
 initN2 = hstack((lsp(0.1, 0.1, 4),lsp(0.1, 1, 4), lsp(12, 12, 6),  lsp(0.1, 12, 6) ))
 
-#do simulations with the different initial values, and put the results into a
-#phase-plane plot
-for i in range(len(initN1)):
-    #initialize the simulation object, with new initial values
-    mo.initialize(N1_init=initN1[i], N2_init=initN2[i], showGraph=0)
-    mo.simulateDynamic()   #solve ODE
-    res = mo.getResults()  #get results as a storage.DictStore object
-    labelStr = 'N1=%g, N2=%g' % (initN1[i], initN2[i]) #create descriptive string
-    plot(res['m.N1'], res['m.N2'], label=labelStr)       #plot the solution
+#do all simulations with the different initial values at once, 
+#and put the results into a phase-plane plot
+plot_phase_plane(mo, initN1, initN2)
 
 #finishing touches on plot
 xlabel('N1 (species 1)')
@@ -72,15 +73,9 @@ figure() #create new figure window
 initN1 = hstack((lsp(0.1, 1, 3),  lsp(0.1, 0.1, 6),lsp(0.1, 12, 6),lsp(12, 12, 6)  ))
 initN2 = hstack((lsp(0.1, 0.1, 3),lsp(0.2, 12, 6), lsp(12, 12, 6), lsp(0.1, 12, 6) ))
 
-#do simulations with the different initial values, and put the results into a
-#phase-plane plot
-for i in range(len(initN1)):
-    #initialize the simulation object, with new initial values
-    mo.initialize(N1_init=initN1[i], N2_init=initN2[i], showGraph=0)
-    mo.simulateDynamic()   #solve ODE
-    res = mo.getResults()  #get results as a storage.DictStore object
-    labelStr = 'N1=%g, N2=%g' % (initN1[i], initN2[i]) #create descriptive string
-    plot(res['m.N1'], res['m.N2'], label=labelStr)       #plot the solution
+#do all simulations with the different initial values at once, 
+#and put the results into a phase-plane plot
+plot_phase_plane(mo, initN1, initN2)
 
 #finishing touches on plot
 xlabel('N1 (species 1)')
@@ -97,15 +92,9 @@ figure() #create new figure window
 initN1 = hstack((array([0.1, 12]),lsp(0.11, 0.5, 4),lsp(0.1, 0.1, 4), lsp(0.1, 11.1, 6),lsp(12, 12, 6)  ))
 initN2 = hstack((array([0.1, 12]),lsp(0.1, 0.1, 4), lsp(0.11, 0.5, 4),lsp(12, 12, 6),   lsp(0.1, 11.1, 6) ))
 
-#do simulations with the different initial values, and put the results into a
-#phase-plane plot
-for i in range(len(initN1)):
-    #initialize the simulation object, with new initial values
-    mo.initialize(N1_init=initN1[i], N2_init=initN2[i], showGraph=0)
-    mo.simulateDynamic()   #solve ODE
-    res = mo.getResults()  #get results as a storage.DictStore object
-    labelStr = 'N1=%g, N2=%g' % (initN1[i], initN2[i]) #create descriptive string
-    plot(res['m.N1'], res['m.N2'], label=labelStr)       #plot the solution
+#do all simulations with the different initial values at once, 
+#and put the results into a phase-plane plot
+plot_phase_plane(mo, initN1, initN2)
 
 #finishing touches on plot
 xlabel('N1 (species 1)')
@@ -122,15 +111,9 @@ figure() #create new figure window
 initN1 = hstack((array([0.1, 12]),lsp(0.2, 4, 6),  lsp(0.1, 0.1, 6),lsp(0.1, 11, 6),lsp(12, 12, 6)  ))
 initN2 = hstack((array([0.1, 12]),lsp(0.1, 0.1, 6),lsp(0.2, 4, 6),  lsp(12, 12, 6), lsp(0.1, 11, 6) ))
 
-#do simulations with the different initial values, and put the results into a
-#phase-plane plot
-for i in range(len(initN1)):
-    #initialize the simulation object, with new initial values
-    mo.initialize(N1_init=initN1[i], N2_init=initN2[i], showGraph=0)
-    mo.simulateDynamic()   #solve ODE
-    res = mo.getResults()  #get results as a storage.DictStore object
-    labelStr = 'N1=%g, N2=%g' % (initN1[i], initN2[i]) #create descriptive string
-    plot(res['m.N1'], res['m.N2'], label=labelStr)       #plot the solution
+#do all simulations with the different initial values at once, 
+#and put the results into a phase-plane plot
+plot_phase_plane(mo, initN1, initN2)
 
 #finishing touches on plot
 xlabel('N1 (species 1)')
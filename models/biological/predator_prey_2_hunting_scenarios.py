@@ -40,27 +40,31 @@ def compute_scenario(hunting_rate_x, hunting_rate_y, duration):
     figure() #create new figure window
     max_i = len(duration)-1
 
-    x, y = 1, 0.1
-    cum_duration = 0
+    #first simulation starts with x=1, y=0.1
+    model.init_hunting(hunting_rate_x[0], hunting_rate_y[0], 1, 0.1, 
+                       duration[0])
+    model.simulateDynamic()   #solve ODE
+    i_start = 0
     #do simulations with the different parameter values, plot results
     for i in range(len(duration)):
-        model.init_hunting(hunting_rate_x[i], hunting_rate_y[i], x, y, duration[i])
-        model.simulateDynamic()   #solve ODE
+        if i > 0:
+            #continue simulation with state values from previous simulation
+            model.param.Hx = hunting_rate_x[i]
+            model.param.Hy = hunting_rate_y[i]
+            model.continueDynamic(duration[i])
         res = model.getResults()  #get results as a storage.DictStore object
         color_tuple = cm.jet(i/max_i)
         #label_str = 'r1=%g' % r1 #create descriptive string
         label_str = 'hx: %g, hy: %g' % (hunting_rate_x[i], hunting_rate_y[i])
-        plot(res['time'] + cum_duration, res['x'],
+        #plot only the results of the current simulation
+        plot(res['time'][i_start:], res['x'][i_start:],
             label='x:     '+label_str, color=color_tuple, linestyle=':')
-        plot(res['time'] + cum_duration, res['y'],
+        plot(res['time'][i_start:], res['y'][i_start:],
             label='y: ', color=color_tuple, linestyle='--')
-        plot(res['time'] + cum_duration, res['hunting_yield'],
+        plot(res['time'][i_start:], res['hunting_yield'][i_start:],
             label='yield: ', color=color_tuple, linestyle='-')
-        #start next simulation with state values from previous simulation
-        x = res['x'][-1]
-        y = res['y'][-1]
-        #cumulative duration to put the simulation's plots after each other
-        cum_duration += duration[i]
+        #the next simulation starts at the last point in time
+        i_start = len(res['time']) - 1
 
 
     #finishing touches on plot
@@ -43,13 +43,13 @@ def compute_phase_diagram(hunting_rate_x, hunting_rate_y, duration, start_x, sta
     #max_i = len(duration)-1
     xmax, ymax = -1e100, -1e100
     xmin, ymin = 1e100, 1e100
-    #do simulations with the different parameter values,
-    #plot results into phase plane
+    #do simulations with the different parameter values, on all processor
+    #cores; plot results into phase plane
+    results = model.sweep([{'init_hunting': (hunting_rate_x, hunting_rate_y,
+                                             start_x[i], start_y[i], duration[i])}
+                           for i in range(len(duration))])
     for i in range(len(duration)):
-        model.init_hunting(hunting_rate_x, hunting_rate_y,
-                           start_x[i], start_y[i], duration[i])
-        model.simulateDynamic()   #solve ODE
-        res = model.getResults()  #get results as a storage.DictStore object
+        res = results.run(i)      #get results as a storage.DictStore object
         #color_tuple = cm.jet(i/max_i)
         plot(res['x'], res['y'], color='black', linestyle='-')
 
@@ -61,6 +61,8 @@ def compute_phase_diagram(hunting_rate_x, hunting_rate_y, duration, start_x, sta
 
     #Sample differentials at different points in phase plane,
     #plot field of arrows
+    model.init_hunting(hunting_rate_x, hunting_rate_y,
+                       start_x[0], start_y[0], duration[0])
     X, Y = mgrid[xmin:xmax:20j,ymin:ymax:20j]
     U, V = zeros(X.shape), zeros(X.shape)
     for i in range(X.shape[0]):